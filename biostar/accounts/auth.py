@@ -2,11 +2,14 @@ import logging
 from django.utils.encoding import force_bytes
 from django.utils.http import urlsafe_base64_encode
 from django.contrib import auth
+from django.core import signing
 from django.template import loader
 from django.conf import settings
+from django.urls import reverse
 
 
 from biostar.emailer.tasks import send_email
+from .const import UNSUBSCRIBE_TOKEN
 from .models import User, Profile
 from .tokens import account_verification_token
 
@@ -60,3 +63,20 @@ def send_verification_email(user):
 
     return True
 
+
+def unsubscribe_url(user_id):
+    """
+    Link that turns off the digest emails of a user without logging in.
+    """
+    token = signing.dumps(user_id, salt="unsubscribe")
+    url = reverse('unsubscribe', kwargs=dict(token=token))
+    return f"{settings.PROTOCOL}://{settings.SITE_DOMAIN}{url}"
+
+
+def edition_recipients(users):
+    """
+    Yields the (email, tokens) pairs used to deliver an edition to the users.
+    """
+    rows = users.values_list('id', 'email').iterator()
+    for user_id, email in rows:
+        yield email, {UNSUBSCRIBE_TOKEN: unsubscribe_url(user_id)}
@@ -5,3 +5,6 @@ PROJECT, RECIPES, POSTS = PROFILE_TABS
 ACTIVE_TAB = "active"
 MESSAGE_COUNT = 'message_count'
 
+
+# Placeholder in bulk emails replaced with the unsubscribe link of each recipient.
+UNSUBSCRIBE_TOKEN = '%UNSUBSCRIBE_URL%'
@@ -0,0 +1,39 @@
+# Generated by Django 3.2.12 on 2026-10-17 23:34
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def index_watched(apps, schema_editor):
+    Profile = apps.get_model('accounts', 'Profile')
+    WatchedTag = apps.get_model('accounts', 'WatchedTag')
+
+    # Build the inverted index from the watched tags of each profile.
+    profiles = Profile.objects.exclude(watched_tags='').values_list('user_id', 'watched_tags')
+    for user_id, watched in profiles.iterator():
+        names = {name.strip().lower() for name in watched.split(",")} - {''}
+        WatchedTag.objects.bulk_create([WatchedTag(name=name, user_id=user_id) for name in names])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('accounts', '0026_userlog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WatchedTag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(db_index=True, max_length=100)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('name', 'user')},
+            },
+        ),
+        migrations.RunPython(index_watched, migrations.RunPython.noop),
+    ]
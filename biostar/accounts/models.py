@@ -208,6 +208,9 @@ class Profile(models.Model):
         except Exception as exc:
             logger.error(f"recomputing watched tags={exc}")
 
+        # Keep the inverted index of the watched tags in sync.
+        WatchedTag.update(user_id=self.user_id, names=self.parse_tags())
+
     def set_upload_size(self):
         """
         Used to set the inital value
@@ -352,6 +355,42 @@ class UserLog(models.Model):
         super(UserLog, self).save(*args, **kwargs)
 
 
+class WatchedTag(models.Model):
+    """
+    Inverted index from a lowercase tag name to the users watching it.
+    """
+    name = models.CharField(max_length=100, db_index=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = ('name', 'user')
+
+    def __str__(self):
+        return f"{self.name} | {self.user_id}"
+
+    @classmethod
+    def update(cls, user_id, names):
+        """
+        Replaces the watched tags of a user, nothing is written when unchanged.
+        """
+        names = {name.strip().lower() for name in names} - {''}
+        current = set(cls.objects.filter(user_id=user_id).values_list('name', flat=True))
+        if names == current:
+            return
+
+        cls.objects.filter(user_id=user_id, name__in=current - names).delete()
+        cls.objects.bulk_create([cls(name=name, user_id=user_id) for name in names - current])
+
+    @classmethod
+    def watchers(cls, names):
+        """
+        The ids of the users watching any of the tags.
+        """
+        names = {name.strip().lower() for name in names}
+        ids = cls.objects.filter(name__in=names).values_list('user_id', flat=True)
+        return set(ids)
+
+
 def is_moderator(user):
     """
     Shortcut to identify moderators from users.
@@ -50,6 +50,12 @@ LOW_REP_THRESHOLD = 0
 # Users below this threshold are considered to have recently joined.
 RECENTLY_JOINED_DAYS = 30
 
+# Unsubscribe links sent in emails expire after this many seconds.
+UNSUBSCRIBE_LINK_AGE = 90 * 24 * 3600
+
+# Messages inserted per batch when notifying many users.
+MESSAGE_BATCH_SIZE = 500
+
 # In MB
 MAX_UPLOAD_SIZE = 10
 
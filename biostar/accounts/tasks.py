@@ -89,14 +89,32 @@ def verification_email(user_id):
     return
 
 
+def recipient_chunks(user_ids, size):
+    """
+    Yields the existing recipient ids in lists of up to size elements.
+    The user ids may be a list or a queryset of ids.
+    """
+    from biostar.accounts.models import User
+
+    ids = User.objects.filter(id__in=user_ids).order_by('id').values_list('id', flat=True)
+    last = 0
+    while True:
+        chunk = list(ids.filter(id__gt=last)[:size])
+        if not chunk:
+            return
+        last = chunk[-1]
+        yield chunk
+
+
 @task
 def create_messages(template, user_ids, sender=None, extra_context={}):
     """
     Create batch message from sender to a given recipient_list
     """
-    from biostar.accounts.models import User, Message, MessageBody
+    from django.db.models import F
+    from biostar.accounts.models import User, Message, MessageBody, Profile
+    from biostar.accounts.util import now
 
-    rec_list = User.objects.filter(id__in=user_ids)
     # Get the sender
     name, email = settings.ADMINS[0]
     sender = sender or User.objects.filter(email=email).first() or User.objects.filter(is_superuser=True).first()
@@ -111,5 +129,12 @@ def create_messages(template, user_ids, sender=None, extra_context={}):
     html = mistune.markdown(body, escape=False)
     body = MessageBody.objects.create(body=body, html=html)
 
-    for rec in rec_list:
-        Message.objects.create(sender=sender, recipient=rec, body=body)
+    # Every recipient shares the same body, the rows are inserted in batches.
+    size = settings.MESSAGE_BATCH_SIZE
+    sent_date = now()
+    for chunk in recipient_chunks(user_ids, size=size):
+        msgs = [Message(sender=sender, recipient_id=rec_id, body=body, sent_date=sent_date) for rec_id in chunk]
+        Message.objects.bulk_create(msgs, batch_size=size)
+
+        # Bulk inserts bypass the signals, count the unread messages here.
+        Profile.objects.filter(user_id__in=chunk).update(new_messages=F('new_messages') + 1)
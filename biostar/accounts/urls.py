@@ -26,6 +26,7 @@ account_patterns = [
 
     path(r'edit/profile/', views.edit_profile, name='edit_profile'),
     path(r'toggle/notify/', views.toggle_notify, name='toggle_notify'),
+    path(r'unsubscribe/<str:token>/', views.unsubscribe, name='unsubscribe'),
     path(r'logout/', views.user_logout, name="logout"),
 
     path(r'debug/user/', views.debug_user, name="debug_user"),
@@ -168,6 +168,25 @@ def toggle_notify(request):
     return redirect(reverse('user_profile', kwargs=dict(uid=user.profile.uid)))
 
 
+def unsubscribe(request, token):
+    "Turns off the digest and mailing list emails from the link sent in the email"
+
+    try:
+        user_id = signing.loads(token, salt="unsubscribe", max_age=settings.UNSUBSCRIBE_LINK_AGE)
+    except signing.BadSignature:
+        messages.error(request, "Invalid or expired unsubscribe link.")
+        return redirect("/")
+
+    # Links are opened by mail scanners too, only the confirmation changes the preference.
+    if request.method == "POST":
+        Profile.objects.filter(user_id=user_id).update(digest_prefs=Profile.NO_DIGEST)
+        messages.success(request, "You will no longer receive digest emails.")
+        return redirect("/")
+
+    context = dict(token=token)
+    return render(request, "accounts/unsubscribe.html", context=context)
+
+
 #@limited(key=RATELIMIT_KEY, rate=SIGNUP_RATE)
 def user_signup(request):
 
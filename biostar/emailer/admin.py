@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import EmailGroup,EmailSubscription
+from .models import EmailGroup, EmailSubscription, Edition
 
 admin.site.register(EmailGroup)
 admin.site.register(EmailSubscription)
+admin.site.register(Edition)
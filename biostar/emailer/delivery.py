@@ -0,0 +1,163 @@
+"""
+Delivers large numbers of emails over a pool of persistent connections.
+
+Messages are consumed from a generator, each worker thread keeps its own
+connection open and a shared limiter keeps the total send rate in check.
+Only connection failures and temporary (4xx) replies are retried.
+"""
+import logging
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.mail import get_connection
+
+logger = logging.getLogger("engine")
+
+
+def transient(exc):
+    """
+    Connection failures and 4xx replies may succeed when retried, other errors are final.
+    """
+    if isinstance(exc, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+        return True
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, msg in exc.recipients.values())
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return 400 <= exc.smtp_code < 500
+    if isinstance(exc, smtplib.SMTPException):
+        return False
+    return isinstance(exc, OSError)
+
+
+class RateLimiter:
+    """
+    Spaces out events so that no more than rate happen per second.
+    """
+
+    def __init__(self, rate=0):
+        self.lock = threading.Lock()
+        self.interval = 1.0 / rate if rate else 0
+        self.next = 0
+
+    def wait(self):
+        if not self.interval:
+            return
+
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next)
+            self.next = start + self.interval
+
+        delay = start - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Delivery:
+    """
+    Sends messages in parallel with retries and a limited send rate.
+    """
+
+    def __init__(self, workers=None, rate=None, retries=None, delay=None):
+        self.workers = workers or settings.EMAIL_WORKERS
+        self.limiter = RateLimiter(rate=settings.EMAIL_SEND_RATE if rate is None else rate)
+        self.retries = settings.EMAIL_RETRIES if retries is None else retries
+        self.delay = settings.EMAIL_RETRY_DELAY if delay is None else delay
+
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []
+        self.sent = 0
+        self.failed = []
+
+    def connection(self):
+        """
+        The connection of the current worker, opened on first use.
+        """
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = get_connection(fail_silently=False)
+            conn.open()
+            self.local.conn = conn
+            with self.lock:
+                self.connections.append(conn)
+        return conn
+
+    def reset(self):
+        """
+        Drops the connection of the current worker after an error.
+        """
+        conn = getattr(self.local, "conn", None)
+        self.local.conn = None
+        if conn is None:
+            return
+        with self.lock:
+            self.connections.remove(conn)
+        try:
+            conn.close()
+        except Exception as exc:
+            logger.error(f"closing connection: {exc}")
+
+    def deliver(self, msg):
+        """
+        Sends one message, retries transient errors with exponential backoff.
+        """
+        for attempt in range(self.retries + 1):
+            self.limiter.wait()
+            try:
+                conn = self.connection()
+                count = conn.send_messages([msg]) or 0
+                with self.lock:
+                    self.sent += count
+                return
+            except Exception as exc:
+                logger.error(f"delivery to={msg.to} attempt={attempt + 1} error: {exc}")
+                if not transient(exc):
+                    break
+                self.reset()
+                if attempt < self.retries:
+                    time.sleep(self.delay * 2 ** attempt)
+
+        with self.lock:
+            self.failed.extend(msg.to)
+
+    def send(self, messages):
+        """
+        Sends a stream of messages, returns the number of messages sent
+        and the recipients of the messages that could not be sent.
+        """
+        # Bounds the messages built ahead of the workers.
+        slots = threading.BoundedSemaphore(self.workers * 2)
+
+        def task(msg):
+            try:
+                self.deliver(msg)
+            finally:
+                slots.release()
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                for msg in messages:
+                    slots.acquire()
+                    pool.submit(task, msg)
+        finally:
+            for conn in list(self.connections):
+                conn.close()
+            self.connections = []
+
+        if self.failed:
+            logger.error(f"delivery failed for {len(self.failed)} recipients")
+
+        return self.sent, self.failed
+
+
+def deliver(messages, **kwargs):
+    """
+    Sends a stream of messages with a new delivery engine.
+    Returns the number of messages sent and the recipients that failed.
+    """
+    engine = Delivery(**kwargs)
+    return engine.send(messages)
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.12 on 2026-10-17 23:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emailer', '0002_remove'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Edition',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=256, unique=True)),
+                ('subject', models.CharField(default='', max_length=256)),
+                ('text', models.TextField(default='')),
+                ('html', models.TextField(default='')),
+                ('date', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+    ]
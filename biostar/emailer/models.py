@@ -50,3 +50,17 @@ class EmailSubscription(models.Model):
 
     def active(self):
         return self.state == self.ACTIVE
+
+
+class Edition(models.Model):
+    """
+    An email rendered once then sent to many recipients.
+    """
+    name = models.CharField(max_length=MAX_NAME_LEN, unique=True)
+    subject = models.CharField(max_length=MAX_NAME_LEN, default='')
+    text = models.TextField(default='')
+    html = models.TextField(default='')
+    date = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return self.name
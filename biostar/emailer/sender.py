@@ -1,13 +1,16 @@
 import logging
+import os
 import re
 import textwrap
 
-from django.core.mail import EmailMultiAlternatives
-from django.core.mail import send_mail, send_mass_mail, get_connection
+from django.core.mail import EmailMessage, EmailMultiAlternatives
+from django.core.mail import send_mail
 from django.template import Context, Template
 from django.template.loader import get_template
 from django.conf import settings
 
+from biostar.emailer import delivery
+
 logger = logging.getLogger("engine")
 
 # Pattern to extract named blocks from a django template.
@@ -57,7 +60,10 @@ class EmailTemplate(object):
 
     def __init__(self, name):
         self.template = get_template(name)
-        self.content = open(self.template.origin.name).read()
+        self.path = self.template.origin.name
+        self.mtime = os.path.getmtime(self.path)
+        with open(self.path) as stream:
+            self.content = stream.read()
         self.subj = get_block(self.content, "subject")
         self.text = get_block(self.content, "text")
         self.html = get_block(self.content, 'html')
@@ -111,8 +117,8 @@ class EmailTemplate(object):
         # Send mass html email
         if len(html) < 10:
             # Format mass mail
-            datatuple = ((subject, text, from_email, [rec]) for rec in recipient_list)
-            send_mass_mail(datatuple=datatuple, fail_silently=False)
+            messages = (EmailMessage(subject, text, from_email, [rec]) for rec in recipient_list)
+            delivery.deliver(messages)
         else:
             send_mass_html_mail(subject=subject,
                                 message=text,
@@ -121,25 +127,64 @@ class EmailTemplate(object):
                                 recipient_list=recipient_list)
 
 
-def send_mass_html_mail(subject, message, message_html, from_email, recipient_list):
+# Parsed email templates of the process keyed by template name.
+TEMPLATES = {}
+
+
+def email_template(name):
+    """
+    Returns the parsed email template, parsed again when the file changes.
     """
+    email = TEMPLATES.get(name)
+    try:
+        if email and os.path.getmtime(email.path) == email.mtime:
+            return email
+    except OSError:
+        pass
+
+    email = EmailTemplate(name)
+    TEMPLATES[name] = email
+    return email
 
+
+def send_mass_html_mail(subject, message, message_html, from_email, recipient_list):
+    """
+    Sends an individual HTML email to each recipient.
+    Returns the number of emails sent and the recipients that failed.
     """
-    connection = get_connection(fail_silently=False)
 
     def make_email(rec):
         msg = EmailMultiAlternatives(subject=subject,
                                      body=message,
                                      from_email=from_email,
-                                     to=[rec],
-                                     connection=connection)
+                                     to=[rec])
         msg.attach_alternative(message_html, "text/html")
         return msg
 
-    # Format mass mail
-    messages = list(map(make_email, recipient_list))
+    # The messages are built as the delivery consumes them.
+    messages = map(make_email, recipient_list)
+
+    return delivery.deliver(messages)
+
 
-    return connection.send_messages(messages)
+def fill_tokens(text, tokens):
+    """
+    Replaces the placeholders of a rendered email with the recipient specific values.
+    """
+    for key, value in tokens.items():
+        text = text.replace(key, value)
+    return text
+
+
+def edition_message(edition, from_email, email, tokens):
+    """
+    Assembles the email of a single recipient from a rendered edition.
+    """
+    text = fill_tokens(edition.text, tokens)
+    msg = EmailMultiAlternatives(subject=edition.subject, body=text, from_email=from_email, to=[email])
+    if len(edition.html) > 10:
+        msg.attach_alternative(fill_tokens(edition.html, tokens), "text/html")
+    return msg
 
 
 def send_html_mail(subject, message, message_html, from_email, recipient_list):
@@ -16,3 +16,18 @@ ROOT_URLCONF = 'biostar.emailer.urls'
 DATA_MIGRATION = False
 
 SEND_MAIL = True
+
+# Parallel connections used when delivering bulk emails.
+EMAIL_WORKERS = 4
+
+# Maximum number of emails sent per second, 0 for no limit (Amazon SES allows 14 by default).
+EMAIL_SEND_RATE = 14
+
+# Attempts repeated for an email that failed to send.
+EMAIL_RETRIES = 3
+
+# Seconds waited before the first retry, doubled on every attempt.
+EMAIL_RETRY_DELAY = 1
+
+# Editions older than this many days are deleted.
+EDITION_KEEP_DAYS = 7
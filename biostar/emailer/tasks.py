@@ -1,9 +1,12 @@
 import logging
 import os
+import textwrap
+from datetime import timedelta
 
 from django.conf import settings
+from django.utils import timezone
 
-from biostar.emailer import sender
+from biostar.emailer import sender, delivery
 
 logger = logging.getLogger("engine")
 
@@ -27,6 +30,75 @@ def send_all():
             logger.error(f"send_all() error: {exc}")
 
 
+def default_context(subject=""):
+    """
+    The context added to every email template.
+    """
+    port = f":{settings.HTTP_PORT}" if settings.HTTP_PORT else ""
+    context = dict(domain=settings.SITE_DOMAIN, protocol=settings.PROTOCOL,
+                   port=port, name=settings.SITE_NAME, subject=subject)
+    return context
+
+
+def build_edition(name, template_name, extra_context={}, subject=""):
+    """
+    Renders the template once into a stored edition, an existing edition is reused.
+    """
+    from biostar.emailer.models import Edition
+
+    edition = Edition.objects.filter(name=name).first()
+    if edition:
+        return edition
+
+    context = default_context(subject=subject)
+    context.update(extra_context)
+
+    email = sender.email_template(template_name)
+    subject, text, html = email.render(context)
+
+    # Text may be indented in template.
+    text = textwrap.dedent(text)
+
+    edition = Edition.objects.create(name=name, subject=subject, text=text, html=html)
+    return edition
+
+
+def prune_editions(days=None):
+    """
+    Deletes the editions older than the given number of days.
+    """
+    from biostar.emailer.models import Edition
+
+    days = settings.EDITION_KEEP_DAYS if days is None else days
+    since = timezone.now() - timedelta(days=days)
+    count, _ = Edition.objects.filter(date__lt=since).delete()
+    logger.info(f"deleted {count} editions older than {days} days")
+    return count
+
+
+def send_edition(edition, recipients, name="", from_email=None):
+    """
+    Sends an edition to each recipient in a stream of (email, tokens) pairs.
+    The tokens map the placeholders of the edition to the recipient specific values.
+    Returns the number of emails sent and the recipients that failed.
+    """
+    if not settings.SEND_MAIL or settings.DATA_MIGRATION:
+        return 0, []
+
+    # Final sender email
+    from_email = from_email or settings.DEFAULT_FROM_EMAIL
+    from_email = settings.FROM_EMAIL_PATTERN % (name, from_email)
+
+    # The messages are assembled as the delivery consumes them.
+    messages = (sender.edition_message(edition=edition, from_email=from_email, email=email, tokens=tokens)
+                for email, tokens in recipients)
+
+    sent, failed = delivery.deliver(messages)
+
+    logger.info(f"edition={edition.name} sent to {sent} recipients, failed for {len(failed)}")
+    return sent, failed
+
+
 def send_email(template_name, recipient_list, extra_context={}, name="", from_email=None, subject="Subject",
                mass=False):
     """
@@ -52,13 +124,10 @@ def send_email(template_name, recipient_list, extra_context={}, name="", from_em
         logger.info(f"sending email from={from_email} recipient_list={recipient_list} template={template_name}")
 
         # The email template instance
-        email = sender.EmailTemplate(template_name)
+        email = sender.email_template(template_name)
 
         # Default context added to each template.
-        port = f":{settings.HTTP_PORT}"if settings.HTTP_PORT else ""
-
-        context = dict(domain=settings.SITE_DOMAIN, protocol=settings.PROTOCOL,
-                       port=port, name=settings.SITE_NAME, subject=subject)
+        context = default_context(subject=subject)
 
         # Additional context added to the template.
         context.update(extra_context)
@@ -1,6 +1,10 @@
 import logging
-from django.core import management
-from biostar.emailer import tasks, auth
+import os
+import smtplib
+from django.core import mail, management
+from django.core.mail import EmailMessage
+from django.core.mail.backends.locmem import EmailBackend
+from biostar.emailer import tasks, auth, delivery
 from django.test import TestCase, override_settings
 from biostar.emailer import models
 
@@ -27,6 +31,21 @@ class SendMailTest(TestCase):
 
         self.assertTrue(successful, "Error sending mail")
 
+    def test_template_cache(self):
+        "Test the parsed templates reused until the file changes"
+        from biostar.emailer import sender
+
+        email = sender.email_template("test_email.html")
+        self.assertIs(sender.email_template("test_email.html"), email)
+
+        # A newer file is parsed again.
+        stat = os.stat(email.path)
+        try:
+            os.utime(email.path, (stat.st_atime, stat.st_mtime + 10))
+            self.assertIsNot(sender.email_template("test_email.html"), email)
+        finally:
+            os.utime(email.path, (stat.st_atime, stat.st_mtime))
+
     def test_add_subs(self):
         "Test adding subscription using auth"
 
@@ -39,6 +58,70 @@ class SendMailTest(TestCase):
         management.call_command('test_email')
 
 
+class FlakyBackend(EmailBackend):
+    """
+    Fails the first send to each recipient to exercise the retries, refuses some recipients.
+    """
+    attempts = []
+
+    def send_messages(self, messages):
+        to = messages[0].to[0]
+        if to.endswith("@lvh.me"):
+            FlakyBackend.attempts.append(to)
+            if to.startswith("refused"):
+                raise smtplib.SMTPRecipientsRefused({to: (550, b"No such user")})
+            if FlakyBackend.attempts.count(to) == 1:
+                raise ConnectionError("connection dropped")
+        return super().send_messages(messages)
+
+
+class DeliveryTest(TestCase):
+
+    def setUp(self):
+        logger.setLevel(logging.WARNING)
+
+    def test_delivery(self):
+        "Test sending a stream of messages in parallel"
+
+        messages = (EmailMessage("Hello", "Hello", "mailer@biostars.org", [f"{i}@lvh.me"]) for i in range(10))
+        sent, failed = delivery.deliver(messages, workers=3, rate=0)
+
+        self.assertEqual((sent, failed), (10, []))
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), sorted(f"{i}@lvh.me" for i in range(10)))
+
+    @override_settings(EMAIL_BACKEND="biostar.emailer.test.test_emailing.FlakyBackend")
+    def test_delivery_retry(self):
+        "Test the retries of failed sends"
+
+        FlakyBackend.attempts = []
+        messages = [EmailMessage("Hello", "Hello", "mailer@biostars.org", [f"{i}@lvh.me"]) for i in range(3)]
+        engine = delivery.Delivery(workers=1, rate=0, retries=1, delay=0)
+
+        self.assertEqual(engine.send(messages), (3, []))
+        self.assertEqual(len(FlakyBackend.attempts), 6)
+
+        # Every attempt fails without retries.
+        FlakyBackend.attempts = []
+        engine = delivery.Delivery(workers=1, rate=0, retries=0, delay=0)
+        self.assertEqual(engine.send(messages[:1]), (0, ["0@lvh.me"]))
+
+        # Refused recipients are not retried.
+        FlakyBackend.attempts = []
+        refused = EmailMessage("Hello", "Hello", "mailer@biostars.org", ["refused@lvh.me"])
+        engine = delivery.Delivery(workers=1, rate=0, retries=3, delay=0)
+        self.assertEqual(engine.send([refused]), (0, ["refused@lvh.me"]))
+        self.assertEqual(FlakyBackend.attempts, ["refused@lvh.me"])
+
+    def test_rate_limit(self):
+        "Test the spacing of the rate limiter"
+
+        limiter = delivery.RateLimiter(rate=100)
+        start = delivery.time.monotonic()
+        for i in range(5):
+            limiter.wait()
+        self.assertGreaterEqual(delivery.time.monotonic() - start, 0.04)
+
+
 @override_settings(SEND_MAIL=SEND_MAIL)
 class ModelTests(TestCase):
 
@@ -21,6 +21,7 @@ from whoosh.searching import Results
 
 from biostar.accounts.models import Profile, User
 from . import auth, util, forms, tasks, search, views, const, moderate
+from .autocomplete import TAGS
 from .models import Post, Vote, Subscription, delete_post_cache, SharedLink, Diff
 
 
@@ -399,6 +400,18 @@ def handle_search(request):
     return ajax_success(users=users, msg="Username searched")
 
 
+@ajax_error_wrapper(method="GET")
+def tag_search(request):
+    """
+    Used to autocomplete tags by prefix, the most used tags come first.
+    """
+    query = request.GET.get('query', '')
+
+    tags = [dict(name=name, count=count) for name, count in TAGS.search(query)]
+
+    return ajax_success(tags=tags, msg="Tags searched")
+
+
 @ajax_limited(key=RATELIMIT_KEY, rate=EDIT_RATE)
 @ajax_error_wrapper(method="GET")
 def inplace_form(request):
@@ -495,8 +508,8 @@ def similar_posts(request, uid):
 
     if results is None:
         logger.debug("Setting similar posts cache.")
-        # Do a more like this search on post
-        similar = search.more_like_this(uid=post.uid)
+        # Read the precomputed similar posts
+        similar = search.get_similar(uid=post.uid)
         # Render template with posts
         tmpl = loader.get_template(template_name)
         context = dict(results=similar)
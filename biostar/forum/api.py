@@ -10,8 +10,9 @@ from datetime import datetime, timedelta
 from django.http import HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from biostar.accounts.models import Profile, User
+from taggit.models import Tag
 from . import util
-from .models import Post, Vote, Subscription, PostView
+from .models import Post, Vote, Subscription, PostView, TagStat, tag_counts
 
 
 logger = logging.getLogger("engine")
@@ -314,28 +315,25 @@ def tags_list(request):
     # Convert months to weeks
     weeks = months * 4
 
-    delta = util.now() - timedelta(weeks=weeks)
-    query = Post.objects.filter(lastedit_date__gt=delta)
-
     # Iterate over tags and collect counts.
     lines = tags.readlines() if tags else []
+    names = [line.decode().lower().strip() for line in lines]
+    names = [name for name in dict.fromkeys(names) if name]
 
-    data = {}
-
-    for line in lines:
-        tag = line.decode().lower().strip()
-        if not tag:
-            continue
+    fields = ('recent', 'recent_answered', 'recent_commented')
 
-        # Get posts with this tag, that have been answered
-        posts = query.filter(tags__name=tag.lower(), is_toplevel=True)
-        uids = posts.values_list('uid', flat=True)
+    # The default window is read from the tag statistics.
+    if weeks == settings.TAG_RECENT_WEEKS:
+        stats = TagStat.objects.filter(tag__name__in=names).values_list('tag__name', *fields)
+    else:
+        delta = util.now() - timedelta(weeks=weeks)
+        stats = tag_counts(Tag.objects.filter(name__in=names), since=delta).values_list('name', *fields)
 
-        # Filter so the count is only 1 answer per questions
-        answer_count = Post.objects.filter(uid__in=uids, answer_count__gte=1).count()
-        comment_count = Post.objects.filter(uid__in=uids, comment_count__gte=1).count()
-        total = len(uids)
+    counts = {name: (total, answers, comments) for name, total, answers, comments in stats}
 
+    data = {}
+    for tag in names:
+        total, answer_count, comment_count = counts.get(tag, (0, 0, 0))
         val = dict(total=total, answer_count=answer_count, comment_count=comment_count)
         data.setdefault(tag, {}).update(val)
 
@@ -9,7 +9,7 @@ from django.contrib import messages
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
 from django.db import transaction
-from django.db.models import F, Q
+from django.db.models import F, Q, Count, Exists, OuterRef
 from django.template import loader
 from django.utils.safestring import mark_safe
 from django.conf import settings
@@ -20,31 +20,15 @@ from biostar.planet.models import BlogPost, Blog
 # Needed for historical reasons.
 from biostar.accounts.models import Profile
 from biostar.utils.helpers import get_ip
-from . import util, awards
+from . import util, tasks
 from .const import *
-from .models import Post, Vote, Subscription, Badge, delete_post_cache, Log, SharedLink, Diff
+from .models import Post, Vote, Subscription, Badge, delete_post_cache, Log, SharedLink, Diff, EventCount
 
 User = get_user_model()
 
 logger = logging.getLogger("engine")
 
 
-def get_votes(user, root):
-    store = {
-        Vote.BOOKMARK: set(),
-        Vote.UP: set()
-    }
-
-    # Collect all the votes for the user.
-    if user.is_authenticated:
-        votes = Vote.objects.filter(post__root=root, author=user).values_list("type", "post__id")
-
-        for vote_type, post_id, in votes:
-            store.setdefault(vote_type, set()).add(post_id)
-
-    return store
-
-
 def convert_html():
     """
     Converts html to text
@@ -306,9 +290,17 @@ def merge_profiles(main, alias):
     return
 
 
-def create_subscription(post, user, sub_type=None, update=False):
+def count_subscriptions(root):
+    """
+    Returns the number of subscriptions that receive messages from the thread.
+    """
+    return Subscription.objects.filter(post=root).exclude(type=Subscription.NO_MESSAGES).count()
+
+
+def create_subscription(post, user, sub_type=None, update=False, recount=True):
     """
     Creates subscription to a post. Returns a list of subscriptions.
+    The subscription count of the root is left to the caller when recount is False.
     """
     subs = Subscription.objects.filter(post=post.root, user=user)
     sub = subs.first()
@@ -333,10 +325,11 @@ def create_subscription(post, user, sub_type=None, update=False):
         Subscription.objects.create(post=post.root, user=user, type=sub_type)
 
     # Recompute subscription count
-    subs_count = Subscription.objects.filter(post=post.root).exclude(type=Subscription.NO_MESSAGES).count()
+    if recount:
+        subs_count = count_subscriptions(post.root)
 
-    # Update root subscription counts.
-    Post.objects.filter(pk=post.root.pk).update(subs_count=subs_count)
+        # Update root subscription counts.
+        Post.objects.filter(pk=post.root.pk).update(subs_count=subs_count)
 
     # Delete following cache
     delete_cache(FOLLOWING, user)
@@ -353,40 +346,56 @@ def post_tree(user, root):
     """
     Populates a tree that contains all posts in the thread.
 
+    The thread and the votes of the user are loaded in a single query,
+    the tree is assembled in memory.
+
     Answers sorted before comments.
     """
 
+    is_moderator = user.is_authenticated and user.profile.is_moderator
+
     # Get all posts that belong to post root.
-    query = Post.objects.valid_posts(u=user, root=root).exclude(pk=root.id)
+    query = Post.objects.filter(root=root).exclude(parent=None)
 
-    # Filter spam/deleted comments or answers.
-    if user.is_anonymous or not user.profile.is_moderator:
-        query = query.exclude(Q(status=Post.DELETED) | Q(spam=Post.SPAM))
+    # Moderators see every post, others only see open posts in open threads.
+    if not is_moderator:
+        if root.is_open:
+            query = query.filter(status=Post.OPEN).exclude(spam=Post.SPAM)
+        else:
+            query = query.filter(pk=root.pk)
 
-    query = query.select_related("lastedit_user__profile", "author__profile", "root__author__profile")
+    # Flag the posts the current user has voted on.
+    if user.is_authenticated:
+        votes = Vote.objects.filter(post=OuterRef('pk'), author=user)
+        query = query.annotate(has_bookmark=Exists(votes.filter(type=Vote.BOOKMARK)),
+                               has_upvote=Exists(votes.filter(type=Vote.UP)))
+
+    query = query.select_related("lastedit_user__profile", "author__profile")
 
     # Apply the sort order to all posts in thread.
-    thread = query.order_by("type", "-accept_count", "-vote_count", "creation_date")
+    query = query.order_by("type", "-accept_count", "-vote_count", "creation_date")
 
-    # Gather votes by the current user.
-    votes = get_votes(user=user, root=root)
+    posts = list(query)
 
-    # Shortcuts to each storage.
-    bookmarks, upvotes = votes[Vote.BOOKMARK], votes[Vote.UP]
+    # Separate the root from the rest of the thread.
+    root = next((post for post in posts if post.pk == root.pk), root)
+    thread = [post for post in posts if post.pk != root.pk]
 
     # Build comments tree.
     comment_tree = dict()
 
     def decorate(post):
         # Mutates the elements! Not worth creating copies.
+        # Every post in the thread shares the same root object.
+        post.root = root
         if post.is_comment:
             comment_tree.setdefault(post.parent_id, []).append(post)
-        post.has_bookmark = int(post.id in bookmarks)
-        post.has_upvote = int(post.id in upvotes)
+        post.has_bookmark = int(getattr(post, 'has_bookmark', False))
+        post.has_upvote = int(getattr(post, 'has_upvote', False))
         if user.is_authenticated:
-            post.can_accept = not post.is_toplevel and (user == post.root.author or user.profile.is_moderator)
-            post.can_moderate = user.profile.is_moderator
-            post.is_editable = (user == post.author or user.profile.is_moderator)
+            post.can_accept = not post.is_toplevel and (user == root.author or is_moderator)
+            post.can_moderate = is_moderator
+            post.is_editable = (user == post.author or is_moderator)
         else:
             post.can_accept = False
             post.is_editable = False
@@ -406,50 +415,30 @@ def post_tree(user, root):
     return root, comment_tree, answers, thread
 
 
-def valid_awards(user):
+def get_counts(user, counts=None, totals=None):
     """
-    Return list of valid awards for a given user
+    Adds the events since the previous update to the session counts, reading every total with one query.
+    The counts grow until the pages showing them reset them, unread messages are counted in the profile.
+    Returns the counts and the totals they were computed from.
     """
+    counts = dict(counts or {})
+    totals = dict(totals or {})
 
-    valid = []
-    # Randomly go from one badge to the other
-    for award in awards.ALL_AWARDS:
-
-        # Valid award targets the user has earned
-        targets = award.get_awards(user)
-
-        for target in targets:
-            post = target if isinstance(target, Post) else None
-            date = post.lastedit_date if post else user.profile.last_login
-            badge = Badge.objects.filter(name=award.name).first()
-
-            valid.append((user, badge, date, post))
+    names = {VOTES_COUNT: f"{VOTES_COUNT}-{user.id}", PLANET_COUNT: PLANET_COUNT,
+             SPAM_COUNT: SPAM_COUNT, MOD_COUNT: MOD_COUNT}
+    current = dict(EventCount.objects.filter(name__in=names.values()).values_list('name', 'value'))
 
-    return valid
+    for key, name in names.items():
+        value = current.get(name, 0)
 
+        # Sessions start counting from their first update.
+        last = totals.get(key, value)
+        counts[key] = counts.get(key, 0) + max(value - last, 0)
+        totals[key] = value
 
-def get_counts(user):
-    # The number of new messages since last visit.
-    message_count = Message.objects.filter(recipient=user, unread=True)[:1000].count()
+    counts[MESSAGE_COUNT] = user.profile.new_messages
 
-    # The number of new votes since last visit.
-    vote_count = Vote.objects.filter(post__author=user, date__gte=user.profile.last_login).exclude(
-        author=user)[:1000].count()
-
-    # Planet count since last visit
-    planet_count = BlogPost.objects.filter(rank__gte=user.profile.last_login)[:100].count()
-
-    # Spam count since last visit.
-    spam_count = Post.objects.filter(spam=Post.SPAM, creation_date__gte=user.profile.last_login)[:1000].count()
-
-    # Moderation actions since last visit.
-    mod_count = Log.objects.filter(date__gte=user.profile.last_login)[:100].count()
-
-    # Store the counts into the session.
-    counts = dict(mod_count=mod_count, spam_count=spam_count, planet_count=planet_count, message_count=message_count,
-                  vote_count=vote_count)
-
-    return counts
+    return counts, totals
 
 
 @transaction.atomic
@@ -469,28 +458,43 @@ def apply_vote(post, user, vote_type):
     if not post.author == user:
         Profile.objects.filter(user=post.author).update(score=F('score') + change)
 
-    # Calculate counts for the current post
-    votes = list(Vote.objects.filter(post=post))
-    vote_count = len(votes)
-    bookcount = len(list(filter(lambda v: v.type == Vote.BOOKMARK, votes)))
-    accept_count = len(list(filter(lambda v: v.type == Vote.ACCEPT, votes)))
+    # Calculate counts for the current post in a single query.
+    counts = Vote.objects.filter(post=post).aggregate(
+        vote_count=Count('id'),
+        book_count=Count('id', filter=Q(type=Vote.BOOKMARK)),
+        accept_count=Count('id', filter=Q(type=Vote.ACCEPT)),
+    )
 
-    # Increment the post vote count.
-    Post.objects.filter(uid=post.uid).update(vote_count=vote_count)
+    # Update the vote counts of the post.
+    post_fields = dict(vote_count=counts['vote_count'])
+    if vote_type == Vote.BOOKMARK:
+        post_fields['book_count'] = counts['book_count']
+    if vote_type == Vote.ACCEPT:
+        post_fields['accept_count'] = counts['accept_count']
 
-    # The thread vote count represents all votes in a thread
-    Post.objects.filter(uid=post.root.uid).update(thread_votecount=F('thread_votecount') + change)
+    Post.objects.filter(uid=post.uid).update(**post_fields)
 
-    # Increment the bookmark count.
-    if vote_type == Vote.BOOKMARK:
-        Post.objects.filter(uid=post.uid).update(book_count=bookcount)
-        # Reset bookmark cache
-        delete_cache(BOOKMARKS, user)
+    # The thread vote count represents all votes in a thread
+    root_fields = dict()
+    if settings.DEFER_THREAD_VOTES:
+        # A single pending recount per thread, later votes are folded into it.
+        key = f"{THREAD_VOTES_KEY}-{post.root_id}"
+        if cache.add(key, 1, 300):
+            root_id = post.root_id
+            transaction.on_commit(lambda: tasks.update_thread_votes.spool(root_id=root_id))
+    else:
+        root_fields['thread_votecount'] = F('thread_votecount') + change
 
     # Handle accepted vote.
     if vote_type == Vote.ACCEPT:
-        Post.objects.filter(uid=post.uid).update(accept_count=accept_count)
-        Post.objects.filter(uid=post.root.uid).update(accept_count=F('accept_count') + change)
+        root_fields['accept_count'] = F('accept_count') + change
+
+    if root_fields:
+        Post.objects.filter(id=post.root_id).update(**root_fields)
+
+    # Reset bookmark cache
+    if vote_type == Vote.BOOKMARK:
+        delete_cache(BOOKMARKS, user)
 
     return msg, vote, change
 
@@ -502,6 +506,11 @@ def move(request, parent, source, ptype=Post.COMMENT, msg="moved"):
     if source.is_toplevel or not parent:
         return url
 
+    # Take the post out of the counts of the old parent.
+    counted = source.is_counted
+    if counted:
+        source.update_counts(change=-1)
+
     # Move this post to comment of parent
     source.parent = parent
     source.type = ptype
@@ -509,10 +518,13 @@ def move(request, parent, source, ptype=Post.COMMENT, msg="moved"):
     title = f"{source.get_type_display()}: {source.root.title[:80]}"
     Post.objects.filter(uid=source.uid).update(parent=parent, type=ptype, title=title)
 
+    # Add the post to the counts of the new parent.
+    if counted:
+        source.update_counts()
+
     # Log action and let user know
     messages.info(request, mark_safe(msg))
     db_logger(user=user, text=f"{msg}", post=source)
-    source.update_parent_counts()
     return url
 
 
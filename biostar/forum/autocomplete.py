@@ -0,0 +1,136 @@
+"""
+Prefix search over the tags used by the site.
+
+The vocabulary is held in memory as a sorted list and searched with bisect,
+each process loads it once and reloads it when tags are added or removed.
+The counts used to rank the matches are refreshed when the index expires.
+"""
+import bisect
+import heapq
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+
+from biostar.forum.const import TAG_INDEX_KEY
+from biostar.forum.models import TagStat
+
+logger = logging.getLogger("engine")
+
+
+def read_options(limit=5000):
+    """
+    Reads the tags listed in the tag options file, one tag per line.
+    """
+    path = getattr(settings, "TAGS_OPTIONS_FILE", None) or ''
+    if not os.path.exists(path):
+        return []
+
+    with open(path, 'r') as stream:
+        lines = (line.strip() for line in islice(stream, limit))
+        return [line for line in lines if line]
+
+
+class Snapshot(namedtuple("Snapshot", "names weights options best")):
+    """
+    One loaded state of the index, replaced as a whole on reload.
+    The best matches of the short prefixes are only kept for the snapshot that computed them.
+    """
+    __slots__ = ()
+
+
+class TagIndex:
+    """
+    Tag names sorted for prefix search, weighted by the number of posts with the tag.
+    """
+
+    # Seconds between checks for a newer version of the tag statistics.
+    CHECK = 5
+
+    # Prefixes up to this length keep their best matches.
+    SHORT = 2
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.snapshot = Snapshot(names=(), weights=(), options=(), best={})
+        self.version = None
+        self.loaded = self.checked = 0
+
+    @property
+    def options(self):
+        return self.snapshot.options
+
+    def load(self, version=None):
+        weights = {}
+        for name, total in TagStat.objects.values_list('tag__name', 'total').iterator():
+            name = name.lower()
+            weights[name] = weights.get(name, 0) + total
+
+        # Tags offered in the options file are suggested even when unused.
+        options = read_options()
+        for name in options:
+            weights.setdefault(name.lower(), 0)
+
+        names = sorted(weights)
+        snapshot = Snapshot(names=tuple(names), weights=tuple(weights[name] for name in names),
+                            options=tuple(options), best={})
+
+        # Readers see either the old or the new snapshot, never a mix of both.
+        with self.lock:
+            self.snapshot = snapshot
+            self.version = version
+            self.loaded = self.checked = time.time()
+
+    def refresh(self):
+        """
+        Reloads the index when tags were added or removed, or the index expired.
+        """
+        now = time.time()
+        if self.loaded and now - self.checked < self.CHECK:
+            return
+
+        self.checked = now
+        version = cache.get(TAG_INDEX_KEY)
+        changed = version is not None and version != self.version
+        if not self.loaded or changed or now - self.loaded > settings.TAG_INDEX_TTL:
+            self.load(version=version)
+
+    def search(self, prefix, limit=None):
+        """
+        Returns the (name, count) pairs of the most used tags starting with the prefix.
+        """
+        self.refresh()
+
+        limit = limit or settings.TAG_SEARCH_LIMIT
+        prefix = prefix.strip().lower()
+
+        # The snapshot is read once, a concurrent reload does not affect this search.
+        index = self.snapshot
+
+        # Short prefixes match many tags, their results are kept.
+        key = (prefix, limit)
+        found = index.best.get(key)
+        if found is not None:
+            return found
+
+        names, weights = index.names, index.weights
+        start = bisect.bisect_left(names, prefix)
+        stop = bisect.bisect_left(names, prefix + '\uffff', lo=start)
+
+        # The most used tags first, ties stay in alphabetical order.
+        found = heapq.nlargest(limit, range(start, stop), key=weights.__getitem__)
+        found = [(names[pos], weights[pos]) for pos in found]
+
+        if len(prefix) <= self.SHORT:
+            index.best[key] = found
+
+        return found
+
+
+# The tag index of the process.
+TAGS = TagIndex()
@@ -1,9 +1,12 @@
 import logging
+import random
+from collections import Counter
 
+from django.conf import settings
 from django.utils.timezone import utc
 from datetime import datetime, timedelta
-from django.db.models import Count
-from django.db.models import Q
+from django.db.models import Count, Q
+from django.db.models.functions import Length
 from biostar.accounts.models import User
 from biostar.forum.models import Post, Vote, Badge, Award
 
@@ -14,15 +17,20 @@ def now():
     return datetime.utcnow().replace(tzinfo=utc)
 
 
-def wrap_qs(cond, klass, pk):
+def more_than(rows, field, count):
+    """
+    Users with more than count rows, the rows are counted per user in one grouped query.
+    """
+    groups = rows.order_by().values(field).annotate(total=Count('id')).filter(total__gt=count)
 
-    return klass.objects.filter(pk=pk) if cond else klass.objects.none()
+    return User.objects.filter(id__in=groups.values(field))
 
 
 class AwardDef(object):
     def __init__(self, name, desc, func, icon, max=None, type=Badge.BRONZE):
         self.name = name
         self.desc = desc
+        # Selects the users or posts of the candidate users that earned the award.
         self.fun = func
         self.icon = icon
         self.template = ""
@@ -31,33 +39,28 @@ class AwardDef(object):
         # No limit if left empty.
         self.max = max
 
-    def get_awards(self, user):
-
+    def get_awards(self, users):
+        """
+        Returns the (user, post) pairs that earned the award, post is None for user awards.
+        """
         try:
-            value = self.fun(user).order_by("pk")
-
-            # Only return the ones that have one
+            value = self.fun(users)
         except Exception as exc:
             logger.error("validator error %s" % exc)
             return []
 
-        if isinstance(value.first(), Post):
-            # Count awards user has for this post.
-            award_count = Count('award', filter=Q(author=user))
-
-            # Get posts/user combo that have not been awarded yet
-            value = value.annotate(award_count=award_count).filter(award_count=0)
-
-            return value
+        if value.model is Post:
+            # Posts that have not been awarded yet.
+            value = value.filter(award=None).select_related("author__profile")
+            return [(post.author, post) for post in value]
 
-        # Existing award user has won at this point.
-        awarded = Award.objects.filter(badge__name=self.name, user=user)
+        # Ensure users do not get over rewarded.
+        if self.max:
+            awarded = Award.objects.filter(badge__name=self.name).values('user')
+            awarded = awarded.annotate(total=Count('id')).filter(total__gte=self.max)
+            value = value.exclude(id__in=awarded.values('user'))
 
-        # Ensure users does not get over rewarded.
-        if self.max and len(awarded) >= self.max:
-            return []
-
-        return value
+        return [(user, None) for user in value.select_related("profile")]
 
     def __hash__(self):
         return hash(self.name)
@@ -66,11 +69,16 @@ class AwardDef(object):
         return self.name == other.name
 
 
+def autobiographer(users):
+    users = users.annotate(text_len=Length('profile__text'))
+    return users.filter(text_len__gt=80, profile__score__gt=1)
+
+
 # Award definitions
 AUTOBIO = AwardDef(
     name="Autobiographer",
     desc="has more than 80 characters in the information field of the user's profile",
-    func=lambda user: wrap_qs(len(user.profile.text) > 80 and user.profile.score > 1, User, user.id),
+    func=autobiographer,
     max=1,
     icon="bullhorn icon"
 )
@@ -79,7 +87,7 @@ AUTOBIO = AwardDef(
 CURATOR = AwardDef(
     name="Curator",
     desc="accepted atleast once",
-    func=lambda user: wrap_qs(len(user.profile.text) > 80 and user.profile.score > 1, User, user.id),
+    func=autobiographer,
     max=1,
     icon="bullhorn icon"
 )
@@ -87,7 +95,7 @@ CURATOR = AwardDef(
 COLLECTOR = AwardDef(
     name="Collector",
     desc="submitted five or more herald stories ",
-    func=lambda user: wrap_qs(len(user.profile.text) > 80 and user.profile.score > 1, User, user.id),
+    func=autobiographer,
     max=1,
     icon="bullhorn icon"
 )
@@ -95,7 +103,7 @@ COLLECTOR = AwardDef(
 EDITOR = AwardDef(
     name="Editor",
     desc="published links ",
-    func=lambda user: wrap_qs(len(user.profile.text) > 80 and user.profile.score > 1, User, user.id),
+    func=autobiographer,
     max=1,
     icon="bullhorn icon"
 )
@@ -104,7 +112,7 @@ EDITOR = AwardDef(
 GOOD_QUESTION = AwardDef(
     name="Good Question",
     desc="asked a question that was upvoted at least 5 times",
-    func=lambda user: Post.objects.filter(vote_count__gte=5, author=user, type=Post.QUESTION),
+    func=lambda users: Post.objects.filter(vote_count__gte=5, author__in=users, type=Post.QUESTION),
     max=1,
     icon="question circle icon"
 )
@@ -112,7 +120,7 @@ GOOD_QUESTION = AwardDef(
 GOOD_ANSWER = AwardDef(
     name="Good Answer",
     desc="created an answer that was upvoted at least 5 times",
-    func=lambda user: Post.objects.filter(vote_count__gt=5, author=user, type=Post.ANSWER),
+    func=lambda users: Post.objects.filter(vote_count__gt=5, author__in=users, type=Post.ANSWER),
     max=1,
     icon="book icon"
 )
@@ -120,7 +128,7 @@ GOOD_ANSWER = AwardDef(
 STUDENT = AwardDef(
     name="Student",
     desc="asked a question with at least 3 up-votes",
-    func=lambda user: Post.objects.filter(vote_count__gt=2, author=user, type=Post.QUESTION),
+    func=lambda users: Post.objects.filter(vote_count__gt=2, author__in=users, type=Post.QUESTION),
     max=1,
     icon="graduation cap icon"
 )
@@ -128,7 +136,7 @@ STUDENT = AwardDef(
 TEACHER = AwardDef(
     name="Teacher",
     desc="created an answer with at least 3 up-votes",
-    func=lambda user: Post.objects.filter(vote_count__gt=2, author=user, type=Post.ANSWER),
+    func=lambda users: Post.objects.filter(vote_count__gt=2, author__in=users, type=Post.ANSWER),
     max=1,
     icon="smile icon"
 )
@@ -136,7 +144,7 @@ TEACHER = AwardDef(
 COMMENTATOR = AwardDef(
     name="Commentator",
     desc="created a comment with at least 3 up-votes",
-    func=lambda user: Post.objects.filter(vote_count__gt=2, author=user, type=Post.COMMENT),
+    func=lambda users: Post.objects.filter(vote_count__gt=2, author__in=users, type=Post.COMMENT),
     max=1,
     icon="mycomment icon"
 )
@@ -144,7 +152,7 @@ COMMENTATOR = AwardDef(
 CENTURION = AwardDef(
     name="Centurion",
     desc="created 100 posts",
-    func=lambda user: wrap_qs(Post.objects.filter(author=user).count() > 100, User, user.id),
+    func=lambda users: more_than(Post.objects.filter(author__in=users), 'author', 100),
     max=1,
     icon="bolt icon",
     type=Badge.SILVER,
@@ -153,7 +161,7 @@ CENTURION = AwardDef(
 EPIC_QUESTION = AwardDef(
     name="Epic Question",
     desc="created a question with more than 10,000 views",
-    func=lambda user: Post.objects.filter(author=user, view_count__gt=10000),
+    func=lambda users: Post.objects.filter(author__in=users, view_count__gt=10000),
     max=1,
     icon="bullseye icon",
     type=Badge.GOLD,
@@ -162,7 +170,7 @@ EPIC_QUESTION = AwardDef(
 POPULAR = AwardDef(
     name="Popular Question",
     desc="created a question with more than 1,000 views",
-    func=lambda user: Post.objects.filter(author=user, view_count__gt=1000),
+    func=lambda users: Post.objects.filter(author__in=users, view_count__gt=1000),
     max=1,
     icon="eye icon",
     type=Badge.GOLD,
@@ -171,7 +179,7 @@ POPULAR = AwardDef(
 ORACLE = AwardDef(
     name="Oracle",
     desc="created more than 1,000 posts (questions + answers + comments)",
-    func=lambda user: wrap_qs(Post.objects.filter(author=user).count() > 1000, User, user.id),
+    func=lambda users: more_than(Post.objects.filter(author__in=users), 'author', 1000),
     max=1,
     icon="sun icon",
     type=Badge.GOLD,
@@ -180,7 +188,7 @@ ORACLE = AwardDef(
 PUNDIT = AwardDef(
     name="Pundit",
     desc="created a comment with more than 10 votes",
-    func=lambda user: Post.objects.filter(author=user, type=Post.COMMENT, vote_count__gt=10),
+    func=lambda users: Post.objects.filter(author__in=users, type=Post.COMMENT, vote_count__gt=10),
     max=1,
     icon="comments icon",
     type=Badge.SILVER,
@@ -189,7 +197,7 @@ PUNDIT = AwardDef(
 GURU = AwardDef(
     name="Guru",
     desc="received more than 100 upvotes",
-    func=lambda user: wrap_qs(Vote.objects.filter(post__author=user).count() > 100, User, user.id),
+    func=lambda users: more_than(Vote.objects.filter(post__author__in=users), 'post__author', 100),
     max=1,
     icon="beer icon",
     type=Badge.SILVER,
@@ -198,7 +206,7 @@ GURU = AwardDef(
 CYLON = AwardDef(
     name="Cylon",
     desc="received 1,000 up votes",
-    func=lambda user: wrap_qs(Vote.objects.filter(post__author=user).count() > 1000, User, user.id),
+    func=lambda users: more_than(Vote.objects.filter(post__author__in=users), 'post__author', 1000),
     max=1,
     icon="rocket icon",
     type=Badge.GOLD,
@@ -207,7 +215,7 @@ CYLON = AwardDef(
 VOTER = AwardDef(
     name="Voter",
     desc="voted more than 100 times",
-    func=lambda user: wrap_qs(Vote.objects.filter(author=user).count() > 100, User, user.id),
+    func=lambda users: more_than(Vote.objects.filter(author__in=users), 'author', 100),
     max=1,
     icon="thumbs up outline icon"
 )
@@ -215,7 +223,7 @@ VOTER = AwardDef(
 SUPPORTER = AwardDef(
     name="Supporter",
     desc="voted at least 25 times",
-    func=lambda user: wrap_qs(Vote.objects.filter(author=user).count() > 25, User, user.id),
+    func=lambda users: more_than(Vote.objects.filter(author__in=users), 'author', 25),
     max=1,
     icon="thumbs up icon",
     type=Badge.SILVER,
@@ -224,7 +232,7 @@ SUPPORTER = AwardDef(
 SCHOLAR = AwardDef(
     name="Scholar",
     desc="created an answer that has been accepted",
-    func=lambda user: Post.objects.filter(author=user, type=Post.ANSWER, accept_count__gt=0),
+    func=lambda users: Post.objects.filter(author__in=users, type=Post.ANSWER, accept_count__gt=0),
     max=1,
     icon="university icon"
 )
@@ -232,7 +240,7 @@ SCHOLAR = AwardDef(
 PROPHET = AwardDef(
     name="Prophet",
     desc="created a post with more than 20 followers",
-    func=lambda user: Post.objects.filter(author=user, type__in=Post.TOP_LEVEL, subs_count__gt=20),
+    func=lambda users: Post.objects.filter(author__in=users, type__in=Post.TOP_LEVEL, subs_count__gt=20),
     max=1,
     icon="leaf icon"
 )
@@ -240,17 +248,16 @@ PROPHET = AwardDef(
 LIBRARIAN = AwardDef(
     name="Librarian",
     desc="created a post with more than 10 bookmarks",
-    func=lambda user: Post.objects.filter(author=user, type__in=Post.TOP_LEVEL, book_count__gt=10),
+    func=lambda users: Post.objects.filter(author__in=users, type__in=Post.TOP_LEVEL, book_count__gt=10),
     max=1,
     icon="bookmark outline icon"
 )
 
 
-def rising_star(user):
+def rising_star(users):
     # The user joined no more than three months ago
-    cond = now() < user.profile.date_joined + timedelta(weeks=15)
-    cond = cond and Post.objects.filter(author=user).count() > 50
-    return wrap_qs(cond, User, user.id)
+    users = users.filter(profile__date_joined__gt=now() - timedelta(weeks=15))
+    return more_than(Post.objects.filter(author__in=users), 'author', 50)
 
 
 RISING_STAR = AwardDef(
@@ -266,7 +273,7 @@ RISING_STAR = AwardDef(
 GREAT_QUESTION = AwardDef(
     name="Great Question",
     desc="created a question with more than 5,000 views",
-    func=lambda user: Post.objects.filter(author=user, view_count__gt=5000),
+    func=lambda users: Post.objects.filter(author__in=users, view_count__gt=5000),
     icon="fire icon",
     type=Badge.SILVER,
 )
@@ -274,7 +281,7 @@ GREAT_QUESTION = AwardDef(
 GOLD_STANDARD = AwardDef(
     name="Gold Standard",
     desc="created a post with more than 25 bookmarks",
-    func=lambda user: Post.objects.filter(author=user, book_count__gt=25),
+    func=lambda users: Post.objects.filter(author__in=users, book_count__gt=25),
     icon="bookmark icon",
     type=Badge.GOLD,
 )
@@ -282,7 +289,7 @@ GOLD_STANDARD = AwardDef(
 APPRECIATED = AwardDef(
     name="Appreciated",
     desc="created a post with more than 5 votes",
-    func=lambda user: Post.objects.filter(author=user, vote_count__gt=5),
+    func=lambda users: Post.objects.filter(author__in=users, vote_count__gt=5),
     icon="heart icon",
     type=Badge.SILVER,
 )
@@ -315,3 +322,79 @@ ALL_AWARDS = [
     GOLD_STANDARD,
     APPRECIATED,
 ]
+
+
+# Badges by name, looked up once per process.
+BADGES = {}
+
+
+def get_badge(name):
+    """
+    Badges are created after migrations, all badges are loaded again when one is missing.
+    """
+    if name not in BADGES:
+        BADGES.update((badge.name, badge) for badge in Badge.objects.all())
+    return BADGES.get(name)
+
+
+def candidates(since=None):
+    """
+    Users that visited, posted, voted or received votes since the given date,
+    they may have earned new awards.
+    """
+    since = since or now() - timedelta(hours=settings.AWARD_CANDIDATE_HOURS)
+
+    posted = Post.objects.filter(lastedit_date__gt=since).values('author')
+    votes = Vote.objects.filter(date__gt=since)
+
+    cond = Q(profile__last_login__gt=since) | Q(id__in=posted)
+    cond |= Q(id__in=votes.values('author')) | Q(id__in=votes.values('post__author'))
+
+    return User.objects.filter(cond)
+
+
+def valid_awards(users):
+    """
+    Return list of valid (user, badge, date, post) awards for the users.
+    Every award runs a single query over all users.
+    """
+    valid = []
+    for award in ALL_AWARDS:
+        badge = get_badge(award.name)
+        if not badge:
+            continue
+
+        for user, post in award.get_awards(users):
+            date = post.lastedit_date if post else user.profile.last_login
+            valid.append((user, badge, date, post))
+
+    return valid
+
+
+def create_awards(users, limit=None):
+    """
+    Creates the awards earned by the users, at most limit new awards for each user in one run.
+    """
+    limit = limit or settings.MAX_AWARDS
+
+    valid = valid_awards(users=users)
+
+    # Pick random awards to give to each user
+    random.shuffle(valid)
+
+    given, seen, awards = Counter(), set(), []
+    for user, badge, date, post in valid:
+        # A post is awarded once.
+        if given[user.id] >= limit or (post and post.id in seen):
+            continue
+
+        given[user.id] += 1
+        if post:
+            seen.add(post.id)
+
+        awards.append(Award(user=user, badge=badge, date=date, post=post))
+
+    Award.objects.bulk_create(awards, batch_size=1000)
+    logger.info(f"{len(awards)} awards given to {len(given)} users")
+
+    return awards
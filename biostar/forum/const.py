@@ -25,17 +25,31 @@ ORDER_MAPPER = {
 
 }
 
-ALLOWED_PARAMS = {"page", "order", "type", "limit", "query", "user", "active"}
+# Cursors of the keyset paginated listings.
+CURSOR_PARAMS = {"after", "before"}
+
+ALLOWED_PARAMS = {"page", "order", "type", "limit", "query", "user", "active", *CURSOR_PARAMS}
 
 # Cache keys used to cache objects.
 LATEST_CACHE_KEY = "LATEST"
 TAGS_CACHE_KEY = "TAGS"
 SIMILAR_CACHE_KEY = "similar"
+SEARCH_CACHE_KEY = "search"
+THREAD_VERSION_KEY = "thread-version"
+THREAD_PAGE_KEY = "thread-page"
+THREAD_VOTES_KEY = "thread-votes"
+TAG_INDEX_KEY = "tag-index"
 USERS_LIST_KEY = "USERS_LIST"
 
 # The name of the session count data.
 COUNT_DATA_KEY = "COUNT_DATA"
 VOTES_COUNT = 'vote_count'
+PLANET_COUNT = 'planet_count'
+SPAM_COUNT = 'spam_count'
+MOD_COUNT = 'mod_count'
+
+# The event totals the session counts were last computed from.
+COUNT_TOTALS_KEY = "count-totals"
 
 # Tabs to pick from in post listing
 MYVOTES, MYPOSTS, MYTAGS, OPEN, \
@@ -0,0 +1,104 @@
+"""
+Embedded html and page titles of external urls.
+
+Fetching runs in tasks with a strict timeout, rendering only reads the stored results.
+"""
+import logging
+from datetime import timedelta
+
+import requests
+from bs4 import BeautifulSoup
+from django.conf import settings
+
+from biostar.forum import util
+from biostar.forum.models import Embed, MAX_NAME_LEN
+
+logger = logging.getLogger("engine")
+
+# Tweets are stored under a canonical url.
+TWEET_URL = "https://twitter.com/i/status/"
+
+# The oEmbed endpoint documented at https://dev.twitter.com/docs/embedded-tweets
+TWEET_API = "https://api.twitter.com/1/statuses/oembed.json?id={}"
+
+
+def tweet_url(tweet_id):
+    return f"{TWEET_URL}{tweet_id}"
+
+
+def is_tweet(url):
+    return url.startswith(TWEET_URL)
+
+
+def expired(embed):
+    """
+    Found embeds are refreshed after a while, failed and unfinished fetches are retried sooner.
+    """
+    limit = settings.EMBED_TTL if embed.status == Embed.FOUND else settings.EMBED_RETRY
+    return util.now() - embed.date > timedelta(seconds=limit)
+
+
+def lookup(urls, record=True):
+    """
+    Returns the stored embeds of the urls and the urls that need to be fetched.
+    The fetches are recorded as requested unless record is False.
+    """
+    urls = set(urls)
+    if not urls:
+        return {}, []
+
+    found = {embed.url: embed for embed in Embed.objects.filter(url__in=urls)}
+    missing = urls - set(found)
+    stale = [url for url, embed in found.items() if expired(embed)]
+
+    if not record:
+        return found, sorted(missing) + stale
+
+    # Record the requested fetches, later lookups will not request them again.
+    now = util.now()
+    Embed.objects.bulk_create([Embed(url=url, date=now) for url in missing], ignore_conflicts=True)
+    Embed.objects.filter(url__in=stale).update(date=now)
+
+    return found, sorted(missing) + stale
+
+
+def fetch(url):
+    """
+    Fetches the embedded html of a tweet or the title of a page and stores the outcome.
+    """
+    html = title = ''
+    try:
+        if is_tweet(url):
+            tweet_id = url[len(TWEET_URL):]
+            resp = requests.get(TWEET_API.format(tweet_id), timeout=settings.EMBED_TIMEOUT)
+            resp.raise_for_status()
+            html = resp.json()['html']
+        else:
+            resp = requests.get(url, timeout=settings.EMBED_TIMEOUT)
+            soup = BeautifulSoup(resp.text, 'html.parser')
+            for elem in soup.find_all('title'):
+                title = elem.get_text().strip()
+                if title:
+                    break
+    except Exception as exc:
+        logger.warning(f"unable to fetch {url}: {exc}")
+
+    # Keep the earlier results when a refresh fails.
+    embed = Embed.objects.filter(url=url).first() or Embed(url=url)
+    embed.html = html or embed.html
+    embed.title = title[:MAX_NAME_LEN] or embed.title
+    embed.status = Embed.FOUND if (embed.html or embed.title) else Embed.MISSING
+    embed.date = util.now()
+    embed.save()
+
+    return embed
+
+
+def add_waiting(post, urls):
+    """
+    Records the post as shown with the embeds of the urls that are not yet fetched.
+    """
+    embeds = Embed.objects.filter(url__in=urls)
+    Through = Embed.posts.through
+    Through.objects.bulk_create([Through(embed_id=embed.id, post_id=post.pk) for embed in embeds],
+                                ignore_conflicts=True)
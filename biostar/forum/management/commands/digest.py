@@ -4,8 +4,10 @@ from django.template import loader
 from django.core.management.base import BaseCommand
 from taggit.models import Tag
 from biostar.forum.models import Post
-from biostar.emailer.tasks import send_email
+from biostar.emailer.tasks import build_edition, send_edition, prune_editions
 from biostar.accounts import util, models
+from biostar.accounts.auth import edition_recipients
+from biostar.accounts.const import UNSUBSCRIBE_TOKEN
 
 logger = logging.getLogger('engine')
 
@@ -19,6 +21,9 @@ def send_digests(days=1, subject=""):
               7: models.Profile.WEEKLY_DIGEST,
               30: models.Profile.MONTHLY_DIGEST}
 
+    # Editions of earlier digests and posts are no longer needed.
+    prune_editions()
+
     # Get posts made within the given time range.
     trange = util.now() - timedelta(days=days)
 
@@ -28,22 +33,16 @@ def send_digests(days=1, subject=""):
         logger.info(f'No new posts found in the last {days} days.')
         return
 
-    # Total number of recipients allowed per batch,
-    # AWS has limit of 50
-    batch_size = 40
+    # Render the digest once per period, then fill in each recipient.
+    name = f"digest-{days}-{util.now():%Y-%m-%d}"
+    context = dict(subject=subject, posts=posts, unsubscribe=UNSUBSCRIBE_TOKEN)
+    edition = build_edition(name=name, template_name="messages/digest.html", extra_context=context)
 
     # Get users with the appropriate digest preference.
     pref = mapper.get(days, models.Profile.DAILY_DIGEST)
-    context = dict(subject=subject, posts=posts)
-    users = models.User.objects.filter(profile__digest_prefs=pref)
-    emails = users.values_list('email', flat=True)
-
-    # Iterate through recipients and send emails in batches.
-    for idx in range(0, len(emails), batch_size):
-        # Get the next set of emails
-        end = idx + batch_size
-        rec_list = emails[idx:end]
-        send_email(template_name="messages/digest.html", extra_context=context, recipient_list=rec_list)
+    users = models.User.objects.filter(profile__digest_prefs=pref).order_by('id')
+
+    send_edition(edition=edition, recipients=edition_recipients(users))
 
     return
 
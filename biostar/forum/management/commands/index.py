@@ -1,7 +1,9 @@
 
 import logging
+import time
 from typing import Any
 import os, sys
+from whoosh.writing import BufferedWriter
 from django.core.management.base import BaseCommand
 from biostar.forum.models import Post
 from django.conf import settings
@@ -51,6 +53,31 @@ def build(size, remove=False):
     logger.info(f"Removed {len(sids)} spam posts from index")
 
 
+@check_lock(LOCK)
+def drain(size, daemon=False, sleep=5):
+    """
+    Applies queued post changes to the search index.
+    The daemon mode keeps a single writer open and polls the queue forever.
+    """
+
+    ix = search.init_index()
+
+    # The writer is only committed once per batch.
+    writer = BufferedWriter(ix, period=None, limit=size)
+
+    try:
+        while True:
+            count = search.process_queue(writer=writer, limit=size)
+
+            # A partial batch means the queue has been emptied.
+            if count < size:
+                if not daemon:
+                    break
+                time.sleep(sleep)
+    finally:
+        writer.close()
+
+
 class Command(BaseCommand):
     help = 'Create search index for the forum app.'
 
@@ -60,6 +87,11 @@ class Command(BaseCommand):
         parser.add_argument('--remove', action='store_true', default=False, help="Removes the existing index.")
         parser.add_argument('--report', action='store_true', default=False, help="Reports on the content of the index.")
         parser.add_argument('--size', type=int, default=0, help="How many posts to index")
+        parser.add_argument('--queue', action='store_true', default=False,
+                            help="Applies the queued post changes to the index.")
+        parser.add_argument('--daemon', action='store_true', default=False,
+                            help="Keeps applying queued post changes as they come in.")
+        parser.add_argument('--sleep', type=int, default=5, help="Seconds to wait when the queue is empty.")
 
     def handle(self, *args, **options):
 
@@ -69,14 +101,21 @@ class Command(BaseCommand):
         remove = options['remove']
         report = options['report']
         size = options['size']
+        queue = options['queue']
+        daemon = options['daemon']
+        sleep = options['sleep']
 
         # Sets the un-indexed flags to false on all posts.
         if reset:
             logger.info(f"Setting indexed field to false on all post.")
             Post.objects.valid_posts(indexed=True).exclude(root=None).update(indexed=False)
 
+        # Apply the changes recorded in the queue.
+        if queue or daemon:
+            drain(size=size or settings.BATCH_INDEXING_SIZE, daemon=daemon, sleep=sleep)
+
         # Index a limited number yet unindexed posts
-        if size:
+        elif size:
             build(size=size, remove=remove)
 
         # Report the contents of the index
@@ -0,0 +1,26 @@
+import logging
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from biostar.forum.models import Post, update_listing
+from biostar.utils.helpers import chunked
+
+logger = logging.getLogger('engine')
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the post listings, needed after posts are changed in bulk.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=0, help="How many posts to process in one batch.")
+
+    def handle(self, *args, **options):
+
+        size = options['size'] or settings.BATCH_INDEXING_SIZE
+
+        ids = Post.objects.filter(is_toplevel=True).order_by('id').values_list('id', flat=True).iterator()
+
+        total = 0
+        for chunk in chunked(ids, size):
+            update_listing(chunk)
+            total += len(chunk)
+            logger.info(f"Updated the listings of {total} posts")
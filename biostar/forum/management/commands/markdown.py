@@ -1,7 +1,13 @@
 import logging
+import os
+from multiprocessing import Pool
 
+from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Max
 from biostar.forum import markdown
+from biostar.forum.models import Post, bump_thread
 
 logger = logging.getLogger('engine')
 
@@ -75,11 +81,117 @@ gist_test = "https://gist.github.com/afrendeiro/6732a46b949e864d6803"
 twitter_test = "https://twitter.com/Linux/status/2311234267"
 
 
+# Default location of the last primary key that was re-rendered, kept across reboots.
+CHECKPOINT = os.path.join(settings.BASE_DIR, 'export', 'markdown.checkpoint')
+
+
+def render_post(item):
+    """
+    Renders the content of a post the same way Post.save does, without any side effects.
+    The embeds are looked up read only, the missing ones stay plain links.
+    """
+    pk, content = item
+    try:
+        refs = markdown.resolve_refs(content, record=False)
+        html = markdown.render(content, refs=refs, clean=True, escape=False)
+    except Exception as exc:
+        logger.error(f"Error rendering post pk={pk}: {exc}")
+        html = None
+    return pk, html
+
+
+def init_worker():
+    # Each worker opens its own database connection.
+    connections.close_all()
+
+
+def read_checkpoint(fname):
+    if not os.path.isfile(fname):
+        return 0
+    text = open(fname).read().strip()
+    return int(text) if text else 0
+
+
+def write_checkpoint(fname, pk):
+    os.makedirs(os.path.dirname(os.path.abspath(fname)), exist_ok=True)
+    tmp = f"{fname}.tmp"
+    with open(tmp, 'w') as fp:
+        fp.write(f"{pk}")
+    os.replace(tmp, fname)
+
+
+def rerender(size=1000, workers=None, dry=False, resume=False, checkpoint=CHECKPOINT):
+    """
+    Renders the html of all posts again, streaming them by primary key ranges.
+    Returns the number of posts whose html changed.
+    """
+    start = read_checkpoint(checkpoint) if resume else 0
+    end = Post.objects.aggregate(Max('pk'))['pk__max'] or 0
+
+    # Zero workers render in the current process.
+    pool = None
+    if workers != 0:
+        connections.close_all()
+        pool = Pool(processes=workers or os.cpu_count(), initializer=init_worker)
+
+    changed = total = 0
+    try:
+        for low in range(start, end, size):
+            high = low + size
+            posts = Post.objects.filter(pk__gt=low, pk__lte=high).order_by('pk')
+            rows = list(posts.values_list('pk', 'content', 'html', 'root__uid'))
+            items = [(pk, content) for pk, content, html, uid in rows]
+
+            results = pool.map(render_post, items) if pool else map(render_post, items)
+            results = dict(results)
+
+            stale = [(pk, results[pk], uid) for pk, content, html, uid in rows
+                     if results[pk] is not None and results[pk] != html]
+
+            if not dry:
+                Post.objects.bulk_update([Post(pk=pk, html=html) for pk, html, uid in stale], ['html'])
+
+                # Expire the cached pages of the changed threads.
+                for uid in {uid for pk, html, uid in stale if uid}:
+                    bump_thread(uid)
+
+                write_checkpoint(checkpoint, high)
+
+            total += len(rows)
+            changed += len(stale)
+            logger.info(f"Rendered {total} posts up to pk={high}, {changed} changed")
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    return changed
+
+
 class Command(BaseCommand):
-    help = 'Used to test markdown rendering'
+    help = 'Used to test markdown rendering, or to render the html of all posts again.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rerender', action='store_true', default=False,
+                            help="Renders the html of all posts again.")
+        parser.add_argument('--size', type=int, default=1000, help="How many posts to render in one batch.")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Number of rendering processes, 0 renders in the current process.")
+        parser.add_argument('--dry', action='store_true', default=False,
+                            help="Counts the posts that would change without saving them.")
+        parser.add_argument('--resume', action='store_true', default=False,
+                            help="Continues after the last saved batch.")
+        parser.add_argument('--checkpoint', default=CHECKPOINT, help="File that stores the last saved batch.")
 
     def handle(self, *args, **options):
 
+        if options['rerender']:
+            changed = rerender(size=options['size'], workers=options['workers'], dry=options['dry'],
+                               resume=options['resume'], checkpoint=options['checkpoint'])
+            label = "would change" if options['dry'] else "changed"
+            print(f"{changed} posts {label}")
+            return
+
         # import markdown2
         # import bleach
         # html_classes = dict(code="language-bash", pre="pre")
@@ -0,0 +1,80 @@
+import logging
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F
+from django.conf import settings
+from biostar.forum.models import Post
+from biostar.utils.helpers import chunked
+
+logger = logging.getLogger('engine')
+
+FIELDS = ('reply_count', 'answer_count', 'comment_count')
+
+
+def expected_counts(root_ids):
+    """
+    Returns the reply, answer and comment counts of every post in the threads.
+    """
+    counts = defaultdict(lambda: dict(reply_count=0, answer_count=0, comment_count=0))
+
+    # A single grouped aggregate over the replies of all threads.
+    replies = Post.objects.filter(root_id__in=root_ids).exclude(pk=F('root_id'))
+    replies = replies.exclude(status=Post.DELETED).exclude(spam=Post.SPAM)
+    groups = replies.values_list('root_id', 'parent_id', 'type').annotate(total=Count('id')).order_by()
+
+    for root_id, parent_id, ptype, total in groups:
+        counts[root_id]['reply_count'] += total
+        if ptype == Post.ANSWER:
+            counts[root_id]['answer_count'] += total
+        if ptype == Post.COMMENT:
+            counts[root_id]['comment_count'] += total
+
+        # The parent counts its direct replies.
+        if parent_id != root_id:
+            counts[parent_id]['reply_count'] += total
+            if ptype == Post.COMMENT:
+                counts[parent_id]['comment_count'] += total
+
+    return counts
+
+
+def recount(root_ids):
+    """
+    Fixes the posts of the threads where the stored counts differ from the expected ones.
+    """
+    counts = expected_counts(root_ids)
+
+    posts = Post.objects.filter(root_id__in=root_ids).only('id', *FIELDS)
+
+    changed = []
+    for post in posts:
+        expected = counts[post.id]
+        current = {field: getattr(post, field) for field in FIELDS}
+        if current != expected:
+            for field, value in expected.items():
+                setattr(post, field, value)
+            changed.append(post)
+
+    Post.objects.bulk_update(changed, FIELDS)
+
+    return changed
+
+
+class Command(BaseCommand):
+    help = 'Verifies the reply, answer and comment counts of threads and fixes the wrong ones.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=0, help="How many threads to process in one batch.")
+
+    def handle(self, *args, **options):
+
+        size = options['size'] or settings.BATCH_INDEXING_SIZE
+
+        root_ids = Post.objects.filter(is_toplevel=True).order_by('id').values_list('id', flat=True).iterator()
+
+        total = fixed = 0
+        for chunk in chunked(root_ids, size):
+            changed = recount(root_ids=chunk)
+            total += len(chunk)
+            fixed += len(changed)
+            logger.info(f"Verified {total} threads, fixed {fixed} posts")
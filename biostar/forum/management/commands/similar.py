@@ -0,0 +1,38 @@
+import logging
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef
+from django.conf import settings
+from biostar.forum.models import Post, SimilarPosts
+from biostar.forum import search
+from biostar.utils.helpers import chunked
+
+logger = logging.getLogger('engine')
+
+
+class Command(BaseCommand):
+    help = 'Precomputes the similar posts for top level posts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', default=False,
+                            help="Recomputes the similar posts for every top level post.")
+        parser.add_argument('--size', type=int, default=0, help="How many posts to process in one batch.")
+
+    def handle(self, *args, **options):
+
+        size = options['size'] or settings.BATCH_INDEXING_SIZE
+
+        # Only posts found in the search index have similar posts.
+        posts = Post.objects.filter(is_toplevel=True, indexed=True)
+
+        # Select posts without a list or that changed since it was computed.
+        if not options['all']:
+            fresh = SimilarPosts.objects.filter(uid=OuterRef('uid'), date__gte=OuterRef('lastedit_date'))
+            posts = posts.exclude(Exists(fresh))
+
+        uids = posts.values_list('uid', flat=True).iterator()
+
+        total = 0
+        for chunk in chunked(uids, size):
+            search.update_similar(uids=chunk)
+            total += len(chunk)
+            logger.info(f"Computed similar posts for {total} posts")
@@ -0,0 +1,27 @@
+import logging
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from taggit.models import Tag
+from biostar.forum.models import update_tag_stats
+from biostar.utils.helpers import chunked
+
+logger = logging.getLogger('engine')
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the tag statistics, run nightly to move the recent window forward.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=0, help="How many tags to process in one batch.")
+
+    def handle(self, *args, **options):
+
+        size = options['size'] or settings.BATCH_INDEXING_SIZE
+
+        ids = Tag.objects.order_by('id').values_list('id', flat=True).iterator()
+
+        total = 0
+        for chunk in chunked(ids, size):
+            update_tag_stats(chunk)
+            total += len(chunk)
+            logger.info(f"Updated the statistics of {total} tags")
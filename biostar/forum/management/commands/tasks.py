@@ -51,6 +51,7 @@ def bump(uids, **kwargs):
         uids = uids.split(',')
 
     Post.objects.filter(uid__in=uids).update(rank=rank, lastedit_user=user)
+    models.update_listing(Post.objects.filter(uid__in=uids).values_list("id", flat=True))
     logger.debug(f'uids={uids} bumped')
 
     return
@@ -66,10 +67,12 @@ def unbump(uids, **kwargs):
         models.Post.objects.filter(uid__in=uids).update(rank=p.creation_date.timestamp())
         logger.debug(f'title={p.title} uid={p.uid} unbumped.')
 
+    models.update_listing([p.id for p in posts])
 
-def awards(limit=50, **kwargs):
+
+def awards(limit=None, **kwargs):
     """
-    Give user awards using a batch method.
+    Give the awards earned by the recently active users, at most limit awards per user in each round.
     """
 
     tasks.batch_create_awards(limit=limit)
@@ -85,8 +88,8 @@ class Command(BaseCommand):
         parser.add_argument('--uids', '-u', type=str, required=False, default='', help='List of uids')
         parser.add_argument('--action', '-a', type=str, required=True, choices=CHOICES, default='',
                             help='Action to take.')
-        parser.add_argument('--limit', dest='limit', type=int, default=100,
-                            help='Limit how many users/posts to process.'),
+        parser.add_argument('--limit', dest='limit', type=int, default=None,
+                            help='Limit how many users/posts to process, or the awards given to each user in a round.'),
 
     def handle(self, *args, **options):
         action = options['action']
@@ -3,6 +3,7 @@ Markdown parser to render the Biostar style markdown.
 """
 import re
 import inspect, logging
+import threading
 from functools import partial
 import mistune
 import requests
@@ -17,9 +18,10 @@ from django.conf import settings
 from mistune import Renderer, InlineLexer, InlineGrammar
 from mistune import escape as escape_text
 from bleach.sanitizer import Cleaner
-from biostar.forum import auth
-from biostar.forum.models import Post, Subscription
+from biostar.forum import auth, embeds, tasks
+from biostar.forum.models import Post, Subscription, Embed
 from biostar.accounts.models import Profile, User
+from biostar.utils.helpers import RENDERS
 from bleach.callbacks import nofollow
 
 logger = logging.getLogger('engine')
@@ -57,6 +59,9 @@ http://test.biostars.org/p/p371285/
 
 '''
 
+# Changes whenever the same markdown starts to render differently.
+RENDER_VERSION = 1
+
 # Shortcut to re.compile
 rec = re.compile
 
@@ -108,22 +113,53 @@ GIST_HTML = '<script src="https://gist.github.com/%s.js"></script>'
 TWITTER_PATTERN = rec(r"http(s)?://(www)?.?twitter.com/\w+/status(es)?/(?P<uid>([\d]+))(/)?([^\s]+)?")
 
 
-def get_tweet(tweet_id):
+# Code blocks and code spans, mentions inside them are not users.
+FENCED_CODE = rec(r"^ *(`{3,}|~{3,})[^\n]*\n[\s\S]*?(?:^ *\1[ \t]*$|\Z)", re.MULTILINE)
+INDENTED_CODE = rec(r"^(?: {4}|\t)[^\n]*$", re.MULTILINE)
+CODE_SPAN = rec(r"(`+)[\s\S]*?(?<!`)\1(?!`)")
+
+# A mention starts the word, the handle in an email address is not a mention.
+MENTION_START = rec(r"(?<![\w.@])\@(?P<handle>[\w_.'-]+)")
+
+
+def mentioned_handles(text):
     """
-    Get the HTML code with the embedded tweet.
-    It requires an API call at https://api.twitter.com/1/statuses/oembed.json as documented here:
-    https://dev.twitter.com/docs/embedded-tweets - section "Embedded Tweets for Developers"
-    https://dev.twitter.com/docs/api/1/get/statuses/oembed
-    Params:
-    tweet_id -- a tweet's numeric id like 2311234267 for the tweet at
-    https://twitter.com/Linux/status/2311234267
+    Returns the handles mentioned in the text outside of code and email addresses.
     """
-    try:
-        response = requests.get("https://api.twitter.com/1/statuses/oembed.json?id={}".format(
-            tweet_id))
-        return response.json()['html']
-    except:
-        return ''
+    for patt in (FENCED_CODE, INDENTED_CODE, CODE_SPAN):
+        text = patt.sub(' ', text)
+    return {m.group("handle") for m in MENTION_START.finditer(text)}
+
+
+def resolve_refs(text, record=True):
+    """
+    Finds the users, posts and profiles referenced in the text with one query per kind.
+    Missing embeds are recorded as requested unless record is False.
+    """
+    handles = mentioned_handles(text)
+    post_uids = {m.group("uid") for patt in (POST_TOPLEVEL, POST_ANCHOR) for m in patt.finditer(text)}
+    profile_uids = {m.group("uid") for m in USER_PATTERN.finditer(text)}
+
+    users = User.objects.filter(profile__handle__in=handles).select_related("profile") if handles else []
+    posts = Post.objects.filter(uid__in=post_uids).select_related("root") if post_uids else []
+    profiles = Profile.objects.filter(uid__in=profile_uids) if profile_uids else []
+
+    # Embedded tweets are fetched in the background, missing ones render as plain links.
+    tweets = {embeds.tweet_url(m.group("uid")) for m in TWITTER_PATTERN.finditer(text)}
+    found, fetch = embeds.lookup(tweets, record=record)
+
+    # Tweets that render as plain links until fetched.
+    pending = set(fetch) | {url for url, embed in found.items() if embed.status == Embed.PENDING}
+
+    refs = dict(
+        users={user.profile.handle: user for user in users},
+        posts={post.uid: post for post in posts},
+        profiles={profile.uid: profile for profile in profiles},
+        embeds={url: embed.html for url, embed in found.items() if embed.html},
+        fetch=fetch,
+        pending=sorted(pending),
+    )
+    return refs
 
 
 class MonkeyPatch(InlineLexer):
@@ -192,14 +228,15 @@ def rewrite_static(link):
 class BiostarInlineLexer(MonkeyPatch):
     grammar_class = BiostarInlineGrammer
 
-    def __init__(self, root=None, allow_rewrite=False, *args, **kwargs):
+    def __init__(self, allow_rewrite=False, *args, **kwargs):
         """
-        :param root: Root post that is being pared
-        :param static_imgs:
+        :param allow_rewrite: Serve images with relative url paths from the static directory.
         """
-        self.root = root
         self.allow_rewrite = allow_rewrite
 
+        # Users, posts and profiles referenced in the document.
+        self.refs = resolve_refs('')
+
         super(BiostarInlineLexer, self).__init__(*args, **kwargs)
         self.enable_all()
 
@@ -241,15 +278,11 @@ class BiostarInlineLexer(MonkeyPatch):
     def output_mention_link(self, m):
 
         handle = m.group("handle")
-        # Query user and get the link
-        user = User.objects.filter(profile__handle=handle).first()
+        # Get the user resolved before rendering.
+        user = self.refs['users'].get(handle)
         if user:
             profile = reverse("user_profile", kwargs=dict(uid=user.profile.uid))
             link = f'<a href="{profile}">{user.profile.name}</a>'
-            # Subscribe mentioned users to post.
-            if self.root:
-                # Create user subscription if it does not already exist.
-                auth.create_subscription(post=self.root, user=user, update=True)
         else:
             link = m.group(0)
 
@@ -258,7 +291,7 @@ class BiostarInlineLexer(MonkeyPatch):
     def output_post_link(self, m):
         uid = m.group("uid")
         link = m.group(0)
-        post = Post.objects.filter(uid=uid).first()
+        post = self.refs['posts'].get(uid)
         title = post.root.title if post else "Post not found"
         return f'<a href="{link}">{title}</a>'
 
@@ -269,7 +302,7 @@ class BiostarInlineLexer(MonkeyPatch):
     def output_anchor_link(self, m):
         uid = m.group("uid")
         link = m.group(0)
-        post = Post.objects.filter(uid=uid).first()
+        post = self.refs['posts'].get(uid)
         title = post.root.title if post else "Post not found"
         return f'<a href="{link}">{title}</a>'
 
@@ -280,7 +313,7 @@ class BiostarInlineLexer(MonkeyPatch):
     def output_user_link(self, m):
         uid = m.group("uid")
         link = m.group(0)
-        profile = Profile.objects.filter(uid=uid).first()
+        profile = self.refs['profiles'].get(uid)
         name = profile.name if profile else f"Invalid user uid: {uid}"
         return f'<a href="{link}">{name}</a>'
 
@@ -338,8 +371,9 @@ class BiostarInlineLexer(MonkeyPatch):
         return f'<a href="{link}">{link}</a>'
 
 
-def embedder(attrs, new, embed=None):
+def embedder(attrs, new, embed=None, tweets=None):
     embed = [] if embed is None else embed
+    tweets = {} if tweets is None else tweets
 
     # Existing <a> tag, leave as is.
     if not new:
@@ -358,7 +392,7 @@ def embedder(attrs, new, embed=None):
         (YOUTUBE_PATTERN1, lambda x: YOUTUBE_HTML % x),
         (YOUTUBE_PATTERN2, lambda x: YOUTUBE_HTML % x),
         (YOUTUBE_PATTERN3, lambda x: YOUTUBE_HTML % x),
-        (TWITTER_PATTERN, get_tweet),
+        (TWITTER_PATTERN, lambda x: tweets.get(embeds.tweet_url(x))),
     ]
 
     for regex, get_text in targets:
@@ -366,6 +400,9 @@ def embedder(attrs, new, embed=None):
         if patt:
             uid = patt.group("uid")
             obj = get_text(uid)
+            # Links without a fetched embed are kept as they are.
+            if obj is None:
+                continue
             embed.append((patt.group(), obj))
             attrs['_text'] = patt.group()
             if 'rel' in attrs:
@@ -374,10 +411,11 @@ def embedder(attrs, new, embed=None):
     return attrs
 
 
-def linkify(text):
+def linkify(text, tweets=None):
     # List of links to embed
     embed = []
-    html = bleach.linkify(text=text, callbacks=[partial(embedder, embed=embed), nofollow], skip_tags=['pre', 'code'])
+    callback = partial(embedder, embed=embed, tweets=tweets)
+    html = bleach.linkify(text=text, callbacks=[callback, nofollow], skip_tags=['pre', 'code'])
 
     # Embed links into html.
     for em in embed:
@@ -388,6 +426,42 @@ def linkify(text):
     return html
 
 
+class ParserPool:
+    """
+    Keeps the markdown parsers of each thread for reuse.
+    Parsers are stateful, a nested parse gets a parser of its own.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def idle(self, key):
+        store = self.local.__dict__.setdefault("idle", {})
+        return store.setdefault(key, [])
+
+    def acquire(self, escape=True, allow_rewrite=False):
+        key = (escape, allow_rewrite)
+        idle = self.idle(key)
+        if idle:
+            return idle.pop()
+
+        # Initialize the renderer
+        renderer = BiostarRenderer(escape=escape)
+
+        # Initialize the lexer
+        inline = BiostarInlineLexer(renderer=renderer, allow_rewrite=allow_rewrite)
+
+        markdown = mistune.Markdown(hard_wrap=True, renderer=renderer, inline=inline)
+        markdown.key = key
+        return markdown
+
+    def release(self, markdown):
+        self.idle(markdown.key).append(markdown)
+
+
+PARSERS = ParserPool()
+
+
 def safe(f):
     """
     Safely call an object without causing errors
@@ -403,12 +477,49 @@ def safe(f):
     return inner
 
 
+def render(text, refs, clean=True, escape=True, allow_rewrite=False):
+    """
+    Renders markdown into html with the references resolved beforehand.
+    """
+    markdown = PARSERS.acquire(escape=escape, allow_rewrite=allow_rewrite)
+    try:
+        markdown.inline.refs = refs
+        output = markdown(text=text)
+    finally:
+        PARSERS.release(markdown)
+
+    # Bleach clean the html.
+    if clean:
+        output = bleach.clean(text=output,
+                            tags=ALLOWED_TAGS,
+                            styles=ALLOWED_STYLES,
+                            attributes=ALLOWED_ATTRIBUTES,
+                            protocols=ALLOWED_PROTOCOLS)
+    # Embed sensitive links into html
+    output = linkify(text=output, tweets=refs['embeds'])
+
+    return output
+
+
+def refs_signature(refs):
+    """
+    The parts of the references that show up in the rendered html.
+    """
+    users = sorted((handle, user.profile.uid, user.profile.name) for handle, user in refs['users'].items())
+    posts = sorted((uid, post.root.title if post.root else '') for uid, post in refs['posts'].items())
+    profiles = sorted((uid, profile.name) for uid, profile in refs['profiles'].items())
+    tweets = sorted(refs['embeds'].items())
+    return users, posts, profiles, tweets
+
+
 @safe
-def parse(text, post=None, clean=True, escape=True, allow_rewrite=False):
+def parse(text, post=None, clean=True, escape=True, allow_rewrite=False, fetch=True):
     """
     Parses markdown into html.
     Expands certain patterns into HTML.
 
+    fetch : Request the embeds missing from the text, off when rendering again.
+
     clean : Applies bleach clean BEFORE mistune escapes unsafe characters.
             Also removes unbalanced tags at this stage.
     escape  : Escape html originally found in the markdown text.
@@ -419,24 +530,27 @@ def parse(text, post=None, clean=True, escape=True, allow_rewrite=False):
     # Resolve the root if exists.
     root = post.parent.root if (post and post.parent) else None
 
-    # Initialize the renderer
-    renderer = BiostarRenderer(escape=escape)
-
-    # Initialize the lexer
-    inline = BiostarInlineLexer(renderer=renderer, root=root, allow_rewrite=allow_rewrite)
-
-    markdown = mistune.Markdown(hard_wrap=True, renderer=renderer, inline=inline)
-
-    output = markdown(text=text)
-    # Bleach clean the html.
-    if clean:
-        output = bleach.clean(text=output,
-                            tags=ALLOWED_TAGS,
-                            styles=ALLOWED_STYLES,
-                            attributes=ALLOWED_ATTRIBUTES,
-                            protocols=ALLOWED_PROTOCOLS)
-    # Embed sensitive links into html
-    output = linkify(text=output)
+    refs = resolve_refs(text, record=fetch)
+
+    # Fill in the missing embeds, posts that show them are rendered again.
+    # Posts request the fetch once saved, so that the post is found when rendering again.
+    if post is not None:
+        post.fetch_embeds = refs['fetch']
+        post.waiting_embeds = refs['pending']
+    elif fetch:
+        for url in refs['fetch']:
+            tasks.fetch_embed.spool(url=url)
+
+    # Subscribe mentioned users to post.
+    if root:
+        for user in refs['users'].values():
+            # Create user subscription if it does not already exist.
+            auth.create_subscription(post=root, user=user, update=True)
+
+    # The same text renders the same way as long as the references look the same.
+    func = partial(render, refs=refs, clean=clean, escape=escape, allow_rewrite=allow_rewrite)
+    output = RENDERS.render(text, func, version=RENDER_VERSION, clean=clean, escape=escape,
+                            allow_rewrite=allow_rewrite, refs=refs_signature(refs))
 
     return output
 
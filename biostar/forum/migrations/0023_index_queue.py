@@ -0,0 +1,22 @@
+# Generated by Django 3.2.12 on 2026-10-17 22:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0022_post_has_diff'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexQueue',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uid', models.CharField(db_index=True, max_length=32)),
+                ('op', models.IntegerField(choices=[(0, 'Upsert'), (1, 'Delete')], default=0)),
+                ('date', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.2.12 on 2026-10-17 22:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0023_index_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarPosts',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uid', models.CharField(max_length=32, unique=True)),
+                ('uids', models.TextField(blank=True, default='')),
+                ('date', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.12 on 2026-10-17 23:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0024_similar_posts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Embed',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.CharField(max_length=1024, unique=True)),
+                ('html', models.TextField(blank=True, default='')),
+                ('title', models.CharField(blank=True, default='', max_length=256)),
+                ('status', models.IntegerField(choices=[(0, 'Pending'), (1, 'Found'), (2, 'Missing')], default=0)),
+                ('date', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 3.2.12 on 2026-10-18 00:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Post types and states at the time of the migration.
+QUESTION, OPEN = 0, 1
+TOPIC_TYPES = dict(question=0, jobs=2, tutorials=8, forum=3, planet=5, tools=10, news=11, pages=4, herald=12)
+
+
+def fill_listing(apps, schema_editor):
+    Post = apps.get_model('forum', 'Post')
+    Listing = apps.get_model('forum', 'Listing')
+
+    posts = Post.objects.filter(is_toplevel=True, status=OPEN).values_list('id', 'type', 'answer_count', 'rank')
+
+    entries = []
+    for pk, ptype, answer_count, rank in posts.iterator():
+        topics = ['latest'] + [topic for topic, value in TOPIC_TYPES.items() if value == ptype]
+        if ptype == QUESTION and answer_count == 0:
+            topics.append('open')
+        entries.extend(Listing(topic=topic, post_id=pk, rank=rank) for topic in topics)
+
+        if len(entries) >= 1000:
+            Listing.objects.bulk_create(entries)
+            entries = []
+
+    Listing.objects.bulk_create(entries)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0025_embed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Listing',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('topic', models.CharField(max_length=32)),
+                ('rank', models.FloatField(default=0)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='forum.post')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['topic', '-rank'], name='forum_listi_topic_b2d461_idx'),
+        ),
+        migrations.RunPython(fill_listing, migrations.RunPython.noop),
+    ]
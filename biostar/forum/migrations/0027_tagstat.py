@@ -0,0 +1,65 @@
+# Generated by Django 3.2.12 on 2026-10-18 01:10
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+from django.utils import timezone
+import django.db.models.deletion
+
+
+def fill_tag_stats(apps, schema_editor):
+    Post = apps.get_model('forum', 'Post')
+    TagStat = apps.get_model('forum', 'TagStat')
+    TaggedItem = apps.get_model('taggit', 'TaggedItem')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+
+    # No posts were tagged yet in a new database.
+    ctype = ContentType.objects.filter(app_label='forum', model='post').first()
+    if not ctype:
+        return
+
+    now = timezone.now()
+    since = now - timedelta(weeks=getattr(settings, 'TAG_RECENT_WEEKS', 24))
+    top = Post.objects.filter(is_toplevel=True)
+    recent = top.filter(lastedit_date__gt=since)
+    posts = dict(total=top, answered=top.filter(answer_count__gt=0), recent=recent,
+                 recent_answered=recent.filter(answer_count__gt=0),
+                 recent_commented=recent.filter(comment_count__gt=0))
+
+    # One grouped query per count, the tagged items are not related to the posts in migrations.
+    stats = {}
+    for field, selected in posts.items():
+        items = TaggedItem.objects.filter(content_type_id=ctype.id, object_id__in=selected.values('id'))
+        for tag_id, count in items.values_list('tag_id').annotate(count=Count('id')).order_by().iterator():
+            stats.setdefault(tag_id, {})[field] = count
+
+    TagStat.objects.bulk_create([TagStat(tag_id=tag_id, date=now, **counts) for tag_id, counts in stats.items()],
+                                batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('taggit', '0003_taggeditem_add_unique_index'),
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('forum', '0026_listing'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagStat',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total', models.IntegerField(db_index=True, default=0)),
+                ('answered', models.IntegerField(default=0)),
+                ('recent', models.IntegerField(default=0)),
+                ('recent_answered', models.IntegerField(default=0)),
+                ('recent_commented', models.IntegerField(default=0)),
+                ('date', models.DateTimeField()),
+                ('tag', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stat', to='taggit.tag')),
+            ],
+        ),
+        migrations.RunPython(fill_tag_stats, migrations.RunPython.noop),
+    ]
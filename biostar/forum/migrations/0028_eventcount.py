@@ -0,0 +1,34 @@
+# Generated by Django 3.2.12 on 2026-10-18 02:05
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_unread(apps, schema_editor):
+    Profile = apps.get_model('accounts', 'Profile')
+    Message = apps.get_model('accounts', 'Message')
+
+    # The unread message counts are kept in the profiles from now on.
+    unread = Message.objects.filter(unread=True).values('recipient_id').annotate(total=Count('id')).order_by()
+    for row in unread.iterator():
+        Profile.objects.filter(user_id=row['recipient_id']).update(new_messages=row['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0026_userlog'),
+        ('forum', '0027_tagstat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(count_unread, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.12 on 2026-10-17 23:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0028_eventcount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='embed',
+            name='posts',
+            field=models.ManyToManyField(blank=True, related_name='pending_embeds', to='forum.Post'),
+        ),
+    ]
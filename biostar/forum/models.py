@@ -1,21 +1,28 @@
+import atexit
 import logging
+import threading
+import time
+from collections import Counter
 from datetime import timedelta
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.sites.models import Site
 from django.core.cache import cache
 from django.core.cache.utils import make_template_fragment_key
-from django.db import models
-from django.db.models import F
+from django.db import models, transaction
+from django import db
+from django.db.models import F, Case, When, Value, Count
 from django.db.models import Q
 from django.shortcuts import reverse
 from taggit.managers import TaggableManager
+from taggit.models import Tag
 from urllib.parse import urlparse
 
 from biostar.utils import helpers
 from biostar.accounts.models import Profile
 from biostar.planet.models import BlogPost
 from . import util
+from .const import THREAD_VERSION_KEY, TAG_INDEX_KEY, LATEST, OPEN
 
 User = get_user_model()
 
@@ -68,7 +75,7 @@ def delete_fragment_cache(key, *params):
     cache.delete(key)
 
 
-def delete_post_cache(post):
+def delete_post_fragments(post):
     """
     Drops both post specific template fragment caches.
     """
@@ -79,6 +86,37 @@ def delete_post_cache(post):
         delete_fragment_cache("post", False, post.root.uid)
 
 
+def thread_version(uid):
+    """
+    Returns the version of the thread with the given root uid.
+    """
+    key = f"{THREAD_VERSION_KEY}-{uid}"
+    version = cache.get(key)
+
+    # A missing version gets a new value that no cached page has used before.
+    if version is None:
+        cache.add(key, util.get_uuid(limit=8), None)
+        version = cache.get(key)
+
+    return version
+
+
+def bump_thread(uid):
+    """
+    Changes the version of a thread, expiring the cached pages of the thread.
+    """
+    key = f"{THREAD_VERSION_KEY}-{uid}"
+    cache.set(key, util.get_uuid(limit=8), None)
+
+
+def delete_post_cache(post):
+    """
+    Drops the template fragment caches and the cached thread page of a post.
+    """
+    delete_post_fragments(post)
+    bump_thread(post.root.uid if post.root else post.uid)
+
+
 class Post(models.Model):
     "Represents a post in a forum"
 
@@ -230,16 +268,6 @@ class Post(models.Model):
     def is_open(self):
         return self.status == Post.OPEN and not self.is_spam
 
-    def recompute_scores(self):
-        # Recompute answers count
-        if self.type == Post.ANSWER:
-            answer_count = Post.objects.valid_posts(root=self.root, type=Post.ANSWER).count()
-            Post.objects.filter(pk=self.parent_id).update(answer_count=answer_count)
-
-        reply_count = Post.objects.valid_posts(root=self.root).exclude(pk=self.root.pk).count()
-
-        Post.objects.filter(pk=self.root.id).update(reply_count=reply_count)
-
     def json_data(self):
         data = {
             'id': self.id,
@@ -346,26 +374,45 @@ class Post(models.Model):
     def __str__(self):
         return "%s: %s (pk=%s)" % (self.get_type_display(), self.title, self.pk)
 
-    def update_parent_counts(self):
+    @property
+    def is_counted(self):
+        """
+        Replies that are neither deleted nor spam add to the counts of the thread.
+        """
+        return self.root_id != self.pk and not self.is_deleted and not self.is_spam
+
+    def count_fields(self, change=1):
         """
-        Update the counts for the parent and root
+        Returns the root and parent field updates that apply the change to the counts.
         """
+        fields = dict(reply_count=F('reply_count') + change)
+        if self.type == Post.COMMENT:
+            fields['comment_count'] = F('comment_count') + change
+
+        # The root counts every reply in the thread.
+        root_fields = dict(fields)
+        if self.type == Post.ANSWER:
+            root_fields['answer_count'] = F('answer_count') + change
 
-        descendants = Post.objects.filter(root=self.root).exclude(Q(pk=self.root.pk) | Q(status=Post.DELETED)
-                                                                  | Q(spam=Post.SPAM))
-        answer_count = descendants.filter(type=Post.ANSWER).count()
-        comment_count = descendants.filter(type=Post.COMMENT).count()
-        reply_count = descendants.count()
-        # Update the root reply, answer, and comment counts.
-        Post.objects.filter(pk=self.root.pk).update(reply_count=reply_count, answer_count=answer_count,
-                                                    comment_count=comment_count)
+        # The parent counts its direct replies.
+        parent_fields = fields if self.parent_id != self.root_id else {}
 
-        children = Post.objects.filter(parent=self.parent).exclude(pk=self.parent.pk)
-        com_count = children.filter(type=Post.COMMENT).count()
+        return root_fields, parent_fields
 
-        # Update parent reply, answer, and comment counts.
-        Post.objects.filter(pk=self.parent.pk, is_toplevel=False).update(comment_count=com_count, answer_count=0,
-                                                                         reply_count=children.count())
+    def update_counts(self, change=1):
+        """
+        Applies the change to the reply, answer and comment counts of the root and parent.
+        """
+        root_fields, parent_fields = self.count_fields(change=change)
+
+        Post.objects.filter(pk=self.root_id).update(**root_fields)
+
+        if parent_fields:
+            Post.objects.filter(pk=self.parent_id).update(**parent_fields)
+
+        # Answers move the root in and out of the open listing.
+        if self.type == Post.ANSWER:
+            update_listing([self.root_id])
 
     @property
     def css(self):
@@ -426,6 +473,357 @@ class PostView(models.Model):
     date = models.DateTimeField(auto_now_add=True)
 
 
+class IndexQueue(models.Model):
+    """
+    Change-log of posts waiting to be applied to the search index.
+    """
+    UPSERT, DELETE = range(2)
+    OP_CHOICES = [(UPSERT, "Upsert"), (DELETE, "Delete")]
+
+    # The uid of the post that changed.
+    uid = models.CharField(max_length=32, db_index=True)
+
+    # The operation to apply to the search index.
+    op = models.IntegerField(choices=OP_CHOICES, default=UPSERT)
+
+    # Date the change was recorded.
+    date = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.get_op_display()}: {self.uid}"
+
+
+def queue_index(uids, op=IndexQueue.UPSERT):
+    """
+    Records post changes that the search indexer will pick up.
+    """
+    entries = [IndexQueue(uid=uid, op=op) for uid in uids if uid]
+    IndexQueue.objects.bulk_create(entries)
+
+
+class SimilarPosts(models.Model):
+    """
+    Precomputed list of posts that are similar to a top level post.
+    """
+
+    # The uid of the top level post.
+    uid = models.CharField(max_length=32, unique=True)
+
+    # Comma separated uids of the similar posts, most similar first.
+    uids = models.TextField(default='', blank=True)
+
+    # Date the list was computed.
+    date = models.DateTimeField()
+
+    def __str__(self):
+        return f"Similar to {self.uid}"
+
+    def save(self, *args, **kwargs):
+        self.date = self.date or util.now()
+        super(SimilarPosts, self).save(*args, **kwargs)
+
+
+class Embed(models.Model):
+    """
+    Embedded html and page titles fetched from external urls.
+    """
+    PENDING, FOUND, MISSING = range(3)
+    STATUS_CHOICES = [(PENDING, "Pending"), (FOUND, "Found"), (MISSING, "Missing")]
+
+    # The url that was fetched.
+    url = models.CharField(max_length=MAX_FIELD_LEN, unique=True)
+
+    # The html embedded in place of the url.
+    html = models.TextField(blank=True, default='')
+
+    # The title of the page.
+    title = models.CharField(max_length=MAX_NAME_LEN, blank=True, default='')
+
+    status = models.IntegerField(choices=STATUS_CHOICES, default=PENDING)
+
+    # Posts rendered while the embed was pending, rendered again once fetched.
+    posts = models.ManyToManyField(Post, blank=True, related_name="pending_embeds")
+
+    # Date of the last fetch, or of the request while pending.
+    date = models.DateTimeField()
+
+    def save(self, *args, **kwargs):
+        self.date = self.date or util.now()
+        super(Embed, self).save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.get_status_display()}: {self.url}"
+
+
+class Listing(models.Model):
+    """
+    Ordered post ids of the public post listings, one row for each topic a post is listed under.
+    """
+
+    # Listing topics of the post types.
+    TOPIC_TYPES = dict(
+        question=Post.QUESTION,
+        jobs=Post.JOB,
+        tutorials=Post.TUTORIAL,
+        forum=Post.FORUM,
+        planet=Post.BLOG,
+        tools=Post.TOOL,
+        news=Post.NEWS,
+        pages=Post.PAGE,
+        herald=Post.HERALD
+    )
+
+    # Topics served from the listing.
+    TOPICS = {LATEST, OPEN, *TOPIC_TYPES}
+
+    topic = models.CharField(max_length=32)
+
+    post = models.ForeignKey(Post, on_delete=models.CASCADE)
+
+    # The rank of the post, the listing is ordered by it.
+    rank = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=['topic', '-rank'])]
+
+    @staticmethod
+    def topics(post):
+        """
+        Returns the topics that list the post.
+        """
+        if not post.is_toplevel or post.status != Post.OPEN:
+            return []
+
+        topics = [LATEST]
+        topics += [topic for topic, ptype in Listing.TOPIC_TYPES.items() if ptype == post.type]
+
+        # Open questions have no answers yet.
+        if post.type == Post.QUESTION and post.answer_count == 0:
+            topics.append(OPEN)
+
+        return topics
+
+
+def update_listing(ids):
+    """
+    Applies the current state of the posts to the listings.
+    """
+    ids = [pk for pk in ids if pk]
+    if not ids:
+        return
+
+    posts = Post.objects.filter(id__in=ids).only('id', 'type', 'status', 'is_toplevel', 'answer_count', 'rank')
+    entries = [Listing(topic=topic, post_id=post.id, rank=post.rank) for post in posts
+               for topic in Listing.topics(post)]
+
+    with transaction.atomic():
+        Listing.objects.filter(post_id__in=ids).delete()
+        Listing.objects.bulk_create(entries)
+
+
+class TagStat(models.Model):
+    """
+    Post counts of a tag, kept up to date as posts are tagged and rebuilt nightly.
+    """
+    tag = models.OneToOneField(Tag, on_delete=models.CASCADE, related_name="stat")
+
+    # Top level posts with the tag.
+    total = models.IntegerField(default=0, db_index=True)
+
+    # Top level posts with the tag that have answers.
+    answered = models.IntegerField(default=0)
+
+    # Counts of the top level posts edited within the recent window.
+    recent = models.IntegerField(default=0)
+    recent_answered = models.IntegerField(default=0)
+    recent_commented = models.IntegerField(default=0)
+
+    # Date the counts were computed.
+    date = models.DateTimeField()
+
+    def __str__(self):
+        return self.tag.name
+
+    def save(self, *args, **kwargs):
+        self.date = self.date or util.now()
+        super(TagStat, self).save(*args, **kwargs)
+
+
+def tag_counts(tags, since):
+    """
+    Annotates the tags with the counts of their top level posts, recent counts start at the since date.
+    """
+    top = Q(post__is_toplevel=True)
+    recent = top & Q(post__lastedit_date__gt=since)
+
+    return tags.annotate(total=Count('post', filter=top),
+                         answered=Count('post', filter=top & Q(post__answer_count__gt=0)),
+                         recent=Count('post', filter=recent),
+                         recent_answered=Count('post', filter=recent & Q(post__answer_count__gt=0)),
+                         recent_commented=Count('post', filter=recent & Q(post__comment_count__gt=0)))
+
+
+def update_tag_stats(ids):
+    """
+    Recomputes the statistics of the tags with one grouped query.
+    """
+    ids = [pk for pk in ids if pk]
+    if not ids:
+        return
+
+    now = util.now()
+    since = now - timedelta(weeks=settings.TAG_RECENT_WEEKS)
+    tags = tag_counts(Tag.objects.filter(id__in=ids), since=since)
+    stats = [TagStat(tag_id=tag.id, total=tag.total, answered=tag.answered, recent=tag.recent,
+                     recent_answered=tag.recent_answered, recent_commented=tag.recent_commented, date=now)
+             for tag in tags]
+
+    with transaction.atomic():
+        existing = set(TagStat.objects.filter(tag_id__in=ids).values_list('tag_id', flat=True))
+        TagStat.objects.filter(tag_id__in=ids).delete()
+        TagStat.objects.bulk_create(stats)
+
+    # New tags are searchable right away, changed counts wait for the index to expire.
+    if {stat.tag_id for stat in stats} != existing:
+        bump_tag_index()
+
+
+def bump_tag_index():
+    """
+    Makes every process reload its tag autocomplete index.
+    """
+    cache.set(TAG_INDEX_KEY, util.get_uuid(8), None)
+
+
+class EventCount(models.Model):
+    """
+    Running total of an event for the whole site or for one user, kept by the code creating the events.
+    """
+    name = models.CharField(max_length=50, unique=True)
+
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}={self.value}"
+
+
+def count_events(names, change=1):
+    """
+    Adds the change to the totals of the named events.
+    """
+    names = set(names)
+    if not names:
+        return
+
+    updated = EventCount.objects.filter(name__in=names).update(value=F('value') + change)
+
+    # The first event of a name creates its total.
+    if updated < len(names):
+        existing = set(EventCount.objects.filter(name__in=names).values_list('name', flat=True))
+        created = [EventCount(name=name, value=change) for name in names - existing]
+        EventCount.objects.bulk_create(created, ignore_conflicts=True)
+
+
+class ViewCounter:
+    """
+    Collects post views in memory and writes them to the database in batches.
+    """
+
+    def __init__(self, size=None, interval=None, timer=False):
+        self.lock = threading.Lock()
+        self.size = size or settings.POST_VIEW_BUFFER_SIZE
+        self.interval = interval or settings.POST_VIEW_FLUSH_INTERVAL
+        self.timer = timer
+        self.thread = None
+        self.hits = []
+        self.last = time.time()
+
+    def add(self, post_id, ip):
+        """
+        Records a view, flushes the buffer when full or too old.
+        """
+        if self.timer and not self.thread:
+            self.start()
+
+        with self.lock:
+            self.hits.append((post_id, ip))
+            ready = len(self.hits) >= self.size or time.time() - self.last >= self.interval
+
+        if ready:
+            self.flush()
+
+    def start(self):
+        """
+        Starts the thread that flushes the views of a quiet process,
+        the remaining views are written when the process exits.
+        """
+        with self.lock:
+            if self.thread:
+                return
+            self.thread = threading.Thread(target=self.run, daemon=True)
+
+        self.thread.start()
+        atexit.register(self.flush)
+
+        # Reloaded uWSGI workers may not run the Python exit handlers.
+        try:
+            import uwsgi
+        except ImportError:
+            return
+
+        hook = getattr(uwsgi, "atexit", None)
+
+        def finish():
+            self.flush()
+            if hook:
+                hook()
+
+        uwsgi.atexit = finish
+
+    def run(self):
+        ticker = threading.Event()
+        while not ticker.wait(self.interval):
+            try:
+                if time.time() - self.last >= self.interval:
+                    self.flush()
+            except Exception as exc:
+                logger.error(f"flushing post views: {exc}")
+            finally:
+                db.connection.close()
+
+    def flush(self):
+        """
+        Inserts the buffered views and increments the view counts with a single update.
+        """
+        with self.lock:
+            hits, self.hits = self.hits, []
+            self.last = time.time()
+
+        if not hits:
+            return 0
+
+        counts = Counter(post_id for post_id, ip in hits)
+
+        # Posts may have been deleted since they were viewed.
+        valid = set(Post.objects.filter(id__in=counts).values_list("id", flat=True))
+        if not valid:
+            return 0
+
+        views = [PostView(post_id=post_id, ip=ip) for post_id, ip in hits if post_id in valid]
+        delta = Case(*[When(id=post_id, then=Value(counts[post_id])) for post_id in valid],
+                     output_field=models.IntegerField())
+
+        with transaction.atomic():
+            PostView.objects.bulk_create(views)
+            Post.objects.filter(id__in=valid).update(view_count=F('view_count') + delta)
+
+        return len(views)
+
+
+# Buffered post views of the current process.
+VIEWS = ViewCounter(timer=settings.POST_VIEW_TIMER)
+
+
 def update_post_views(post, request, timeout=settings.POST_VIEW_TIMEOUT):
     """
     Views are updated per interval.
@@ -441,18 +839,15 @@ def update_post_views(post, request, timeout=settings.POST_VIEW_TIMEOUT):
     if cache.get(cache_key):
         return
 
-    # Insert a new view into database.
-    PostView.objects.create(ip=ip, post=post)
-
-    # Separately increment post view.
-    Post.objects.filter(id=post.id).update(view_count=F('view_count') + 1)
+    # Buffer the view, the database is updated in batches.
+    VIEWS.add(post_id=post.id, ip=ip)
 
     # Set the cache.
     cache.set(cache_key, 1, timeout)
 
     # Drop the post related cache for logged in users.
     if request.user.is_authenticated:
-        delete_post_cache(post)
+        delete_post_fragments(post)
 
     return post
 
@@ -16,7 +16,8 @@ from django.conf import settings
 from biostar.accounts.views import user_moderate as account_moderate
 from biostar.accounts.models import Profile, User
 from biostar.utils.decorators import check_params
-from biostar.forum.models import Post, delete_post_cache, Log
+from biostar.forum.models import Post, delete_post_cache, bump_thread, Log, IndexQueue, queue_index, \
+    update_listing, count_events
 from biostar.forum import auth, const, util
 
 
@@ -174,17 +175,16 @@ def delete_post(request, post, **kwargs):
         # Deleted children should return root url.
         url = "/" if post.is_toplevel else post.root.get_absolute_url()
     else:
+        # Take the post out of the counts of the thread.
+        if post.is_counted:
+            post.update_counts(change=-1)
         Post.objects.filter(uid=post.uid).update(status=Post.DELETED)
-        post.recompute_scores()
+        queue_index(uids=[post.uid], op=IndexQueue.DELETE)
         msg = f"deleted post"
         messages.info(request, mark_safe(msg))
         auth.db_logger(user=user, post=post, text=msg)
         url = post.get_absolute_url()
 
-    # Recompute post score.
-    if not post.is_toplevel:
-        post.root.recompute_scores()
-
     return url
 
 
@@ -193,10 +193,15 @@ def open(request, post, **kwargs):
         post.author.profile.bump_over_threshold()
 
     user = request.user
+    counted = post.is_counted
     Post.objects.filter(uid=post.uid).update(status=Post.OPEN, spam=Post.NOT_SPAM)
-    post.recompute_scores()
+    queue_index(uids=[post.uid])
+
+    # Add the reopened post back to the counts of the thread.
+    post.status, post.spam = Post.OPEN, Post.NOT_SPAM
+    if post.is_counted and not counted:
+        post.update_counts()
 
-    post.root.recompute_scores()
     msg = f"opened post"
     url = post.get_absolute_url()
     messages.info(request, mark_safe(msg))
@@ -264,15 +269,26 @@ def toggle_spam(request, post, **kwargs):
     # Drop the cache for the post.
     delete_post_cache(post)
 
+    # The post counts towards the thread before the toggle.
+    counted = post.is_counted
+
     # Current state of the toggle.
     if post.is_spam:
         Post.objects.filter(id=post.id).update(spam=Post.NOT_SPAM, status=Post.OPEN)
     else:
         Post.objects.filter(id=post.id).update(spam=Post.SPAM, status=Post.CLOSED)
+        count_events([const.SPAM_COUNT])
 
     # Refetch up to date state of the post.
     post = Post.objects.filter(id=post.id).get()
 
+    # Apply the toggle to the counts of the thread.
+    if post.is_counted != counted:
+        post.update_counts(change=1 if post.is_counted else -1)
+
+    # Apply the toggle to the post listings.
+    update_listing([post.root_id or post.id])
+
     # Set the state for the user (only non moderators are affected)
     state = Profile.SUSPENDED if post.is_spam else Profile.NEW
 
@@ -282,11 +298,12 @@ def toggle_spam(request, post, **kwargs):
     # Generate logging messages.
     if post.is_spam:
         text = f"marked post as spam"
+        # Remove the spam from the search index.
+        queue_index(uids=[post.uid], op=IndexQueue.DELETE)
     else:
         text = f"restored post from spam"
-
-        # Set indexed flag to False, so it's removed from spam index
-        Post.objects.filter(id=post.id).update(indexed=False)
+        # Add the restored post back into the search index.
+        queue_index(uids=[post.uid])
 
     # Set a logging message.
     messages.success(request, text)
@@ -306,6 +323,7 @@ def close(request, post, **kwargs):
     """
     user = request.user
     Post.objects.filter(uid=post.uid).update(status=Post.CLOSED)
+    queue_index(uids=[post.uid], op=IndexQueue.DELETE)
     # Generate a rationale post on why this post is closed.
     rationale = mod_rationale(post=post, user=user,
                               template="messages/closed.md")
@@ -352,6 +370,11 @@ def relocate(request, post, **kwds):
         messages.warning(request, "cannot relocate a top level post")
         return url
 
+    # Take the post out of the counts of the old parent.
+    counted = post.is_counted
+    if counted:
+        post.update_counts(change=-1)
+
     if post.type == Post.COMMENT:
         msg = f"relocated comment to answer"
         post.type = Post.ANSWER
@@ -361,7 +384,10 @@ def relocate(request, post, **kwds):
 
     post.parent = post.root
     post.save()
-    post.update_parent_counts()
+
+    # Add the post to the counts of the new parent.
+    if counted:
+        post.update_counts()
 
     auth.db_logger(user=request.user, post=post, text=f"{msg}")
     messages.info(request, msg)
@@ -383,7 +409,14 @@ def moderate(request, post, action):
 
     if action in action_map:
         mod_func = action_map[action]
+        # The action may delete the post, take the thread before.
+        root_uid = post.root.uid if post.root else post.uid
+        root_id = post.root_id or post.id
         url = mod_func(request=request, post=post)
+        # Expire the cached pages of the thread.
+        bump_thread(root_uid)
+        # Apply the action to the post listings.
+        update_listing([root_id])
     else:
         url = post.get_absolute_url()
         msg = "Unknown moderation action given."
@@ -18,5 +18,8 @@ set -ue
 # Set the configuration module.
 export DJANGO_SETTINGS_MODULE=conf.run.site_settings
 
-# Add BATCH_SIZE posts to search index
-python manage.py index --size ${BATCH_SIZE}
\ No newline at end of file
+# Apply queued post changes to the search index in batches of BATCH_SIZE
+python manage.py index --queue --size ${BATCH_SIZE}
+
+# Precompute similar posts for newly indexed posts.
+python manage.py similar --size ${BATCH_SIZE}
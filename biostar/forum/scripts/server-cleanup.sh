@@ -18,4 +18,7 @@ export DJANGO_SETTINGS_MODULE=conf.run.site_settings
 
 python manage.py cleanup
 
+# Verify the reply counts of the threads.
+python manage.py recount
+
 python manage.py sitemap
\ No newline at end of file
@@ -1,11 +1,14 @@
+import hashlib
 import logging
 import os
+import threading
 import time
 from itertools import count, islice
 from collections import defaultdict
 
 # Postgres specific queries should go into separate module.
 from django.conf import settings
+from django.core.cache import cache
 from django.db.models import Q
 from whoosh import writing, classify
 from whoosh.analysis import StemmingAnalyzer, StopFilter
@@ -19,7 +22,9 @@ from whoosh.index import create_in, open_dir, exists_in
 from whoosh.fields import ID, TEXT, KEYWORD, Schema, BOOLEAN, NUMERIC, DATETIME
 
 from biostar.utils.helpers import htmltomarkdown
-from biostar.forum.models import Post
+from biostar.forum.models import Post, IndexQueue, SimilarPosts
+from biostar.forum import util
+from biostar.forum.const import SEARCH_CACHE_KEY
 
 logger = logging.getLogger('engine')
 
@@ -121,6 +126,71 @@ def init_index(dirname=None, indexname=None, schema=None):
     return ix
 
 
+class SearcherPool(object):
+    """
+    Process wide index handle with a pool of open searchers.
+    Searchers are reused between queries and only refreshed when the index generation changes,
+    the refresh reopens just the segments that changed.
+    """
+
+    def __init__(self, size=None):
+        self.size = size
+        self.lock = threading.Lock()
+        self.ix = None
+        self.location = None
+        self.idle = []
+
+    def index(self):
+        """
+        Returns the shared index handle, reopened only when the index location changes.
+        """
+        location = (settings.INDEX_DIR, settings.INDEX_NAME)
+
+        with self.lock:
+            if self.ix is None or self.location != location:
+                # Searchers opened on another index may not be reused.
+                for searcher in self.idle:
+                    searcher.close()
+                self.idle = []
+                self.ix = init_index(dirname=location[0], indexname=location[1])
+                self.location = location
+
+            return self.ix
+
+    def acquire(self):
+        """
+        Returns an up to date searcher from the pool.
+        """
+        ix = self.index()
+
+        with self.lock:
+            searcher = self.idle.pop() if self.idle else None
+
+        if searcher is None:
+            return ix.searcher()
+
+        # Returns the same searcher when the index generation is unchanged.
+        return searcher.refresh()
+
+    def release(self, searcher):
+        """
+        Returns a searcher to the pool, closing it when the pool is full.
+        """
+        size = self.size or settings.SEARCHER_POOL_SIZE
+
+        with self.lock:
+            reusable = searcher._ix is self.ix and not searcher.is_closed
+            if reusable and len(self.idle) < size:
+                self.idle.append(searcher)
+                return
+
+        searcher.close()
+
+
+# Searchers shared by the current process.
+POOL = SearcherPool()
+
+
 def print_info(dirname=None, indexname=None):
     """
     Prints information on the index.
@@ -197,20 +267,63 @@ def crawl(reindex=False, overwrite=False, limit=1000):
     return
 
 
+def process_queue(writer, limit=None):
+    """
+    Applies one batch of the index change-log to the search index.
+    Repeated changes to the same post are coalesced into a single update.
+    Returns the number of change-log entries processed.
+    """
+
+    limit = limit or settings.BATCH_INDEXING_SIZE
+
+    # Oldest changes first.
+    entries = IndexQueue.objects.order_by('pk').values_list('pk', 'uid', 'op')[:limit]
+    entries = list(entries)
+
+    if not entries:
+        return 0
+
+    # The most recent change to a post wins.
+    ops = {uid: op for pk, uid, op in entries}
+
+    upserts = [uid for uid, op in ops.items() if op == IndexQueue.UPSERT]
+    posts = Post.objects.valid_posts(uid__in=upserts, is_toplevel=True).select_related("author__profile")
+
+    indexed = set()
+    for post in posts:
+        add_index(post=post, writer=writer)
+        indexed.add(post.uid)
+
+    # Deleted posts and posts that are no longer valid are dropped from the index.
+    for uid in ops.keys() - indexed:
+        writer.delete_by_term('uid', uid)
+
+    writer.commit()
+
+    # Remove the processed entries from the change-log.
+    IndexQueue.objects.filter(pk__in=[pk for pk, uid, op in entries]).delete()
+    Post.objects.filter(uid__in=indexed).update(indexed=True)
+
+    logger.debug(f"Indexed {len(indexed)} posts from {len(entries)} queued changes")
+
+    return len(entries)
+
+
 def whoosh_search(query, limit=10, page=1, ix=None, fields=None, reverse=False, sortedby=[], **kwargs):
     """
     Query search index
     """
 
     fields = fields or ['tags', 'title', 'content', 'author']
-    ix = ix or init_index()
-    searcher = ix.searcher()
+
+    # Searchers on the shared index come from the pool.
+    searcher = ix.searcher() if ix else POOL.acquire()
 
     # Splits the query into words and applies
     # and OR filter, eg. 'foo bar' == 'foo OR bar'
     orgroup = OrGroup
 
-    parser = MultifieldParser(fieldnames=fields, schema=ix.schema, group=orgroup).parse(query)
+    parser = MultifieldParser(fieldnames=fields, schema=searcher.schema, group=orgroup).parse(query)
 
     hits = searcher.search_page(parser,pagenum=page, pagelen=limit, reverse=reverse, sortedby=sortedby, **kwargs)
     hits.results.fragmenter.maxchars = 100
@@ -219,13 +332,47 @@ def whoosh_search(query, limit=10, page=1, ix=None, fields=None, reverse=False,
     return hits
 
 
+class CachedPage(object):
+    """
+    The paging information of a search result page, safe to store in the cache.
+    """
+
+    def __init__(self, pagenum, pagecount, total):
+        self.pagenum = pagenum
+        self.pagecount = pagecount
+        self.total = total
+
+    def is_last_page(self):
+        return self.pagecount == 0 or self.pagenum == self.pagecount
+
+
+def search_cache_key(query, page, fields, reverse, sortedby, limit):
+    """
+    Cache key for a search, tied to the current index generation.
+    """
+    # Extra whitespace does not change the query.
+    query = ' '.join(query.split())
+    generation = POOL.index().latest_generation()
+    params = f"{query}|{page}|{fields}|{reverse}|{sortedby}|{limit}"
+    digest = hashlib.md5(params.encode('utf-8')).hexdigest()
+
+    return f"{SEARCH_CACHE_KEY}-{generation}-{digest}"
+
+
 def perform_search(query, page=1, fields=None, reverse=False, sortedby=[], limit=None):
     """
-    Utility functions to search whoosh index, collect results and closes
+    Utility functions to search whoosh index, collect results and closes.
+    Highlighted results are cached until the next commit to the index.
     """
 
     limit = limit or settings.SEARCH_LIMIT
 
+    cache_key = search_cache_key(query=query, page=page, fields=fields, reverse=reverse, sortedby=sortedby,
+                                 limit=limit)
+    found = cache.get(cache_key)
+    if found is not None:
+        return found
+
     indexed = whoosh_search(query=query, fields=fields, page=page, reverse=reverse, sortedby=sortedby, limit=limit)
 
     # Highlight the whoosh results.
@@ -233,9 +380,14 @@ def perform_search(query, page=1, fields=None, reverse=False, sortedby=[], limit
 
     final = list(map(copier, indexed))
 
-    indexed.results.searcher.close()
+    # Keep only the paging information.
+    paging = CachedPage(pagenum=indexed.pagenum, pagecount=indexed.pagecount, total=indexed.total)
+
+    POOL.release(indexed.results.searcher)
 
-    return final, indexed
+    cache.set(cache_key, (final, paging), settings.SEARCH_CACHE_TIMEOUT)
+
+    return final, paging
 
 
 def more_like_this(uid, top=0, sortedby=[]):
@@ -254,11 +406,62 @@ def more_like_this(uid, top=0, sortedby=[]):
     else:
         final = []
 
-    found.results.searcher.close()
+    POOL.release(found.results.searcher)
 
     return final
 
 
+def update_similar(uids, top=0):
+    """
+    Computes and stores the posts most similar to each of the given posts.
+    Posts missing from the index are skipped.
+    """
+
+    top = top or settings.SIMILAR_FEED_COUNT
+    found = dict()
+
+    searcher = POOL.acquire()
+    try:
+        for uid in uids:
+            docnum = searcher.document_number(uid=uid)
+            if docnum is None:
+                continue
+            hits = searcher.more_like(docnum, "content", top=top)
+            found[uid] = [hit['uid'] for hit in hits]
+    finally:
+        POOL.release(searcher)
+
+    # Replace the previously stored lists.
+    now = util.now()
+    SimilarPosts.objects.filter(uid__in=found.keys()).delete()
+    stored = [SimilarPosts(uid=uid, uids=','.join(values), date=now) for uid, values in found.items()]
+    SimilarPosts.objects.bulk_create(stored)
+
+    return found
+
+
+def get_similar(uid):
+    """
+    Returns posts similar to a post from the precomputed list,
+    computing it if the post has not been processed yet.
+    """
+
+    stored = SimilarPosts.objects.filter(uid=uid).first()
+
+    if stored:
+        uids = stored.uids.split(',') if stored.uids else []
+    else:
+        uids = update_similar(uids=[uid]).get(uid, [])
+
+    posts = Post.objects.valid_posts(uid__in=uids).select_related("author__profile", "lastedit_user__profile")
+
+    # Most similar posts go first.
+    order = {value: idx for idx, value in enumerate(uids)}
+    posts = sorted(posts, key=lambda p: order[p.uid])
+
+    return posts
+
+
 def remove_post(post, ix=None):
     """
     Remove spam from index
@@ -59,12 +59,18 @@ SEARCH_LIMIT = 50
 # Initialize the planet app.
 INIT_PLANET = False
 
+# Seconds to keep search results in the cache, a new index commit also expires them.
+SEARCH_CACHE_TIMEOUT = 3600
+
 # Minimum amount of characters to preform searches
 SEARCH_CHAR_MIN = 1
 
 # How many posts to index in one job.
 BATCH_INDEXING_SIZE = 1000
 
+# How many open searchers each process keeps around.
+SEARCHER_POOL_SIZE = 4
+
 # Add another context processor to first template.
 TEMPLATES[0]['OPTIONS']['context_processors'] += [
     'biostar.forum.context.forum'
@@ -80,9 +86,16 @@ SIMILAR_FEED_COUNT = 30
 
 SESSION_UPDATE_SECONDS = 10
 
-# Maximum number of awards every SESSION_UPDATE_SECONDS.
+# Maximum number of new awards for a user in one award run.
 MAX_AWARDS = 2
 
+# Maximum number of award rounds in one award run, each round gives at most MAX_AWARDS per user.
+MAX_AWARD_ROUNDS = 50
+
+# Users visiting, posting or voting within these many hours are checked for new awards.
+# Awards are given by the periodic 'tasks --action award' command.
+AWARD_CANDIDATE_HOURS = 26
+
 # How many stories to show
 HERALD_LIST_COUNT = 100
 
@@ -118,6 +131,10 @@ EDIT_RATE = '250/h'
 SUBS_RATE = '100/h'
 DIGEST_RATE = '100/h'
 
+# Recount thread votes in a background task instead of on every vote.
+# Votes arriving before the task runs are folded into a single recount.
+DEFER_THREAD_VOTES = False
+
 # Additional middleware.
 MIDDLEWARE += [
     #'biostar.forum.middleware.ban_ip',
@@ -145,9 +162,42 @@ ROOT_URLCONF = 'biostar.forum.urls'
 
 WSGI_APPLICATION = 'biostar.wsgi.application'
 
+# Seconds to keep thread pages rendered for anonymous readers.
+# Any change within the thread expires the page sooner.
+THREAD_CACHE_TIMEOUT = 3600 * 24
+
+# Weeks of post edits counted in the recent tag statistics.
+TAG_RECENT_WEEKS = 24
+
+# Seconds before each process reloads the tag autocomplete index with the latest counts.
+TAG_INDEX_TTL = 600
+
+# How many tags the autocomplete suggests.
+TAG_SEARCH_LIMIT = 10
+
+# Seconds to wait for an external host when fetching embeds and link titles.
+EMBED_TIMEOUT = 5
+
+# Seconds before a fetched embed is refreshed.
+EMBED_TTL = 3600 * 24 * 30
+
+# Seconds before a failed or unfinished fetch is tried again.
+EMBED_RETRY = 3600
+
 # Time between two accesses from the same IP to qualify as a different view (seconds)
 POST_VIEW_TIMEOUT = 300
 
+# Post views are buffered in memory and written in batches.
+# The buffer is written when it holds this many views.
+POST_VIEW_BUFFER_SIZE = 100
+
+# The buffer is also written when older than this interval (seconds).
+POST_VIEW_FLUSH_INTERVAL = 60
+
+# Each process writes its buffer from a timer thread every interval.
+# uWSGI needs enable-threads for the timer to run, see conf/site/site_uwsgi.ini.
+POST_VIEW_TIMER = True
+
 # This flag is used flag situation where a data migration is in progress.
 # Allows us to turn off certain type of actions (for example sending emails).
 DATA_MIGRATION = False
@@ -1,11 +1,16 @@
 import logging
-from django.db.models.signals import post_save, pre_save
+from functools import partial
+from django.db.models.signals import post_save, pre_save, post_delete
 from django.dispatch import receiver
 from taggit.models import Tag
+from django.db import transaction
 from django.db.models import F, Q
 from biostar.accounts.models import Profile, Message, User
-from biostar.forum.models import Post, Award, Subscription, SharedLink, Diff
-from biostar.forum import tasks, auth, util
+from biostar.planet.models import BlogPost
+from biostar.forum.models import Post, Award, Subscription, SharedLink, Diff, IndexQueue, SimilarPosts, queue_index, \
+    delete_post_cache, update_listing, Vote, Log, count_events, bump_tag_index
+from biostar.forum import tasks, auth, util, markdown, embeds
+from biostar.forum.const import VOTES_COUNT, PLANET_COUNT, MOD_COUNT
 
 
 logger = logging.getLogger("engine")
@@ -73,21 +78,44 @@ def ban_user(sender, instance, created, **kwargs):
 
     # Label all posts by a spammer as 'spam'
     if instance.is_spammer:
-        Post.objects.filter(author=instance.user).update(spam=Post.SPAM)
+        posts = Post.objects.filter(author=instance.user)
+        uids = list(posts.values_list("uid", flat=True))
 
+        # Take the posts out of the counts of their threads.
+        for post in posts.exclude(spam=Post.SPAM):
+            if post.is_counted:
+                post.update_counts(change=-1)
 
-@receiver(post_save, sender=Post)
-def finalize_post(sender, instance, created, **kwargs):
+        posts.update(spam=Post.SPAM)
 
-    # Determine the root of the post.
-    root = instance.root if instance.root is not None else instance
+        # Remove the spam from the search index.
+        queue_index(uids=uids, op=IndexQueue.DELETE)
+        update_listing(posts.values_list("root_id", flat=True).distinct())
 
-    # Update last contributor, last editor, and last edit date to the thread
-    Post.objects.filter(uid=root.uid).update(lastedit_user=instance.lastedit_user,
-                                             lastedit_date=instance.lastedit_date)
 
-    # Get newly created subscriptions since the last edit date.
-    subs = Subscription.objects.filter(date__gte=instance.lastedit_date, post=instance.root)
+def on_commit(func, **kwargs):
+    """
+    Runs the function once the current transaction is committed.
+    """
+    transaction.on_commit(partial(func, **kwargs))
+
+
+def subscribe_mentions(post):
+    """
+    Subscribes the users mentioned in a new top level post.
+    """
+    handles = markdown.mentioned_handles(post.content)
+    if not handles:
+        return
+    for user in User.objects.filter(profile__handle__in=handles).select_related("profile"):
+        auth.create_subscription(post=post, user=user, update=True, recount=False)
+
+
+@receiver(post_save, sender=Post)
+def finalize_post(sender, instance, created, **kwargs):
+
+    # Field updates to the post, its root and its parent, at most one update per row.
+    fields, root_fields, parent_fields = dict(), dict(), dict()
     extra_context = dict()
 
     if created:
@@ -105,65 +133,149 @@ def finalize_post(sender, instance, created, **kwargs):
         if instance.parent.type in (Post.ANSWER, Post.COMMENT):
             instance.type = Post.COMMENT
 
+        # The type may have changed above.
+        instance.is_toplevel = instance.type in Post.TOP_LEVEL
+
         # Sanity check.
         assert instance.root and instance.parent
 
-        # Make the last editor first in the list of contributors
-        # Done on post creation to avoid moderators being added for editing a post.
-        instance.root.thread_users.remove(instance.lastedit_user)
-        instance.root.thread_users.add(instance.lastedit_user)
-
         # Update this post rank on create and not every edit.
         instance.rank = instance.lastedit_date.timestamp()
 
-        # Save the instance.
-        instance.save()
-        instance.update_parent_counts()
+        fields.update(uid=instance.uid, root=instance.root, parent=instance.parent,
+                      type=instance.type, is_toplevel=instance.is_toplevel, rank=instance.rank)
+
+    # Determine the root of the post.
+    root = instance.root if instance.root is not None else instance
+
+    # Update last contributor, last editor, and last edit date to the thread
+    root_fields.update(lastedit_user=instance.lastedit_user, lastedit_date=instance.lastedit_date)
+
+    # Ensure spam posts get closed status
+    if instance.is_spam and instance.status != Post.CLOSED:
+        instance.status = fields['status'] = Post.CLOSED
+
+    # Title is inherited from top level.
+    title = f"{instance.get_type_display()}: {root.title[:80]}"
+    if not instance.is_toplevel and instance.title != title:
+        instance.title = fields['title'] = title
+
+    with transaction.atomic():
+
+        # Get newly created subscriptions since the last edit date.
+        subs = Subscription.objects.filter(date__gte=instance.lastedit_date, post=root)
+
+        if created:
+            # Make the last editor first in the list of contributors
+            # Done on post creation to avoid moderators being added for editing a post.
+            root.thread_users.remove(instance.lastedit_user)
+            root.thread_users.add(instance.lastedit_user)
+
+            # Add the post to the counts of the thread.
+            if instance.is_counted:
+                counts, parent_fields = instance.count_fields()
+                root_fields.update(counts)
 
-        # Bump the root rank when a new answer is added.
-        if instance.is_answer:
-            Post.objects.filter(uid=instance.root.uid).update(rank=util.now().timestamp())
+            # Bump the root rank when a new answer is added.
+            if instance.is_answer:
+                root_fields['rank'] = util.now().timestamp()
 
-        # Create subscription to the root.
-        auth.create_subscription(post=instance.root, user=instance.author)
+            # Create subscription to the root.
+            auth.create_subscription(post=root, user=instance.author, recount=False)
 
-        # Get all subscribed users when a new post is created
-        subs = Subscription.objects.filter(post=instance.root)
+            # Users mentioned in replies are subscribed while rendering the markdown.
+            if instance.is_toplevel:
+                subscribe_mentions(instance)
 
+            root_fields['subs_count'] = auth.count_subscriptions(root)
+
+            # Get all subscribed users when a new post is created
+            subs = Subscription.objects.filter(post=root)
+
+        # A top level post is its own root.
+        if root.pk == instance.pk:
+            fields.update(root_fields)
+        else:
+            Post.objects.filter(pk=root.pk).update(**root_fields)
+
+        if fields:
+            Post.objects.filter(pk=instance.pk).update(**fields)
+
+        if parent_fields:
+            Post.objects.filter(pk=instance.parent_id).update(**parent_fields)
+
+        # The status, type, rank and answers of the root decide its listings.
+        update_listing([root.pk])
+
+        # Set the tags on the instance when they changed.
+        tag_ids = set()
+        if instance.is_toplevel:
+            names = instance.parse_tags()
+            current = dict(instance.tags.values_list('name', 'id'))
+            if set(names) != {name.lower() for name in current}:
+                instance.tags.set(*names)
+                tag_ids = set(current.values()) | set(instance.tags.values_list('id', flat=True))
+
+        # New answers may change the answered counts of the root tags.
+        if created and instance.is_answer:
+            tag_ids = set(root.tags.values_list('id', flat=True))
+
+        # Queue top level posts for the search indexer.
+        if instance.is_toplevel:
+            op = IndexQueue.DELETE if instance.is_spam else IndexQueue.UPSERT
+            queue_index(uids=[instance.uid], op=op)
+
+        # Exclude current authors from receiving messages from themselves
+        subs = subs.exclude(Q(type=Subscription.NO_MESSAGES) | Q(user=instance.author))
+
+        sub_ids = list(subs.values_list('id', flat=True))
+
+    # The root is known once the post is created.
+    if created:
+        delete_post_cache(instance)
+
+    # The post is rendered again once the embeds it shows as links are fetched.
+    waiting = getattr(instance, "waiting_embeds", [])
+    if waiting:
+        embeds.add_waiting(post=instance, urls=waiting)
+
+    # Tasks are spooled once the post is committed, so that they find it.
+    if created:
         # Notify users who are watching tags in this post
-        tasks.notify_watched_tags.spool(uid=instance.uid, extra_context=extra_context)
+        on_commit(tasks.notify_watched_tags.spool, uid=instance.uid, extra_context=extra_context)
 
         # Send out mailing list when post is created.
-        tasks.mailing_list.spool(uid=instance.uid, extra_context=extra_context)
+        on_commit(tasks.mailing_list.spool, uid=instance.uid, extra_context=extra_context)
 
-    # Set the tags on the instance.
-    if instance.is_toplevel:
-        tags = [Tag.objects.get_or_create(name=name)[0] for name in instance.parse_tags()]
-        instance.tags.clear()
-        instance.tags.add(*tags)
+    # Update the statistics of the tags that were added or removed.
+    if tag_ids:
+        on_commit(tasks.update_tag_stats.spool, ids=list(tag_ids))
 
-    # Ensure spam posts get closed status
-    if instance.is_spam:
-        Post.objects.filter(uid=instance.uid).update(status=Post.CLOSED)
+    # Notify subscribers
+    on_commit(tasks.notify_followers.spool, sub_ids=sub_ids, author_id=instance.author.pk,
+              uid=instance.uid, extra_context=extra_context)
 
-    if not instance.is_toplevel:
-        # Title is inherited from top level.
-        title = f"{instance.get_type_display()}: {instance.root.title[:80]}"
-        Post.objects.filter(uid=instance.uid).update(title=title)
+    # Fetch the embeds missing from the rendered post.
+    for url in getattr(instance, "fetch_embeds", []):
+        on_commit(tasks.fetch_embed.spool, url=url)
+    instance.fetch_embeds = instance.waiting_embeds = []
 
-    # Ensure posts get re-indexed after being edited.
-    Post.objects.filter(uid=instance.uid).update(indexed=False)
 
-    # Exclude current authors from receiving messages from themselves
-    subs = subs.exclude(Q(type=Subscription.NO_MESSAGES) | Q(user=instance.author))
+@receiver(post_delete, sender=Tag)
+def remove_tag(sender, instance, **kwargs):
+    # Deleted tags leave the autocomplete index.
+    bump_tag_index()
 
-    sub_ids = list(subs.values_list('id', flat=True))
 
-    # Notify subscribers
-    tasks.notify_followers.spool(sub_ids=sub_ids,
-                                 author_id=instance.author.pk,
-                                 uid=instance.uid,
-                                 extra_context=extra_context)
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    # Remove deleted posts from the search index.
+    queue_index(uids=[instance.uid], op=IndexQueue.DELETE)
+    SimilarPosts.objects.filter(uid=instance.uid).delete()
+
+    # Take the post out of the counts of the thread.
+    if instance.is_counted:
+        instance.update_counts(change=-1)
 
 
 @receiver(post_save, sender=Post)
@@ -175,4 +287,30 @@ def check_spam(sender, instance, created, **kwargs):
 def link_title(sender, instance, created, **kwargs):
     # Set the title of each link upon creation
     if created:
-        tasks.set_link_title.spool(pk=instance.pk)
\ No newline at end of file
+        tasks.set_link_title.spool(pk=instance.pk)
+
+
+@receiver(post_save, sender=Vote)
+def count_vote(sender, instance, created, **kwargs):
+    # Count the votes the author receives from others.
+    if created and instance.author_id != instance.post.author_id:
+        count_events([f"{VOTES_COUNT}-{instance.post.author_id}"])
+
+
+@receiver(post_save, sender=Log)
+def count_log(sender, instance, created, **kwargs):
+    if created:
+        count_events([MOD_COUNT])
+
+
+@receiver(post_save, sender=BlogPost)
+def count_blog_post(sender, instance, created, **kwargs):
+    if created:
+        count_events([PLANET_COUNT])
+
+
+@receiver(post_save, sender=Message)
+def count_message(sender, instance, created, **kwargs):
+    # Count the unread messages of the recipient.
+    if created and instance.unread:
+        Profile.objects.filter(user_id=instance.recipient_id).update(new_messages=F('new_messages') + 1)
@@ -90,6 +90,63 @@ function autocomplete_users() {
 
 }
 
+function tag_search(text, cb, elem) {
+
+    $.ajax("/ajax/tag/search/",
+        {
+            type: 'GET',
+            dataType: 'json',
+            ContentType: 'application/json',
+            data: {
+                'query': text,
+            },
+            success: function (data) {
+
+                if (data.status === 'error') {
+                    cb([])
+                } else {
+                    var vals = $.map(data.tags, function (value) {
+                        return {
+                            key: value.name,
+                            name: value.name,
+                            count: value.count,
+                        };
+                    });
+                    cb(vals);
+
+                }
+            },
+            error: function (xhr, status, text) {
+                error_message(elem, xhr, status, text);
+            }
+        });
+
+}
+
+function autocomplete_tags() {
+    // Suggest tags for the last tag typed in the tag field.
+    var field = $('#tag_val');
+
+    var tribute = new Tribute({
+        values: function (text, cb) {
+            tag_search(text, cb, field);
+        },
+        autocompleteMode: true,
+        autocompleteSeparator: /,\s*/,
+        menuItemLimit: 10,
+        selectTemplate: function (item) {
+            return item.original.name + ',';
+        },
+        menuItemTemplate: function (item) {
+            return "<b>{0}</b> &times; {1}".format(item.original.name, item.original.count)
+        },
+
+    });
+
+    tribute.attach(field);
+
+}
+
 function drag_and_drop() {
 
     $(".droppable").droppable(
@@ -25,7 +25,7 @@ def notify_watched_tags(uid, extra_context):
     """
     Notify users watching a given tag found in post.
     """
-    from biostar.accounts.models import User
+    from biostar.accounts.models import User, WatchedTag
     from biostar.forum.models import Post
     from django.conf import settings
 
@@ -34,11 +34,11 @@ def notify_watched_tags(uid, extra_context):
     # Update template context with post
     extra_context.update(dict(post=post))
 
-    users = [User.objects.filter(profile__watched__name__iexact=tag.name).distinct()
-             for tag in post.root.tags.all()]
+    # All users watching any of the tags come from the inverted index.
+    names = post.root.tags.values_list('name', flat=True)
+    user_ids = WatchedTag.watchers(names)
 
-    # Flatten nested users queryset and get email.
-    emails = set(u.email for o in users for u in o)
+    emails = set(User.objects.filter(id__in=user_ids).values_list('email', flat=True))
 
     from_email = settings.DEFAULT_NOREPLY_EMAIL
     if emails:
@@ -56,6 +56,32 @@ def created_post(pid):
     pass
 
 
+@task
+def update_thread_votes(root_id):
+    """
+    Recounts all votes in a thread.
+    """
+    from django.core.cache import cache
+    from biostar.forum.models import Post, Vote
+    from biostar.forum.const import THREAD_VOTES_KEY
+
+    # Votes arriving from now on schedule a new recount.
+    cache.delete(f"{THREAD_VOTES_KEY}-{root_id}")
+
+    count = Vote.objects.filter(post__root_id=root_id).count()
+    Post.objects.filter(id=root_id).update(thread_votecount=count)
+
+
+@task
+def update_tag_stats(ids):
+    """
+    Recomputes the statistics of the tags.
+    """
+    from biostar.forum import models
+
+    models.update_tag_stats(ids)
+
+
 # @timer(2)
 # def inner_timer(*args, **kwargs):
 #     print("TIMERRRRR " *10)
@@ -111,62 +137,26 @@ def created_post(pid):
 @task
 def create_user_awards(user_id, limit=None):
     from biostar.accounts.models import User
-    from biostar.forum.models import Award, Badge, Post
-    from biostar.forum.awards import ALL_AWARDS
-    from biostar.forum import util, auth
-    from django.conf import settings
-
-    limit = limit or settings.MAX_AWARDS
-
-    user = User.objects.filter(id=user_id).first()
-    # debugging
-    # Award.objects.all().delete()
-
-    # Collect valid targets
-    valid = auth.valid_awards(user=user)
-
-    # Pick random awards to give to user
-    random.shuffle(valid)
-
-    valid = valid[:limit]
-
-    for target in valid:
-        user, badge, date, post = target
+    from biostar.forum import awards
 
-        # Set the award date to the post edit date
-        date = post.lastedit_date if post else date
+    users = User.objects.filter(id=user_id)
 
-        # Create an award for each target.
-        Award.objects.create(user=user, badge=badge, date=date, post=post)
+    for award in awards.create_awards(users=users, limit=limit):
+        message(f"award {award.badge.name} created for {award.user.email}")
 
-        message(f"award {badge.name} created for {user.email}")
 
+def batch_create_awards(limit=None):
+    """
+    Gives the awards earned by the recently active users, run periodically.
+    Each round gives at most limit awards per user, rounds run until nothing is left to give.
+    """
+    from django.conf import settings
+    from biostar.forum import awards
 
-def batch_create_awards(limit=100):
-    from biostar.accounts.models import User
-    from biostar.forum import auth, models, util
-
-    # Randomly order awards
-    users = User.objects.order_by('?')[:limit]
-
-    # Aggregate target awards into flat list
-    targets = []
-    for u in users:
-        valid = auth.valid_awards(user=u)
-        targets.extend(valid)
-
-    def batch():
-        for target in targets:
-            if not target:
-                continue
-            user, badge, date, post = target
-            award = models.Award(user=user, badge=badge, date=date, post=post)
-            logger.debug(f"awarded {award.badge.name} to {user}")
-
-            yield award
-
-    models.Award.objects.bulk_create(objs=batch(), batch_size=limit)
-    logger.info(f"{len(targets)} awards given to {len(users)} users")
+    users = awards.candidates()
+    for step in range(settings.MAX_AWARD_ROUNDS):
+        if not awards.create_awards(users=users, limit=limit):
+            break
 
 
 def high_trust(user, minscore=50):
@@ -187,35 +177,51 @@ def set_link_title(pk):
     """
     Sets the title of a shared link.
     """
-    import requests
-    from bs4 import BeautifulSoup
+    from biostar.forum import embeds
     from biostar.forum.models import SharedLink
     link = SharedLink.objects.filter(pk=pk).first()
 
     logger.info(f"getting link title for {link.url}")
 
-    try:
-        # Fetch the page.
-        resp = requests.get(link.url)
+    # Titles of known pages are reused.
+    found, fetch = embeds.lookup([link.url])
+    embed = found.get(link.url)
 
-        # Parse the content
-        soup = BeautifulSoup(resp.text, 'html.parser')
+    # Pending embeds have no title yet, the link fetches it.
+    if fetch or not embed.title:
+        embed = embeds.fetch(link.url)
 
-        # Set the title
-        for elem in soup.find_all('title'):
-            title = elem.get_text()
-            if title:
-                title = title.strip()
-                SharedLink.objects.filter(pk=pk).update(title=title)
-                break
+    if embed.title:
+        SharedLink.objects.filter(pk=pk).update(title=embed.title[:200])
 
-    except Exception as exc:
-        logger.warning(exc)
+
+@task
+def fetch_embed(url):
+    """
+    Fetches an embed and renders the posts that show it again.
+    """
+    from biostar.forum import embeds, markdown
+    from biostar.forum.models import Post, Embed, delete_post_cache
+
+    embed = embeds.fetch(url)
+
+    # Only the posts rendered while the embed was pending are rendered again.
+    posts = list(embed.posts.all())
+    embed.posts.clear()
+    if embed.status != Embed.FOUND or not embed.html:
+        return
+
+    for post in posts:
+        html = markdown.parse(post.content, clean=True, escape=False, fetch=False)
+        Post.objects.filter(pk=post.pk).update(html=html)
+        delete_post_cache(post)
 
 
 @task
 def spam_check(uid):
-    from biostar.forum.models import Post, Log, delete_post_cache
+    from biostar.forum.models import Post, Log, IndexQueue, delete_post_cache, queue_index, update_listing, \
+        count_events
+    from biostar.forum.const import SPAM_COUNT
     from biostar.accounts.models import User, Profile
     from biostar.forum.auth import db_logger
 
@@ -263,6 +269,16 @@ def spam_check(uid):
         if flag:
 
             Post.objects.filter(uid=post.uid).update(spam=Post.SPAM, status=Post.CLOSED)
+            count_events([SPAM_COUNT])
+
+            # Take the spam out of the counts of the thread.
+            if post.is_counted:
+                post.update_counts(change=-1)
+
+            # Take the spam out of the post listings.
+            update_listing([post.root_id])
+
+            queue_index(uids=[post.uid], op=IndexQueue.DELETE)
 
             # Get the first admin.
             user = User.objects.filter(is_superuser=True).order_by("pk").first()
@@ -294,35 +310,24 @@ def herald_emails(uid):
     Send emails to herald subscribers
     """
     from biostar.emailer.models import EmailSubscription, EmailGroup
+    from biostar.emailer.tasks import build_edition, send_edition
     from biostar.forum.models import Post
     post = Post.objects.filter(uid=uid).first()
     group = EmailGroup.objects.filter(uid='herald').first()
     # Get active subscriptions to herald.
     subs = EmailSubscription.objects.filter(group=group, state=EmailSubscription.ACTIVE)
 
-    if not subs:
+    if not post or not subs.exists():
         return
 
-    emails = subs.values_list('email', flat=True)
-    context = dict(post=post)
-    # Prepare the templates and emails
+    # Render the post once, then deliver it to every subscriber.
     email_template = "herald/herald_email.html"
+    edition = build_edition(name=f"herald-{post.uid}", template_name=email_template, extra_context=dict(post=post))
+
+    emails = subs.values_list('email', flat=True).iterator()
     author = post.author.profile.name
     from_email = settings.DEFAULT_NOREPLY_EMAIL
-
-    # Total number of recipients allowed per open connection,
-    # Amazon SES has limit of 50
-    batch_size = 40
-
-    # Iterate through recipients and send emails in batches.
-    for idx in range(0, len(emails), batch_size):
-        # Get the next set of emails
-        end = idx + batch_size
-        rec_list = emails[idx:end]
-        send_email(template_name=email_template, extra_context=context, name=author,
-        from_email=from_email,recipient_list=rec_list, mass=True)
-
-    return
+    send_edition(edition=edition, recipients=((email, {}) for email in emails), name=author, from_email=from_email)
 
 
 @task
@@ -333,27 +338,27 @@ def mailing_list(uid, extra_context={}):
     from django.conf import settings
     from biostar.forum.models import Post
     from biostar.accounts.models import User, Profile
+    from biostar.accounts.auth import edition_recipients
+    from biostar.accounts.const import UNSUBSCRIBE_TOKEN
+    from biostar.emailer.tasks import build_edition, send_edition
 
     # Get the post and users that have this enabled.
     post = Post.objects.filter(uid=uid).first()
-    users = User.objects.filter(profile__digest_prefs=Profile.ALL_MESSAGES)
+    users = User.objects.filter(profile__digest_prefs=Profile.ALL_MESSAGES).order_by('id')
 
-    emails = [user.email for user in users]
+    if not post or not users.exists():
+        return
 
     # Update template context with post
-    extra_context.update(dict(post=post))
+    extra_context.update(dict(post=post, unsubscribe=UNSUBSCRIBE_TOKEN))
 
-    # Prepare the templates and emails
+    # The post is rendered once, each email only fills in the unsubscribe link.
     email_template = "messages/mailing_list.html"
+    edition = build_edition(name=f"post-{post.uid}", template_name=email_template, extra_context=extra_context)
+
     author = post.author.profile.name
     from_email = settings.DEFAULT_NOREPLY_EMAIL
-    if emails:
-        send_email(template_name=email_template,
-                   extra_context=extra_context,
-                   name=author,
-                   from_email=from_email,
-                   recipient_list=emails,
-                   mass=True)
+    send_edition(edition=edition, recipients=edition_recipients(users), name=author, from_email=from_email)
 
 
 @task
@@ -380,8 +385,8 @@ def notify_followers(sub_ids, author_id, uid, extra_context={}):
     author = User.objects.filter(id=author_id).first()
     subs = Subscription.objects.filter(id__in=sub_ids)
 
-    users = [sub.user for sub in subs]
-    user_ids = [u.pk for u in users]
+    # Recipient ids are streamed from the database in batches.
+    user_ids = subs.values_list('user_id', flat=True)
 
     # Update template context with post
     extra_context.update(dict(post=post))
@@ -397,10 +402,10 @@ def notify_followers(sub_ids, author_id, uid, extra_context={}):
     # Exclude mailing list users to avoid duplicate emails.
     email_subs = email_subs.exclude(user__profile__digest_prefs=Profile.ALL_MESSAGES)
     # No email subscriptions
-    if not email_subs:
+    recipient_list = list(email_subs.values_list('user__email', flat=True))
+    if not recipient_list:
         return
 
-    recipient_list = [sub.user.email for sub in email_subs]
     from_email = settings.DEFAULT_NOREPLY_EMAIL
 
     send_email(template_name=email_template,
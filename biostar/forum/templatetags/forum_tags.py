@@ -4,13 +4,12 @@ import logging
 import os
 import random
 from datetime import timedelta
-from itertools import count, islice
+from itertools import islice
 
 import bleach
 from django import template, forms
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.paginator import Paginator
 from django.db.models import Count
 from django.shortcuts import reverse
 from django.utils.safestring import mark_safe
@@ -23,6 +22,7 @@ from biostar.accounts.models import Profile, Message
 from biostar.forum import const, auth
 from biostar.utils import helpers
 from biostar.forum import markdown
+from biostar.forum.autocomplete import TAGS
 from biostar.forum.models import Post, Vote, Award, Subscription, Badge
 
 User = get_user_model()
@@ -245,6 +245,7 @@ def unread(message, user):
 @register.simple_tag
 def toggle_unread(user):
     Message.objects.filter(recipient=user, unread=True).update(unread=False)
+    Profile.objects.filter(user=user).update(new_messages=0)
     return ''
 
 
@@ -309,30 +310,11 @@ def inplace_type_field(post=None, field_id='type'):
     return mark_safe(post_type)
 
 
-def get_tags_file():
-    """
-    Get a list of files to render from a file
-    """
-    # Get the tags op
-
-    tags_file = getattr(settings, "TAGS_OPTIONS_FILE", None)
-
-    return tags_file
-
-
 def read_tags(exclude=[], limit=5000):
-    """Read tags from a file. Each line is considered a tag. """
-    # Get tags from a file
-    tags_file = get_tags_file() or ''
-    stream = open(tags_file, 'r') if os.path.exists(tags_file) else []
-    stream = islice(zip(count(1), stream), limit)
-    tags_opts = set()
-
-    for idx, line in stream:
-        line = line.strip()
-        if line in exclude:
-            continue
-        tags_opts.add((line, False))
+    """Tags from the options file, read once per process. """
+    TAGS.refresh()
+    options = islice(TAGS.options, limit)
+    tags_opts = {(name, False) for name in options if name not in exclude}
 
     return tags_opts
 
@@ -432,7 +414,8 @@ def get_post_list(target, request, show=None):
     Return post list belonging to a user
     """
     user = request.user
-    page = request.GET.get("page", 1)
+    after = request.GET.get("after")
+    before = request.GET.get("before")
     posts = Post.objects.valid_posts(u=user, author=target)
 
     # Show a specific post listing.
@@ -444,11 +427,11 @@ def get_post_list(target, request, show=None):
     posts = posts.filter(type=type_filter) if type_filter is not None else posts
 
     posts = posts.select_related("root").select_related("author__profile", "lastedit_user__profile")
-    posts = posts.order_by("-rank")
 
-    # Cache the users posts add pagination to posts.
-    paginator = Paginator(object_list=posts, per_page=settings.POSTS_PER_PAGE)
-    posts = paginator.get_page(page)
+    # Page through the users posts by rank.
+    paginator = helpers.KeysetPaginator(object_list=posts, ordering=("-rank", "-id"),
+                                        per_page=settings.POSTS_PER_PAGE)
+    posts = paginator.get_page(after=after, before=before)
 
     return posts
 
@@ -566,10 +549,13 @@ def relative_url(context, value, field_name, urlencode=None):
     # Check if the param is in biggest common set.
     expect = const.ALLOWED_PARAMS
 
+    # A new cursor replaces the other cursor as well.
+    replaced = const.CURSOR_PARAMS if field_name in const.CURSOR_PARAMS else {field_name}
+
     def apply_filter(param):
         key = param.split('=')[0]
         # Return parameter if in valid const.
-        if key != field_name and key in expect:
+        if key not in replaced and key in expect:
             return param
 
     request = context['request']
@@ -729,7 +715,7 @@ def boxclass(post=None, uid=None):
 
 
 @register.simple_tag(takes_context=True)
-def render_comments(context, tree, post, template_name='widgets/comment_body.html'):
+def render_comments(context, tree, post, template_name='widgets/comment_list.html'):
     request = context["request"]
     if post.id in tree:
         text = traverse_comments(request=request, post=post, tree=tree, template_name=template_name)
@@ -740,31 +726,36 @@ def render_comments(context, tree, post, template_name='widgets/comment_body.htm
 
 
 def traverse_comments(request, post, tree, template_name):
-    "Traverses the tree and generates the page"
+    """
+    Traverses the tree and generates the page.
+    The tree is flattened so that all comments render in a single template pass.
+    A None element in the flat list closes the indentation of the last open comment.
+    """
 
-    body = template.loader.get_template(template_name)
     seen = set()
+    nodes = []
 
-    def traverse(node, collect=[]):
+    # Walk the tree depth first without recursion.
+    stack = list(reversed(tree[post.id]))
+    while stack:
+        node = stack.pop()
 
-        cont = {"post": node, 'user': request.user, 'request': request}
-        html = body.render(cont)
-        collect.append(f'<div class="indent" ><div>{html}</div>')
+        # Closing marker for a comment whose children were all visited.
+        if node is None:
+            nodes.append(None)
+            continue
+
+        nodes.append(node)
+        stack.append(None)
 
-        for child in tree.get(node.id, []):
+        for child in reversed(tree.get(node.id, [])):
             if child in seen:
                 raise Exception(f"circular tree {child.pk} {child.title}")
             seen.add(child)
-            traverse(child, collect=collect)
-
-        collect.append(f"</div>")
+            stack.append(child)
 
-    # this collects the comments for the post
-    collect = ['<div class="comment-list">']
-    for node in tree[post.id]:
-        traverse(node, collect=collect)
-    collect.append("</div>")
-    html = '\n'.join(collect)
+    body = template.loader.get_template(template_name)
+    html = body.render(dict(nodes=nodes, user=request.user, request=request))
 
     return html
 
@@ -781,6 +772,15 @@ def top_level_only(attrs, new=False):
     return attrs
 
 
+def render_file(text):
+    """
+    Renders the markdown of a static page.
+    """
+    html = markdown.parse(text, clean=False, escape=False, allow_rewrite=True)
+    html = bleach.linkify(html, callbacks=[top_level_only], skip_tags=['pre'])
+    return html
+
+
 @register.simple_tag
 def markdown_file(pattern):
     """
@@ -795,9 +795,7 @@ def markdown_file(pattern):
         text = f" file '{pattern}': '{path}' not found"
 
     try:
-
-        html = markdown.parse(text, clean=False, escape=False, allow_rewrite=True)
-        html = bleach.linkify(html, callbacks=[top_level_only], skip_tags=['pre'])
+        html = helpers.RENDERS.render(text, render_file, version=markdown.RENDER_VERSION, page=True)
         html = mark_safe(html)
     except Exception as e:
         html = f"Markdown rendering exception"
@@ -54,6 +54,29 @@ class PostTest(TestCase):
         self.preform_votes(post=self.post, user=self.owner)
         self.preform_votes(post=self.post, user=user2)
 
+    def test_vote_counts(self):
+        """Test the counts maintained by voting"""
+        user2 = User.objects.create(username="user", email="user@tested.com", password="tested")
+
+        answer = models.Post.objects.create(title="answer", author=user2, content="tested foo bar too for",
+                                            type=models.Post.ANSWER, parent=self.post)
+
+        self.preform_votes(post=answer, user=self.owner)
+
+        answer.refresh_from_db()
+        self.post.refresh_from_db()
+        self.assertEqual((answer.vote_count, answer.book_count, answer.accept_count), (3, 1, 1))
+        self.assertEqual((self.post.thread_votecount, self.post.accept_count), (3, 1))
+
+        # Deferred thread counts are recounted once the vote is committed.
+        with self.settings(DEFER_THREAD_VOTES=True), self.captureOnCommitCallbacks(execute=True):
+            self.preform_votes(post=self.post, user=user2)
+
+        self.post.refresh_from_db()
+        total = models.Vote.objects.filter(post__root=self.post).count()
+        self.assertEqual(self.post.thread_votecount, total)
+        self.assertEqual(total, 5)
+
     def test_drag_and_drop(self):
         """
         Test AJAX function used to drag and drop.
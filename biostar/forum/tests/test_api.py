@@ -3,6 +3,7 @@ import os
 import shutil
 import datetime
 from django.core import management
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.urls import reverse
 from django.test import TestCase, override_settings
 from django.conf import settings
@@ -59,4 +60,19 @@ class PostAPITest(TestCase):
         self.assertEqual(response.status_code, 200)
         #self.process_response(response=response)
 
+    def test_tags_list(self):
+        """Test the tag counts read from the statistics and from the posts"""
 
+        with self.captureOnCommitCallbacks(execute=True):
+            models.Post.objects.create(title="Tagged", author=self.owner, content="Tagged",
+                                       tag_val="foo,bar", type=models.Post.QUESTION)
+
+        tags = SimpleUploadedFile("tags.txt", b"foo\nmissing\n")
+        response = self.client.post(reverse("api_tags_list"), data=dict(tags=tags))
+        data = response.json()
+        self.assertEqual(data["foo"], dict(total=1, answer_count=0, comment_count=0))
+        self.assertEqual(data["missing"], dict(total=0, answer_count=0, comment_count=0))
+
+        tags = SimpleUploadedFile("tags.txt", b"foo\n")
+        response = self.client.post(reverse("api_tags_list"), data=dict(tags=tags, months="1"))
+        self.assertEqual(response.json()["foo"]["total"], 1)
@@ -1,8 +1,9 @@
 import logging
 import os
+from unittest.mock import patch, MagicMock
 from django.test import TestCase
 from django.conf import settings
-from biostar.forum import models, markdown
+from biostar.forum import models, markdown, embeds, tasks
 from biostar.accounts.models import User
 
 logger = logging.getLogger('engine')
@@ -111,3 +112,142 @@ class MarkdownTest(TestCase):
 
         # Catch all errors at once.
         self.assertTrue(error_count == 0)
+
+    def test_batched_links(self):
+        """
+        Test that links of the same kind are resolved with a single query.
+        """
+        links = [f"{settings.PROTOCOL}://{SITE_URL}/p/{uid}/ " for uid in ("1", "2", "3")] * 10
+        text = "\n\n".join(links + [f"{settings.PROTOCOL}://{SITE_URL}/u/5 ", "@test"])
+
+        # One query for posts, one for profiles and one for users.
+        with self.assertNumQueries(3):
+            html = markdown.parse(text, clean=True, escape=False)
+
+        self.assertIn(">Test</a>", html)
+        self.assertIn("Post not found", html)
+        self.assertIn(">tested2</a>", html)
+
+    def test_render_cache(self):
+        """
+        Test that the same text is rendered once.
+        """
+        text = f"Render cache {settings.PROTOCOL}://{SITE_URL}/p/1/ "
+
+        with patch("biostar.forum.markdown.render", wraps=markdown.render) as render:
+            first = markdown.parse(text, clean=True, escape=False)
+            second = markdown.parse(text, clean=True, escape=False)
+
+        self.assertEqual(first, second)
+        self.assertEqual(render.call_count, 1)
+
+        # Changing the title of a linked post renders the text again.
+        models.Post.objects.filter(uid="1").update(title="Renamed")
+        self.assertIn(">Renamed</a>", markdown.parse(text, clean=True, escape=False))
+
+    def test_mentions(self):
+        """
+        Test that only mentions outside of code subscribe users.
+        """
+        reader = User.objects.create(username="reader", email="reader@tested.com")
+        reader.profile.handle = "reader"
+        reader.profile.save()
+
+        self.assertEqual(markdown.mentioned_handles("Hi @test, see `@reader` or a@reader"), {"test"})
+
+        content = "Run:\n\n```\nping @reader\n```\n\n    @reader\n"
+        post = models.Post.objects.create(title="Code", author=self.owner, content=content,
+                                          type=models.Post.QUESTION)
+        models.Post.objects.create(title="Answer", author=self.owner, content=content,
+                                   type=models.Post.ANSWER, parent=post)
+        self.assertFalse(models.Subscription.objects.filter(user=reader).exists())
+
+        models.Post.objects.create(title="Answer", author=self.owner, content="Thanks @reader",
+                                   type=models.Post.ANSWER, parent=post)
+        self.assertTrue(models.Subscription.objects.filter(user=reader, post=post).exists())
+
+    def test_embeds(self):
+        """
+        Test that tweets are fetched after saving and rendered into the post.
+        """
+        link = "https://twitter.com/Linux/status/1234567"
+        response = MagicMock()
+        response.json.return_value = dict(html="<blockquote>Tweet</blockquote>")
+
+        with patch("biostar.forum.embeds.requests.get", return_value=response) as get, \
+                self.captureOnCommitCallbacks(execute=True):
+            post = models.Post.objects.create(title="Tweet", author=self.owner, content=link,
+                                              type=models.Post.QUESTION)
+        get.assert_called_once()
+
+        # The post is rendered again once the embed is found.
+        post.refresh_from_db()
+        self.assertIn("<blockquote>Tweet</blockquote>", post.html)
+
+        # Posts shown while another fetch is pending wait on the embed.
+        other = embeds.tweet_url("2345678")
+        models.Embed.objects.create(url=other)
+        with patch("biostar.forum.embeds.requests.get") as get, self.captureOnCommitCallbacks(execute=True):
+            waiting = models.Post.objects.create(title="Waiting", author=self.owner, type=models.Post.QUESTION,
+                                                 content="https://twitter.com/Linux/status/2345678")
+            digits = models.Post.objects.create(title="Digits", author=self.owner, content="Number 2345678",
+                                                type=models.Post.QUESTION)
+        get.assert_not_called()
+        embed = models.Embed.objects.get(url=other)
+        self.assertEqual(list(embed.posts.all()), [waiting])
+
+        # Only the waiting posts are rendered again.
+        html = digits.html
+        with patch("biostar.forum.embeds.requests.get", return_value=response):
+            tasks.fetch_embed(url=other)
+        waiting.refresh_from_db()
+        digits.refresh_from_db()
+        self.assertIn("<blockquote>Tweet</blockquote>", waiting.html)
+        self.assertEqual(digits.html, html)
+        self.assertEqual(embed.posts.count(), 0)
+
+        # Failed fetches are not requested again until they expire.
+        with patch("biostar.forum.embeds.requests.get", side_effect=Exception("timeout")):
+            embed = embeds.fetch(embeds.tweet_url("7654321"))
+
+        self.assertEqual(embed.status, models.Embed.MISSING)
+        found, fetch = embeds.lookup([embed.url])
+        self.assertEqual(fetch, [])
+
+        # Shared links of pending embeds fetch the title.
+        page = MagicMock(text="<title>Page</title>")
+        models.Embed.objects.create(url="https://example.com/page")
+        link = models.SharedLink.objects.create(author=self.owner, url="https://example.com/page")
+        with patch("biostar.forum.embeds.requests.get", return_value=page):
+            tasks.set_link_title(pk=link.pk)
+        link.refresh_from_db()
+        self.assertEqual(link.title, "Page")
+
+    def test_rerender(self):
+        """
+        Test rendering the html of stored posts again.
+        """
+        from biostar.forum.management.commands import markdown as command
+
+        models.Post.objects.filter(pk=self.post.pk).update(html="stale")
+        checkpoint = os.path.join(settings.BASE_DIR, 'export', 'test', 'markdown.checkpoint')
+        if os.path.isfile(checkpoint):
+            os.remove(checkpoint)
+
+        # A dry run leaves the posts alone.
+        self.assertEqual(command.rerender(size=1, workers=0, dry=True, checkpoint=checkpoint), 1)
+        self.assertFalse(os.path.isfile(checkpoint))
+
+        self.assertEqual(command.rerender(size=1, workers=0, checkpoint=checkpoint), 1)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.html, markdown.parse(self.post.content, clean=True, escape=False))
+
+        # Resuming starts after the last saved batch.
+        models.Post.objects.filter(pk=self.post.pk).update(html="stale")
+        self.assertEqual(command.rerender(size=1, workers=0, resume=True, checkpoint=checkpoint), 0)
+        os.remove(checkpoint)
+
+        # Rendering again does not request the missing embeds.
+        pk, html = command.render_post((self.post.pk, "https://twitter.com/Linux/status/3456789"))
+        self.assertIn("3456789", html)
+        self.assertFalse(models.Embed.objects.exists())
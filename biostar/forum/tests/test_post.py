@@ -1,13 +1,22 @@
 import logging
 import os
 import shutil
+import types
+from datetime import timedelta
 from django.core import management
 from django.urls import reverse
 from django.test import TestCase, override_settings
 from django.conf import settings
-from biostar.forum import models, views, search, tasks, feed
+from django.core.cache import cache
+from django.db.models import Count
+from django.db.models.functions import Coalesce
+from unittest.mock import patch
+from biostar.forum import models, views, search, tasks, feed, const, auth, markdown, moderate, autocomplete, awards
+from biostar.forum.management.commands import recount
+from biostar.utils import helpers
 from biostar.utils.helpers import fake_request
-from biostar.accounts.models import User
+from biostar.accounts.models import User, Profile, Message, MessageBody
+from biostar.accounts.const import MESSAGE_COUNT
 
 logger = logging.getLogger('engine')
 
@@ -60,6 +69,53 @@ class PostTest(TestCase):
         self.owner.profile.save()
         tasks.create_user_awards(self.owner.id)
 
+        badges = models.Award.objects.filter(user=self.owner).values_list("badge__name", flat=True)
+        self.assertEqual(list(badges), ["Autobiographer"])
+
+    def test_award_batch(self):
+        """
+        Test giving the awards of many users at once
+        """
+        users = [User.objects.create(username=f"user{step}", email=f"user{step}@tested.com", password="tested")
+                 for step in range(3)]
+        posts = [models.Post.objects.create(title="Question", author=user, content="Question",
+                                            type=models.Post.QUESTION) for user in users]
+
+        models.Post.objects.filter(id=posts[0].id).update(vote_count=3)
+        models.Post.objects.filter(id__in=[posts[1].id, posts[2].id]).update(view_count=2000)
+
+        # Each award runs one query for all users, badges are loaded once.
+        awards.BADGES.clear()
+        with self.assertNumQueries(len(awards.ALL_AWARDS) + 2):
+            created = awards.create_awards(users=awards.candidates(), limit=1)
+
+        given = {(award.user_id, award.badge.name) for award in created}
+        self.assertEqual(given, {(users[0].id, "Student"), (users[1].id, "Popular Question"),
+                                 (users[2].id, "Popular Question")})
+
+        # Awarded posts are not awarded again.
+        created = awards.create_awards(users=awards.candidates(), limit=1)
+        self.assertEqual(created, [])
+
+        # The batch runs rounds until all earned awards are given.
+        extra = [models.Post.objects.create(title="Question", author=users[0], content="Question",
+                                            type=models.Post.QUESTION) for step in range(2)]
+        models.Post.objects.filter(id__in=[post.id for post in extra]).update(vote_count=3)
+        tasks.batch_create_awards(limit=1)
+        self.assertEqual(models.Award.objects.filter(user=users[0], badge__name="Student").count(), 3)
+
+        # Users that did not visit are candidates when their posts receive votes.
+        past = awards.now() - timedelta(days=10)
+        Profile.objects.filter(user=users[1]).update(last_login=past)
+        models.Post.objects.filter(author=users[1]).update(lastedit_date=past)
+        self.assertFalse(awards.candidates().filter(id=users[1].id).exists())
+        models.Vote.objects.create(author=users[2], post=posts[1], type=models.Vote.UP)
+        self.assertTrue(awards.candidates().filter(id=users[1].id).exists())
+
+        # The command passes its limit to the batch.
+        with patch.object(awards, "create_awards") as create:
+            management.call_command('tasks', action='award', limit=2)
+        self.assertEqual(create.call_args.kwargs["limit"], 2)
 
     def test_comment_traversal(self):
         """Test comment rendering pages"""
@@ -81,6 +137,12 @@ class PostTest(TestCase):
 
         self.assertTrue(response.status_code == 200, 'Error rendering comments')
 
+        # Nested comments are rendered inside the parent comment.
+        html = response.content.decode()
+        start, end = html.index('<div class="comment-list">'), html.index(f'data-value="{comment2.uid}"')
+        self.assertIn(f'data-value="{comment.uid}"', html[start:end], 'Comments rendered out of order')
+        self.assertEqual(html.count('<div'), html.count('</div>'), 'Unbalanced comment tree')
+
     def Xtest_edit_post(self):
         """
         Test post edit for root and descendants
@@ -110,6 +172,424 @@ class PostTest(TestCase):
         response = views.post_view(request=request, uid=self.post.uid)
         return
 
+    def test_thread_cache(self):
+        """
+        Test the cached thread page served to anonymous readers
+        """
+        url = reverse("post_view", kwargs=dict(uid=self.post.uid))
+
+        version = models.thread_version(self.post.uid)
+        key = f"{const.THREAD_PAGE_KEY}-{self.post.uid}-{version}"
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(cache.get(key), response.content)
+
+        # The second reader gets the stored page.
+        response = self.client.get(url)
+        self.assertEqual(cache.get(key), response.content)
+
+        # Adding an answer changes the version of the thread.
+        models.Post.objects.create(title="Answer", author=self.owner, content="Answer content",
+                                   type=models.Post.ANSWER, parent=self.post)
+        self.assertNotEqual(models.thread_version(self.post.uid), version)
+
+        response = self.client.get(url)
+        self.assertIn(b"Answer content", response.content)
+
+    def test_finalize_post(self):
+        """
+        Test the side effects applied after saving a post
+        """
+        with patch("biostar.forum.markdown.parse", wraps=markdown.parse) as parse:
+            post = models.Post.objects.create(title="Tagged", author=self.owner, content="Tagged",
+                                              tag_val="foo,bar", type=models.Post.QUESTION)
+            answer = models.Post.objects.create(title="Answer", author=self.owner, content="Answer",
+                                                type=models.Post.ANSWER, parent=post)
+
+        # The markdown is rendered once per post.
+        self.assertEqual(parse.call_count, 2)
+
+        self.assertEqual(answer.uid, f"9{answer.pk}")
+        self.assertEqual(answer.title, "Answer: Tagged")
+        post.refresh_from_db()
+        self.assertEqual((post.root_id, post.parent_id, post.reply_count), (post.id, post.id, 1))
+        self.assertEqual(post.lastedit_date, answer.lastedit_date)
+        self.assertEqual(set(post.tags.names()), {"foo", "bar"})
+
+        # Top level types under an answer become comments.
+        reply = models.Post.objects.create(title="Reply", author=self.owner, content="Reply",
+                                           type=models.Post.QUESTION, parent=answer)
+        reply.refresh_from_db()
+        self.assertEqual((reply.type, reply.is_toplevel), (models.Post.COMMENT, False))
+
+        # Unchanged tags are left alone.
+        with patch.object(type(post.tags), "set") as tags_set:
+            post.save()
+        tags_set.assert_not_called()
+
+        post.tag_val = "foo"
+        post.save()
+        self.assertEqual(set(post.tags.names()), {"foo"})
+
+    def test_tag_stats(self):
+        """
+        Test the tag statistics maintained as posts are tagged and answered
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            post = models.Post.objects.create(title="Tagged", author=self.owner, content="Tagged",
+                                              tag_val="foo,bar", type=models.Post.QUESTION)
+
+        def stats():
+            values = models.TagStat.objects.filter(tag__name__in=["foo", "bar", "baz"])
+            return {name: (total, answered) for name, total, answered in
+                    values.values_list('tag__name', 'total', 'answered')}
+
+        self.assertEqual(stats(), dict(foo=(1, 0), bar=(1, 0)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            post.tag_val = "bar,baz"
+            post.save()
+        self.assertEqual(stats(), dict(foo=(0, 0), bar=(1, 0), baz=(1, 0)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            models.Post.objects.create(title="Answer", author=self.owner, content="Answer",
+                                       type=models.Post.ANSWER, parent=post)
+        self.assertEqual(stats(), dict(foo=(0, 0), bar=(1, 1), baz=(1, 1)))
+
+        # The nightly rebuild agrees with the maintained counts.
+        expected = stats()
+        models.TagStat.objects.all().delete()
+        management.call_command('tagstats')
+        self.assertEqual(stats(), expected)
+
+        response = self.client.get(reverse('tags_list'), data=dict(query="ba"))
+        self.assertContains(response, "baz")
+
+    def test_tag_search(self):
+        """
+        Test the prefix search over the tags
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            for tags in ["rna-seq,dna", "rna-seq,rna", "rna-seq"]:
+                models.Post.objects.create(title="Tagged", author=self.owner, content="Tagged",
+                                           tag_val=tags, type=models.Post.QUESTION)
+
+        index = autocomplete.TagIndex()
+        self.assertEqual(index.search("RN"), [("rna-seq", 3), ("rna", 1)])
+        self.assertEqual(index.search("rna-"), [("rna-seq", 3)])
+        self.assertEqual(index.search("x"), [])
+
+        # Changed counts of known tags keep the index.
+        version = cache.get(const.TAG_INDEX_KEY)
+        with self.captureOnCommitCallbacks(execute=True):
+            models.Post.objects.create(title="Tagged", author=self.owner, content="Tagged",
+                                       tag_val="dna", type=models.Post.QUESTION)
+        self.assertEqual(cache.get(const.TAG_INDEX_KEY), version)
+
+        # New tags reload the index.
+        with self.captureOnCommitCallbacks(execute=True):
+            models.Post.objects.create(title="Tagged", author=self.owner, content="Tagged",
+                                       tag_val="rnai", type=models.Post.QUESTION)
+        index.checked = 0
+        self.assertEqual(index.search("rna", limit=2), [("rna-seq", 3), ("rna", 1)])
+        self.assertIn(("rnai", 1), index.search("rna"))
+
+        # The kept matches of short prefixes are dropped on reload.
+        self.assertIn(("rnai", 1), index.search("rn"))
+
+        self.client.force_login(self.owner)
+        autocomplete.TAGS.checked = 0
+        response = self.client.get(reverse('tag_search'), data=dict(query="dn"))
+        self.assertEqual(response.json()["tags"], [dict(name="dna", count=2)])
+
+    def test_session_counts(self):
+        """
+        Test the session counts computed from the event totals
+        """
+        counts, totals = auth.get_counts(user=self.owner)
+        self.assertEqual(counts[const.VOTES_COUNT], 0)
+
+        # Votes from others and moderation logs add up until reset.
+        auth.apply_vote(post=self.post, user=self.staff_user, vote_type=models.Vote.UP)
+        auth.apply_vote(post=self.post, user=self.owner, vote_type=models.Vote.BOOKMARK)
+        auth.db_logger(user=self.staff_user, text="moderated")
+        Message.objects.create(sender=self.staff_user, recipient=self.owner,
+                               body=MessageBody.objects.create(body="Hello", html="Hello"))
+        self.owner.profile.refresh_from_db()
+
+        with self.assertNumQueries(1):
+            counts, totals = auth.get_counts(user=self.owner, counts=counts, totals=totals)
+        self.assertEqual((counts[const.VOTES_COUNT], counts[const.MOD_COUNT]), (1, 1))
+
+        # The unread messages are counted in the profile.
+        unread = Message.objects.filter(recipient=self.owner, unread=True).count()
+        self.assertEqual(counts[MESSAGE_COUNT], unread)
+
+        counts[const.VOTES_COUNT] = 0
+        counts, totals = auth.get_counts(user=self.owner, counts=counts, totals=totals)
+        self.assertEqual((counts[const.VOTES_COUNT], counts[const.MOD_COUNT]), (0, 1))
+
+    @override_settings(MESSAGE_BATCH_SIZE=2)
+    def test_notify_followers(self):
+        """
+        Test the batched messages sent to the followers of a post
+        """
+        users = [User.objects.create(username=f"follower{i}", email=f"follower{i}@tested.com")
+                 for i in range(5)]
+        subs = [models.Subscription.objects.create(user=user, post=self.post, type=models.Subscription.LOCAL_MESSAGE)
+                for user in users]
+        tasks.notify_followers(sub_ids=[sub.id for sub in subs], author_id=self.owner.pk, uid=self.post.uid)
+
+        # Every follower gets one message sharing a single body.
+        msgs = Message.objects.filter(sender=self.owner)
+        self.assertEqual(msgs.count(), len(users))
+        self.assertEqual(msgs.values('body').distinct().count(), 1)
+
+        # The unread counts include the bulk inserted messages.
+        for user in users:
+            user.profile.refresh_from_db()
+            unread = Message.objects.filter(recipient=user, unread=True).count()
+            self.assertEqual(user.profile.new_messages, unread)
+
+    @override_settings(SEND_MAIL=True, EMAIL_SEND_RATE=0)
+    def test_mailing_list_edition(self):
+        """
+        Test the mailing list rendered once and sent to each recipient
+        """
+        from django.core import mail
+        from biostar.emailer import sender
+        from biostar.emailer.models import Edition
+        from biostar.accounts.models import Profile
+
+        users = [User.objects.create(username=f"reader{i}", email=f"reader{i}@tested.com")
+                 for i in range(3)]
+        Profile.objects.filter(user__in=users).update(digest_prefs=Profile.ALL_MESSAGES)
+
+        render = sender.EmailTemplate.render
+        with patch.object(sender.EmailTemplate, 'render', autospec=True, side_effect=render) as render:
+            tasks.mailing_list(uid=self.post.uid)
+            tasks.mailing_list(uid=self.post.uid)
+
+        # One render for the post, the second run reuses the edition.
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(Edition.objects.filter(name=f"post-{self.post.uid}").count(), 1)
+        self.assertEqual(len(mail.outbox), 2 * len(users))
+
+        # Every recipient gets a personal unsubscribe link.
+        first, second = [next(m for m in mail.outbox if m.to == [user.email]) for user in users[:2]]
+        url = first.body.split("mailing list: ")[-1].split()[0]
+        self.assertNotIn(url, second.body)
+
+        # Opening the link only asks for a confirmation.
+        self.client.get(url)
+        users[0].profile.refresh_from_db()
+        self.assertEqual(users[0].profile.digest_prefs, Profile.ALL_MESSAGES)
+
+        self.client.post(url)
+        users[0].profile.refresh_from_db()
+        self.assertEqual(users[0].profile.digest_prefs, Profile.NO_DIGEST)
+
+        # Old editions are deleted.
+        from biostar.emailer.tasks import prune_editions
+        Edition.objects.update(date=models.util.now() - models.timedelta(days=30))
+        self.assertEqual(prune_editions(days=7), 1)
+
+    @override_settings(SEND_MAIL=True, EMAIL_SEND_RATE=0)
+    def test_watched_tags(self):
+        """
+        Test the watchers of a post found in the inverted tag index
+        """
+        from django.core import mail
+        from biostar.accounts.models import Profile, WatchedTag
+
+        Profile.objects.filter(user=self.staff_user).update(watched_tags="RNA-seq,dna")
+        self.staff_user.profile.refresh_from_db()
+        self.staff_user.profile.add_watched()
+
+        self.assertEqual(set(WatchedTag.objects.filter(user=self.staff_user).values_list('name', flat=True)),
+                         {"rna-seq", "dna"})
+        self.assertEqual(WatchedTag.watchers(["Rna-Seq", "other"]), {self.staff_user.pk})
+
+        # Removed tags leave the index.
+        Profile.objects.filter(user=self.staff_user).update(watched_tags="dna")
+        self.staff_user.profile.refresh_from_db()
+        self.staff_user.profile.add_watched()
+        self.assertEqual(WatchedTag.watchers(["rna-seq"]), set())
+
+        self.post.tags.add("dna")
+        tasks.notify_watched_tags(uid=self.post.uid, extra_context={})
+        self.assertEqual([email.to for email in mail.outbox], [[self.staff_user.email]])
+
+    def test_reply_counts(self):
+        """
+        Test the reply counts maintained on create, move and delete
+        """
+        answer = models.Post.objects.create(title="Answer", author=self.owner, content="Answer",
+                                            type=models.Post.ANSWER, parent=self.post)
+        comment = models.Post.objects.create(title="Comment", author=self.owner, content="Comment",
+                                             type=models.Post.COMMENT, parent=answer)
+
+        def counts(post):
+            post.refresh_from_db()
+            return post.reply_count, post.answer_count, post.comment_count
+
+        self.assertEqual(counts(self.post), (2, 1, 1))
+        self.assertEqual(counts(answer), (1, 0, 1))
+
+        # Moving the comment to an answer changes both parents.
+        request = fake_request(url="/", data={}, user=self.staff_user)
+        auth.move_to_answer(request=request, post=comment)
+        self.assertEqual(counts(self.post), (2, 2, 0))
+        self.assertEqual(counts(answer), (0, 0, 0))
+
+        answer.delete()
+        self.assertEqual(counts(self.post), (1, 1, 0))
+
+        # The reconciliation finds nothing to fix.
+        self.assertEqual(recount.recount(root_ids=[self.post.id]), [])
+
+        models.Post.objects.filter(id=self.post.id).update(reply_count=10)
+        self.assertEqual(len(recount.recount(root_ids=[self.post.id])), 1)
+        self.assertEqual(counts(self.post), (1, 1, 0))
+
+    def test_listing(self):
+        """
+        Test the post listings maintained on post changes
+        """
+        question = models.Post.objects.create(title="Question", author=self.owner, content="Question",
+                                              type=models.Post.QUESTION)
+        job = models.Post.objects.create(title="Job", author=self.owner, content="Job", type=models.Post.JOB)
+
+        def listed(topic):
+            entries = models.Listing.objects.filter(topic=topic).order_by('-rank', '-post_id')
+            return [post.id for post in views.listed_posts(entries)]
+
+        self.assertEqual(listed(const.LATEST), [job.id, question.id, self.post.id])
+        self.assertEqual(listed("jobs"), [job.id])
+        self.assertEqual(listed(const.OPEN), [question.id, self.post.id])
+
+        # Answered questions leave the open listing, the new answer ranks the question first.
+        models.Post.objects.create(title="Answer", author=self.owner, content="Answer",
+                                   type=models.Post.ANSWER, parent=self.post)
+        self.assertEqual(listed(const.OPEN), [question.id])
+        self.assertEqual(listed(const.LATEST), [self.post.id, job.id, question.id])
+
+        # Closed posts are not listed.
+        request = fake_request(url="/", data={}, user=self.staff_user)
+        moderate.moderate(request=request, post=job, action="close")
+        self.assertEqual(listed("jobs"), [])
+
+        # Spam leaves the listings and comes back when restored.
+        views.mark_spam(request, uid=question.uid)
+        self.assertEqual(listed(const.OPEN), [])
+        views.mark_spam(request, uid=question.uid)
+        self.assertEqual(listed(const.OPEN), [question.id])
+
+        # The latest page is served from the listing.
+        request = fake_request(url=reverse('post_list'), data={}, user=self.owner, method="GET")
+        posts = views.post_list(request, topic=const.LATEST)
+        self.assertEqual([post.id for post in posts], [self.post.id, question.id])
+
+    def test_keyset_pages(self):
+        """
+        Test paging through posts with cursors
+        """
+        for step in range(4):
+            models.Post.objects.create(title=f"Post {step}", author=self.owner, content="Post",
+                                       type=models.Post.QUESTION)
+
+        posts = models.Post.objects.all()
+        expected = list(posts.order_by('-rank', '-id').values_list('id', flat=True))
+        paginator = helpers.KeysetPaginator(object_list=posts, ordering=('-rank', '-id'), per_page=2)
+
+        def ids(page):
+            return [post.id for post in page]
+
+        first = paginator.get_page()
+        second = paginator.get_page(after=first.next_cursor)
+        last = paginator.get_page(after=second.next_cursor)
+        self.assertEqual(ids(first) + ids(second) + ids(last), expected)
+        self.assertFalse(first.has_previous())
+        self.assertFalse(last.has_next())
+        self.assertEqual(paginator.count, len(expected))
+
+        # Moving back returns the same page.
+        self.assertEqual(ids(paginator.get_page(before=last.previous_cursor)), ids(second))
+        self.assertEqual(ids(paginator.get_page(before=second.previous_cursor)), ids(first))
+
+        # Cursors of other orderings start over.
+        other = helpers.KeysetPaginator(object_list=posts, ordering=('-view_count', '-id'), per_page=2)
+        self.assertEqual(ids(paginator.get_page(after=other.get_page().next_cursor)), ids(first))
+        self.assertEqual(ids(paginator.get_page(after="invalid")), ids(first))
+
+        # Annotated keys are compared after grouping.
+        for post, names in zip(posts, ["a", "a,b", "a,b,c"]):
+            post.tags.set(*names.split(","))
+        tags = views.Tag.objects.filter(name__in=["a", "b", "c"]).annotate(nitems=Count('post'))
+        paginator = helpers.KeysetPaginator(object_list=tags, ordering=('-nitems', '-id'), per_page=2)
+        page = paginator.get_page(after=paginator.get_page().next_cursor)
+        self.assertEqual([tag.name for tag in page], ["c"])
+
+        url = reverse('post_topic', kwargs=dict(topic="questions"))
+        response = self.client.get(url, data=dict(order="views", after=first.next_cursor))
+        self.assertEqual(response.status_code, 200)
+
+        # Users that never logged in are reached when paging by visit.
+        for step in range(3):
+            User.objects.create(username=f"visitor{step}", email=f"visitor{step}@tested.com", password="tested")
+        Profile.objects.update(last_login=None)
+
+        users = User.objects.annotate(visited=Coalesce('profile__last_login', 'profile__date_joined'))
+        first = helpers.KeysetPaginator(object_list=users, ordering=('-visited', '-id'), per_page=1).get_page()
+
+        request = fake_request(url=reverse('community_list'), data=dict(after=first.next_cursor),
+                               user=self.owner, method="GET")
+        with patch.object(views, 'render') as render:
+            views.community_list(request)
+        page = render.call_args.kwargs['context']['users']
+        self.assertEqual(len(page), users.count() - 1)
+        self.assertNotIn(first[0].id, [user.id for user in page])
+
+    def test_view_counter(self):
+        """
+        Test buffered post views
+        """
+        other = models.Post.objects.create(title="Other", author=self.owner, content="Other",
+                                           type=models.Post.QUESTION)
+        counter = models.ViewCounter(size=3, interval=3600)
+        counter.add(post_id=self.post.id, ip="127.0.0.1")
+        counter.add(post_id=self.post.id, ip="127.0.0.2")
+
+        # Nothing is written until the buffer fills up.
+        self.assertEqual(models.PostView.objects.count(), 0)
+
+        counter.add(post_id=other.id, ip="127.0.0.1")
+
+        self.assertEqual(models.PostView.objects.count(), 3)
+        self.post.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((self.post.view_count, other.view_count), (2, 1))
+        self.assertEqual(counter.flush(), 0)
+
+        # The timer thread starts once and the buffer is flushed at exit.
+        counter = models.ViewCounter(size=3, interval=3600, timer=True)
+        with patch.object(models.atexit, 'register') as register, patch.object(counter, 'run'):
+            counter.add(post_id=self.post.id, ip="127.0.0.1")
+            counter.add(post_id=self.post.id, ip="127.0.0.2")
+        register.assert_called_once_with(counter.flush)
+        self.assertEqual(len(counter.hits), 2)
+
+        # Under uWSGI the buffer is also flushed when a worker is reloaded.
+        uwsgi = types.SimpleNamespace(atexit=None)
+        counter = models.ViewCounter(size=3, interval=3600, timer=True)
+        with patch.dict('sys.modules', uwsgi=uwsgi), patch.object(models.atexit, 'register'), \
+                patch.object(counter, 'run'):
+            counter.add(post_id=self.post.id, ip="127.0.0.1")
+        uwsgi.atexit()
+        self.assertEqual(counter.hits, [])
+        self.assertEqual(models.PostView.objects.count(), 4)
+
     @override_settings(DEBUG=TEST_DEBUG)
     def test_populate(self):
         "Test forum populating "
@@ -181,4 +661,75 @@ class PostSearchTest(TestCase):
 
         search.print_info()
         # TODO: put back in
-        #self.assertTrue(len(whoosh_search), f"Whoosh search returned no results. At least {self.limit} expected")
\ No newline at end of file
+        #self.assertTrue(len(whoosh_search), f"Whoosh search returned no results. At least {self.limit} expected")
+    def test_index_queue(self):
+        """
+        Test applying the queued post changes to the index.
+        """
+        from whoosh.writing import BufferedWriter
+
+        # Edits to the same post are coalesced.
+        self.post.save()
+        self.post.save()
+
+        ix = search.init_index()
+        writer = BufferedWriter(ix, period=None, limit=100)
+        search.process_queue(writer=writer)
+        writer.close()
+
+        self.assertFalse(models.IndexQueue.objects.exists(), "Queued changes were not processed.")
+        self.assertTrue(models.Post.objects.get(pk=self.post.pk).indexed, "Post was not indexed.")
+
+        # Deleted posts are removed from the index.
+        uid = self.post.uid
+        self.post.delete()
+        writer = BufferedWriter(ix, period=None, limit=100)
+        search.process_queue(writer=writer)
+        writer.close()
+
+        found = search.whoosh_search(query=uid, fields=['uid'])
+        self.assertFalse(len(found), "Deleted post was not removed from the index.")
+        search.POOL.release(found.results.searcher)
+
+    def test_searcher_pool(self):
+        """
+        Test that searchers are reused until the index changes.
+        """
+        pool = search.SearcherPool(size=1)
+        search.process_queue(writer=pool.index().writer())
+
+        searcher = pool.acquire()
+        pool.release(searcher)
+        self.assertIs(pool.acquire(), searcher, "Searcher was not reused.")
+
+        # A commit bumps the index generation.
+        self.post.save()
+        search.process_queue(writer=pool.index().writer())
+        pool.release(searcher)
+        self.assertTrue(pool.acquire().up_to_date(), "Searcher was not refreshed.")
+
+    def test_search_cache(self):
+        """
+        Test that search results are cached until the index changes.
+        """
+        key = search.search_cache_key(query="Test  post", page=1, fields=None, reverse=False, sortedby=[], limit=10)
+        search.perform_search(query="Test post", limit=10)
+        self.assertIsNotNone(search.cache.get(key), "Search results were not cached.")
+
+        # Committing to the index expires the results.
+        search.process_queue(writer=search.POOL.index().writer())
+        newkey = search.search_cache_key(query="Test post", page=1, fields=None, reverse=False, sortedby=[], limit=10)
+        self.assertNotEqual(key, newkey, "Index commit did not change the cache key.")
+
+    def test_similar_posts(self):
+        """
+        Test precomputing the similar posts.
+        """
+        search.process_queue(writer=search.POOL.index().writer())
+        management.call_command('similar')
+
+        stored = models.SimilarPosts.objects.filter(uid=self.post.uid).first()
+        self.assertTrue(stored, "Similar posts were not computed.")
+
+        similar = search.get_similar(uid=self.post.uid)
+        self.assertNotIn(self.post, similar, "Post should not be similar to itself.")
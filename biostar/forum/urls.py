@@ -62,6 +62,7 @@ forum_patterns = [
     # Community urls
     path('user/list/', views.community_list, name='community_list'),
     path('ajax/handle/search/', ajax.handle_search, name='handle_search'),
+    path('ajax/tag/search/', ajax.tag_search, name='tag_search'),
 
     # Api calls
     path(r'api/traffic/', api.traffic, name='api_traffic'),
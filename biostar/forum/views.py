@@ -10,7 +10,8 @@ from django.contrib.auth.decorators import login_required
 from django.core.cache import cache
 from django.core.paginator import Paginator
 from django.db.models import Count, Q
-from django.http import Http404
+from django.db.models.functions import Coalesce
+from django.http import Http404, HttpResponse
 from django.shortcuts import render, redirect, reverse
 from django.views.decorators.csrf import ensure_csrf_cookie
 from taggit.models import Tag
@@ -19,8 +20,9 @@ from biostar.accounts.models import Profile
 from biostar.forum import forms, auth, tasks, util, search, models, moderate
 from biostar.forum.const import *
 
-from biostar.forum.models import Post, Vote, Badge, Subscription, Log
+from biostar.forum.models import Post, Vote, Badge, Subscription, Log, Listing, TagStat
 from biostar.utils.decorators import is_moderator, check_params, reset_count, is_staff, authenticated
+from biostar.utils.helpers import KeysetPaginator
 
 User = get_user_model()
 
@@ -32,17 +34,10 @@ CREATE_PARAMS = {'title', 'tag_val'}
 CREATE_PARAMS.update(ALLOWED_PARAMS)
 
 # Valid post values as they correspond to database post types.
-POST_TYPE = dict(
-    question=Post.QUESTION,
-    jobs=Post.JOB,
-    tutorials=Post.TUTORIAL,
-    forum=Post.FORUM,
-    planet=Post.BLOG,
-    tools=Post.TOOL,
-    news=Post.NEWS,
-    pages=Post.PAGE,
-    herald=Post.HERALD
-)
+POST_TYPE = Listing.TOPIC_TYPES
+
+# Post orderings paginated by seeking past the sort keys of the previous page.
+SEEK_ORDERS = {RANK, UPDATE, ANSWERS, CREATION, BOOKED, VIEWS, REPLIES, VOTES}
 
 LIMIT_MAP = dict(
     all=0,
@@ -104,6 +99,19 @@ class CachedPaginator(Paginator):
         return value
 
 
+def listed_posts(entries):
+    """
+    Returns the posts of the listing entries, in the order of the entries.
+    """
+    ids = [entry.post_id for entry in entries]
+
+    # A single query fetches the posts with the information used during rendering.
+    posts = Post.objects.filter(id__in=ids).select_related("root", "author__profile", "lastedit_user__profile")
+    order = {pk: index for index, pk in enumerate(ids)}
+
+    return sorted(posts, key=lambda post: order[post.id])
+
+
 def apply_sort(posts, limit=None, order=None):
     # Apply post ordering.
     if ORDER_MAPPER.get(order):
@@ -277,6 +285,8 @@ def post_list(request, topic=None, tag="", cutoff=None, ordering=None):
 
     # Parse the GET parameters for filtering information
     page = request.GET.get('page', 1)
+    after = request.GET.get('after')
+    before = request.GET.get('before')
     order = request.GET.get("order", ordering) or 'rank'
     topic = topic or request.GET.get("type", LATEST) or LATEST
     limit = request.GET.get("limit", "all") or "all"
@@ -291,8 +301,24 @@ def post_list(request, topic=None, tag="", cutoff=None, ordering=None):
         # Create the cache key only with latest topic
         cache_key = f"{LATEST}-{order}-{limit}" if topic is LATEST else ''
 
+    # Public topics in the default order are read from the listings.
+    listed = not tag and topic in Listing.TOPICS and order == RANK and LIMIT_MAP.get(limit, 0) == 0
+    seek = not cutoff and (order in SEEK_ORDERS or order not in ORDER_MAPPER)
+
+    if listed:
+        entries = Listing.objects.filter(topic=topic)
+        paginator = KeysetPaginator(object_list=entries, ordering=('-rank', '-post_id'), cache_key=cache_key,
+                                    per_page=settings.POSTS_PER_PAGE, fetch=listed_posts)
+        return paginator.get_page(after=after, before=before)
+
     posts = apply_sort(posts, limit=limit, order=order)
 
+    if seek:
+        ordering = (ORDER_MAPPER.get(order, '-rank'), '-id')
+        paginator = KeysetPaginator(object_list=posts, ordering=ordering, cache_key=cache_key,
+                                    per_page=settings.POSTS_PER_PAGE)
+        return paginator.get_page(after=after, before=before)
+
     # Institute a cutoff
     if cutoff:
         posts = posts[:cutoff]
@@ -341,8 +367,7 @@ def post_topic(request, topic):
     Show list of posts of a given type
     """
 
-    # Set the cache key based on order and limit
-    posts = post_list(request, topic=topic, cutoff=1000)
+    posts = post_list(request, topic=topic)
 
     # Clear topic if there are no posts.
     topic = topic if posts else ''
@@ -405,18 +430,19 @@ def myvotes(request):
     """
     Show posts by user that received votes
     """
-    page = request.GET.get('page', 1)
+    after = request.GET.get('after')
+    before = request.GET.get('before')
 
     votes = Vote.objects.filter(post__author=request.user).select_related('post', 'post__root',
-                                                                          'author__profile').order_by("-date")
+                                                                          'author__profile')
     # Create the paginator
-    paginator = CachedPaginator(object_list=votes,
+    paginator = KeysetPaginator(object_list=votes, ordering=('-date', '-id'),
                                 per_page=settings.POSTS_PER_PAGE)
 
     # Apply the votes paging.
-    votes = paginator.get_page(page)
+    votes = paginator.get_page(after=after, before=before)
 
-    context = dict(votes=votes, page=page, tab='myvotes')
+    context = dict(votes=votes, tab='myvotes')
     return render(request, template_name="user_votes.html", context=context)
 
 
@@ -425,24 +451,23 @@ def tags_list(request):
     """
     Show posts by user
     """
-    page = request.GET.get('page', 1)
+    after = request.GET.get('after')
+    before = request.GET.get('before')
     query = request.GET.get('query', '')
 
-    count = Count('post', filter=Q(post__is_toplevel=True))
-
-    db_query = Q(name__icontains=query) if query else Q()
+    db_query = Q(tag__name__icontains=query) if query else Q()
     cache_key = '' if query else TAGS_CACHE_KEY
 
-    tags = Tag.objects.annotate(nitems=count).filter(db_query)
-    tags = tags.order_by('-nitems')
+    tags = TagStat.objects.filter(db_query).select_related('tag')
 
     # Create the paginator
-    paginator = CachedPaginator(cache_key=cache_key,
+    paginator = KeysetPaginator(cache_key=cache_key,
                                 object_list=tags,
+                                ordering=('-total', '-id'),
                                 per_page=settings.POSTS_PER_PAGE)
 
-    # Apply the votes paging.
-    tags = paginator.get_page(page)
+    # Apply the tags paging.
+    tags = paginator.get_page(after=after, before=before)
 
     context = dict(tags=tags, tab='tags', query=query)
 
@@ -451,7 +476,8 @@ def tags_list(request):
 
 @check_params(allowed=ALLOWED_PARAMS)
 def community_list(request):
-    page = request.GET.get("page", 1)
+    after = request.GET.get('after')
+    before = request.GET.get('before')
     ordering = request.GET.get("order", "visit")
     limit_to = request.GET.get("limit", "time")
     query = request.GET.get('query', '')
@@ -469,13 +495,17 @@ def community_list(request):
                    Q(username__icontains=query) | Q(email__icontains=query)
         users = users.filter(db_query)
 
-    order = ORDER_MAPPER.get(ordering, "visit")
+    order = ORDER_MAPPER.get(ordering, ORDER_MAPPER[VISIT])
     users = users.filter(profile__state__in=[Profile.NEW, Profile.TRUSTED])
-    users = users.order_by(order)
+
+    # The keys of the pages may not be null, users that never logged in sort by the date they joined.
+    if order == ORDER_MAPPER[VISIT]:
+        users = users.annotate(visited=Coalesce('profile__last_login', 'profile__date_joined'))
+        order = '-visited'
 
     # Create the paginator (six users per row)
-    paginator = CachedPaginator(object_list=users, per_page=60)
-    users = paginator.get_page(page)
+    paginator = KeysetPaginator(object_list=users, ordering=(order, '-id'), per_page=60)
+    users = paginator.get_page(after=after, before=before)
     context = dict(tab="community", users=users, query=query, order=ordering, limit=limit_to)
 
     return render(request, "community_list.html", context=context)
@@ -533,6 +563,15 @@ def post_view(request, uid):
     if post.is_spam and user.is_anonymous:
         raise Http404("Post does not exist.")
 
+    # Anonymous readers are served the cached page, unless there are messages to display.
+    cacheable = user.is_anonymous and request.method == "GET" and not messages.get_messages(request)
+    cache_key = f"{THREAD_PAGE_KEY}-{post.uid}-{models.thread_version(post.uid)}" if cacheable else ''
+    html = cache.get(cache_key) if cache_key else None
+
+    if html is not None:
+        models.update_post_views(post=post, request=request, timeout=settings.POST_VIEW_TIMEOUT)
+        return HttpResponse(html)
+
     # Form used for answers
     form = forms.PostShortForm(user=request.user, post=post)
 
@@ -552,7 +591,13 @@ def post_view(request, uid):
 
     context = dict(post=root, tree=comment_tree, form=form, answers=answers)
 
-    return render(request, "post_view.html", context=context)
+    response = render(request, "post_view.html", context=context)
+
+    # Store the page for the next anonymous reader.
+    if cache_key:
+        cache.set(cache_key, response.content, settings.THREAD_CACHE_TIMEOUT)
+
+    return response
 
 
 @check_params(allowed=CREATE_PARAMS)
@@ -2,6 +2,7 @@ import logging
 
 import toml as hjson
 import mistune
+from functools import partial
 import urllib.parse
 import base64
 from django.db import models
@@ -12,6 +13,7 @@ from django.urls import reverse
 from django.utils import timezone
 from django.conf import settings
 from biostar.accounts.models import User
+from biostar.utils.helpers import RENDERS
 from . import util
 from .const import *
 
@@ -28,10 +30,9 @@ class Bunch(object):
 
 
 def make_html(text, user=None):
-    if user and user.profile.trusted:
-        html = mistune.markdown(text, escape=False)
-    else:
-        html = mistune.markdown(text, escape=True)
+    escape = not (user and user.profile.trusted)
+    func = partial(mistune.markdown, escape=escape)
+    html = RENDERS.render(text, func, version=mistune.__version__, escape=escape)
     return html
 
 
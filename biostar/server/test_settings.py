@@ -4,6 +4,9 @@ from .settings import *
 
 TASK_RUNNER = "block"
 
+# Post views are written when the buffer fills up.
+POST_VIEW_TIMER = False
+
 INIT_PLANET = False
 
 # Skip hitting the spam indexe when creating test posts
@@ -218,6 +218,12 @@ TASK_RUNNER = 'block'
 
 TASK_MODULES = []
 
+# Rendered markdown kept in memory by each process.
+RENDER_CACHE_SIZE = 1000
+
+# Cache alias that shares rendered markdown between processes (optional).
+RENDER_CACHE_BACKEND = None
+
 # The email delivery engine.
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
@@ -2,13 +2,24 @@ from django.contrib.messages.storage import fallback
 from django.test import RequestFactory, client
 from django.conf import settings
 import logging
+import base64
+import binascii
+import hashlib
+import json
+import threading
 import traceback
+from collections import OrderedDict
+from collections.abc import Sequence
 import html
 import html2markdown
 from datetime import datetime
+from itertools import islice
 from biostar import VERSION
 import os
 import uuid
+from django.core.cache import cache, caches
+from django.core.exceptions import ValidationError
+from django.db.models import Q
 
 logger = logging.getLogger('engine')
 
@@ -17,6 +28,18 @@ def get_uuid(limit=32):
     return str(uuid.uuid4())[:limit]
 
 
+def chunked(stream, size):
+    """
+    Yields lists of up to size elements from the stream.
+    """
+    stream = iter(stream)
+    while True:
+        chunk = list(islice(stream, size))
+        if not chunk:
+            return
+        yield chunk
+
+
 def fake_request(url, data, user, method="POST", rmeta={}):
     "Make a fake request; defaults to POST."
 
@@ -79,3 +102,213 @@ def ip_triplet(request):
     ips = oip.split(".")[:-1]
     ip = ".".join(ips)
     return ip
+
+
+class RenderCache:
+    """
+    Caches rendered html under a hash of the source text, the render options and the renderer version.
+    The most recent renders are kept in memory, a shared cache backend may be configured as well.
+    """
+
+    def __init__(self, size=None, backend=None):
+        self.lock = threading.Lock()
+        self.store = OrderedDict()
+        self.size = size
+        self.backend = backend
+
+    def shared(self):
+        alias = self.backend or settings.RENDER_CACHE_BACKEND
+        return caches[alias] if alias else None
+
+    @staticmethod
+    def key(text, version, **options):
+        params = sorted(options.items())
+        digest = hashlib.sha1(f"{version}|{params}|{text}".encode("utf-8")).hexdigest()
+        return f"render-{digest}"
+
+    def remember(self, key, html):
+        size = self.size or settings.RENDER_CACHE_SIZE
+        with self.lock:
+            self.store[key] = html
+            self.store.move_to_end(key)
+            while len(self.store) > size:
+                self.store.popitem(last=False)
+
+    def get(self, key):
+        with self.lock:
+            if key in self.store:
+                self.store.move_to_end(key)
+                return self.store[key]
+
+        shared = self.shared()
+        html = shared.get(key) if shared else None
+        if html is not None:
+            self.remember(key, html)
+
+        return html
+
+    def set(self, key, html):
+        self.remember(key, html)
+        shared = self.shared()
+        if shared:
+            shared.set(key, html)
+
+    def clear(self):
+        with self.lock:
+            self.store.clear()
+
+    def render(self, text, func, version, **options):
+        """
+        Returns the cached html of the text, calls func(text) on a miss.
+        The options must contain every parameter that changes the output of func.
+        """
+        key = self.key(text, version, **options)
+        html = self.get(key)
+
+        if html is None:
+            html = func(text)
+            self.set(key, html)
+
+        return html
+
+
+# Renders shared by all apps of the process.
+RENDERS = RenderCache()
+
+
+class KeysetPage(Sequence):
+    """
+    A page of a keyset paginator, links to the neighbouring pages with cursors instead of page numbers.
+    """
+    keyset = True
+
+    def __init__(self, object_list, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return bool(self.next_cursor)
+
+    def has_previous(self):
+        return bool(self.previous_cursor)
+
+
+class KeysetPaginator:
+    """
+    Paginates a queryset by seeking past the sort keys of the last row shown instead of skipping
+    an offset, deep pages cost as much as the first one.
+    The last key of the ordering must be unique, for example ('-rank', '-id').
+    The keys may not be null, coalesce nullable fields into an annotation and order by that.
+    """
+
+    # Time to live for the cached count, in seconds
+    TTL = 300
+
+    def __init__(self, object_list, ordering, per_page, cache_key='', fetch=None):
+        self.object_list = object_list
+        self.ordering = list(ordering)
+        self.per_page = per_page
+
+        # May not contain spaces
+        self.cache_key = ''.join(cache_key.split())
+
+        # Optionally maps the rows of a page to the objects that are shown.
+        self.fetch = fetch
+
+    @property
+    def count(self):
+        value = cache.get(self.cache_key) if self.cache_key else None
+        if value is None:
+            value = self.object_list.count()
+            if self.cache_key:
+                cache.set(self.cache_key, value, self.TTL)
+        return value
+
+    @staticmethod
+    def value(row, name):
+        # Follow the relations of the key, annotations are attributes of the row.
+        for attr in name.split('__'):
+            row = getattr(row, attr)
+        return row
+
+    def cursor(self, row):
+        values = [str(self.value(row, key.lstrip('-'))) for key in self.ordering]
+        data = json.dumps([self.ordering, values]).encode('utf-8')
+        return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+    def decode(self, cursor):
+        """
+        Returns the key values stored in the cursor, None for invalid cursors or other orderings.
+        """
+        try:
+            data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            ordering, values = json.loads(data)
+        except (ValueError, TypeError, binascii.Error):
+            return None
+
+        if ordering != self.ordering or len(values) != len(ordering):
+            return None
+
+        return values
+
+    def seek(self, values, forward=True):
+        """
+        Matches the rows past the key values, in the direction of the ordering when moving forward.
+        """
+        names = [key.lstrip('-') for key in self.ordering]
+        query = Q()
+        for index, key in enumerate(self.ordering):
+            lookup = 'lt' if key.startswith('-') == forward else 'gt'
+            cond = Q(**{f"{names[index]}__{lookup}": values[index]})
+            for name, value in zip(names[:index], values):
+                cond &= Q(**{name: value})
+            query |= cond
+        return query
+
+    def rows(self, values, forward):
+        ordering = self.ordering
+        if not forward:
+            ordering = [key[1:] if key.startswith('-') else f"-{key}" for key in ordering]
+
+        rows = self.object_list.order_by(*ordering)
+        if values:
+            rows = rows.filter(self.seek(values, forward=forward))
+
+        return list(rows[:self.per_page + 1])
+
+    def get_page(self, after=None, before=None):
+        """
+        Returns the page following the after cursor or preceding the before cursor.
+        """
+        forward = not before
+        values = self.decode(before or after or '')
+
+        try:
+            rows = self.rows(values=values, forward=forward)
+        except (ValidationError, ValueError):
+            # Cursor values that do not fit the keys start from the beginning.
+            values, forward = None, True
+            rows = self.rows(values=values, forward=forward)
+
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not forward:
+            rows.reverse()
+
+        has_next = more if forward else bool(values)
+        has_previous = bool(values) if forward else more
+
+        next_cursor = self.cursor(rows[-1]) if has_next and rows else None
+        previous_cursor = self.cursor(rows[0]) if has_previous and rows else None
+
+        objects = self.fetch(rows) if self.fetch else rows
+
+        return KeysetPage(objects, paginator=self, next_cursor=next_cursor, previous_cursor=previous_cursor)
@@ -16,4 +16,10 @@ export DJANGO_SETTINGS_MODULE=conf.run.site_settings
 python manage.py cleanup
 
 # Clear site sessions
-python manage.py clearsessions
\ No newline at end of file
+python manage.py clearsessions
+
+# Move the recent window of the tag statistics.
+python manage.py tagstats
+
+# Give the awards earned by the recently active users.
+python manage.py tasks --action award